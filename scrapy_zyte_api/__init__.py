@@ -5,6 +5,7 @@ if _NEEDS_EARLY_REACTOR:
 
     install_reactor("twisted.internet.asyncioreactor.AsyncioSelectorReactor")
 
+from ._cache import ScrapyZyteAPICacheStorage  # NOQA
 from ._downloader_middleware import ScrapyZyteAPIDownloaderMiddleware  # NOQA
 from ._request_fingerprinter import ScrapyZyteAPIRequestFingerprinter  # NOQA
 from .handler import ScrapyZyteAPIDownloadHandler  # NOQA
@@ -0,0 +1,183 @@
+import gzip
+import os
+from collections import OrderedDict
+from logging import getLogger
+from time import time
+from typing import Optional, Set, Union
+
+from scrapy import Request, Spider
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.project import data_path
+
+from ._json import _load_json_codec
+from ._request_fingerprinter import ScrapyZyteAPIRequestFingerprinter
+from .responses import (
+    ZyteAPIMixin,
+    ZyteAPIResponse,
+    ZyteAPITextResponse,
+    _process_response,
+)
+
+logger = getLogger(__name__)
+
+_REVALIDATION_META_KEY = "_zyte_api_cache_revalidation"
+_SUFFIX = ".json.gz"
+
+
+class ScrapyZyteAPICacheStorage:
+    """HTTP cache storage backend that stores raw Zyte API responses on disk,
+    compressed, keyed by the fingerprints of
+    :class:`~scrapy_zyte_api.ScrapyZyteAPIRequestFingerprinter`.
+
+    Responses that do not come from Zyte API are not cached.
+    """
+
+    def __init__(self, settings):
+        if ScrapyZyteAPIRequestFingerprinter is None:
+            raise NotConfigured(
+                "ScrapyZyteAPICacheStorage requires Scrapy 2.7 or higher."
+            )
+        self._cache_dir = data_path(settings["HTTPCACHE_DIR"])
+        self._ttl = settings.getint("HTTPCACHE_EXPIRATION_SECS")
+        self._max_size = settings.getint("ZYTE_API_CACHE_MAX_SIZE", 0)
+        self._stale_while_revalidate = settings.getint(
+            "ZYTE_API_CACHE_STALE_WHILE_REVALIDATE", 0
+        )
+        # Entry sizes by key, from least to most recently used.
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._size = 0
+        self._revalidating: Set[str] = set()
+        self._json_codec = _load_json_codec(settings)
+
+    def open_spider(self, spider: Spider):
+        crawler = spider.crawler
+        fingerprinter = getattr(crawler, "request_fingerprinter", None)
+        if not isinstance(fingerprinter, ScrapyZyteAPIRequestFingerprinter):
+            fingerprinter = ScrapyZyteAPIRequestFingerprinter.from_crawler(crawler)
+        self._fingerprinter = fingerprinter
+        self._stats = crawler.stats
+        self._spider_dir = os.path.join(self._cache_dir, spider.name)
+        os.makedirs(self._spider_dir, exist_ok=True)
+        self._load_index()
+        logger.debug(
+            f"Using Zyte API cache storage in {self._spider_dir} "
+            f"({len(self._index)} entries, {self._size} bytes)"
+        )
+
+    def close_spider(self, spider: Spider):
+        pass
+
+    def _load_index(self):
+        entries = []
+        for entry in os.scandir(self._spider_dir):
+            if not entry.name.endswith(_SUFFIX):
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, entry.name[: -len(_SUFFIX)], stat.st_size))
+        self._index.clear()
+        self._size = 0
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._size += size
+
+    def _key(self, request: Request) -> str:
+        return self._fingerprinter.fingerprint(request).hex()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._spider_dir, f"{key}{_SUFFIX}")
+
+    def _remove(self, key: str):
+        self._size -= self._index.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def retrieve_response(
+        self, spider: Spider, request: Request
+    ) -> Optional[Union[ZyteAPITextResponse, ZyteAPIResponse]]:
+        """Return response if present in cache, or None otherwise."""
+        if request.meta.get(_REVALIDATION_META_KEY, False):
+            return None
+        key = self._key(request)
+        if key not in self._index:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                entry = self._json_codec.loads(gzip.decompress(f.read()))
+            ttl = float(entry["ttl"])
+            age = time() - float(entry["timestamp"])
+            raw_api_response = entry["response"]
+        except (OSError, ValueError, KeyError, TypeError):
+            # Unreadable, corrupt or otherwise malformed entry.
+            self._remove(key)
+            return None
+
+        if 0 < ttl < age:
+            if age > ttl + self._stale_while_revalidate:
+                self._remove(key)
+                self._stats.inc_value("scrapy-zyte-api/cache/expired")
+                return None
+            self._stats.inc_value("scrapy-zyte-api/cache/stale")
+            self._revalidate(spider, request, key)
+
+        self._index.move_to_end(key)
+        os.utime(path)
+        return _process_response(raw_api_response, request)
+
+    def store_response(self, spider: Spider, request: Request, response):
+        """Store the given response in the cache."""
+        if not isinstance(response, ZyteAPIMixin):
+            return
+        raw_api_response = response.raw_api_response
+        if raw_api_response is None:
+            return
+        entry = {
+            "timestamp": time(),
+            "ttl": request.meta.get("zyte_api_cache_ttl", self._ttl),
+            "response": raw_api_response,
+        }
+        data = gzip.compress(self._json_codec.dumps(entry).encode())
+        key = self._key(request)
+        path = self._path(key)
+        # Write to a temporary file first, so that concurrent readers never
+        # see partially-written entries.
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+        self._size += len(data) - self._index.pop(key, 0)
+        self._index[key] = len(data)
+        self._evict()
+
+    def _evict(self):
+        if not self._max_size:
+            return
+        while self._size > self._max_size and self._index:
+            key = next(iter(self._index))
+            self._remove(key)
+            self._stats.inc_value("scrapy-zyte-api/cache/evictions")
+
+    def _revalidate(self, spider: Spider, request: Request, key: str):
+        if key in self._revalidating:
+            return
+        self._revalidating.add(key)
+        meta = {**request.meta, _REVALIDATION_META_KEY: True}
+        revalidation_request = request.replace(meta=meta, dont_filter=True)
+
+        def log_failure(failure):
+            logger.warning(
+                f"Could not revalidate the cached response of {request}: "
+                f"{failure.value}"
+            )
+
+        def done(_):
+            self._revalidating.discard(key)
+
+        # The response goes through the HTTP cache downloader middleware,
+        # which stores it, but not through the spider.
+        deferred = spider.crawler.engine.download(revalidation_request)
+        deferred.addErrback(log_failure)
+        deferred.addBoth(done)
@@ -0,0 +1,173 @@
+from collections import deque
+from logging import getLogger
+from time import monotonic
+from typing import Deque, Dict, Optional, Set
+
+from scrapy.statscollectors import StatsCollector
+
+logger = getLogger(__name__)
+
+# Zyte API response status codes that mean that the target website could not
+# be downloaded, e.g. because it is down or banning requests.
+_TARGET_ERROR_STATUSES = frozenset((520, 521))
+
+_CLOSED = "closed"
+_OPEN = "open"
+_HALF_OPEN = "half-open"
+
+
+class _Circuit:
+    def __init__(self):
+        self.state = _CLOSED
+        self.failures: Deque[float] = deque()
+        self.opened_at = 0.0
+        self.probes = 0
+        # Set to a new value every time the circuit opens, so that the outcome
+        # of a probe allowed before that is ignored.
+        self.epoch = 0
+
+
+class _Permit:
+    """Returned by :meth:`_CircuitBreaker.allow` for an allowed Zyte API
+    request. *probe* is the epoch of the circuit that allowed the request as
+    a probe, or ``None`` if the request is not a probe."""
+
+    __slots__ = ("domain", "probe")
+
+    def __init__(self, domain: str, probe: Optional[int] = None):
+        self.domain = domain
+        self.probe = probe
+
+
+class _CircuitBreaker:
+    """Tracks, per target domain, failed Zyte API requests, and stops Zyte API
+    requests to a domain once *max_failures* of them fail within *window*
+    seconds.
+
+    After *cooldown* seconds, up to *probes* requests to the domain are
+    allowed at a time. If one of them succeeds, requests are allowed again;
+    if one of them fails, requests are stopped for another *cooldown*
+    seconds.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_failures: int = 10,
+        window: float = 60.0,
+        cooldown: float = 60.0,
+        probes: int = 1,
+    ):
+        if max_failures < 1 or probes < 1:
+            raise ValueError(
+                f"The maximum number of failures and the number of probe "
+                f"requests of a circuit breaker must be 1 or higher, got "
+                f"{max_failures} and {probes}."
+            )
+        self._max_failures = max_failures
+        self._window = window
+        self._cooldown = cooldown
+        self._probes = probes
+        # Circuits are only kept while open, half-open, or with failures
+        # within the window, so that memory usage does not grow with the
+        # number of domains.
+        self._circuits: Dict[str, _Circuit] = {}
+        # Shared by all circuits, so that epochs are never reused, even by a
+        # circuit removed and created again.
+        self._epoch = 0
+        # Domains with a state stat.
+        self._state_stats: Set[str] = set()
+        self.opened = 0
+
+    def allow(self, domain: str) -> Optional[_Permit]:
+        """Returns ``None`` if a Zyte API request to *domain* may not be sent.
+
+        Otherwise, returns a permit that must be passed to :meth:`record`
+        once the request finishes, whatever its outcome."""
+        circuit = self._circuits.get(domain)
+        if circuit is None or circuit.state == _CLOSED:
+            return _Permit(domain)
+        if circuit.state == _OPEN:
+            if monotonic() - circuit.opened_at < self._cooldown:
+                return None
+            circuit.state = _HALF_OPEN
+        if circuit.probes >= self._probes:
+            return None
+        circuit.probes += 1
+        return _Permit(domain, circuit.epoch)
+
+    def record(self, permit: _Permit, failed: Optional[bool]):
+        """Records the outcome of the Zyte API request allowed with *permit*:
+        a failure to download the target website (``True``), a success
+        (``False``), or an error unrelated to the target website (``None``),
+        e.g. a Zyte API rate limiting response or a request that was never
+        sent, which does not count either way."""
+        domain = permit.domain
+        circuit = self._circuits.get(domain)
+        if permit.probe is not None:
+            if circuit is None or permit.probe != circuit.epoch:
+                # The circuit opened again, or closed, while the probe was in
+                # flight.
+                return
+            circuit.probes -= 1
+            if failed:
+                self._open(domain, circuit)
+            elif failed is False:
+                logger.info(f"Resuming Zyte API requests to {domain}.")
+                del self._circuits[domain]
+            return
+        if circuit is None:
+            if not failed:
+                return
+            circuit = self._circuits[domain] = _Circuit()
+        # Outcomes of requests allowed before the circuit opened are ignored.
+        if circuit.state != _CLOSED or not failed:
+            return
+        now = monotonic()
+        circuit.failures.append(now)
+        self._expire_failures(circuit, now)
+        if len(circuit.failures) >= self._max_failures:
+            self._open(domain, circuit)
+
+    def _expire_failures(self, circuit: _Circuit, now: float):
+        while circuit.failures and circuit.failures[0] <= now - self._window:
+            circuit.failures.popleft()
+
+    def _open(self, domain: str, circuit: _Circuit):
+        logger.warning(
+            f"Too many Zyte API requests to {domain} failed, not sending "
+            f"more for {self._cooldown} seconds."
+        )
+        circuit.state = _OPEN
+        circuit.opened_at = monotonic()
+        circuit.failures.clear()
+        circuit.probes = 0
+        self._epoch += 1
+        circuit.epoch = self._epoch
+        self.opened += 1
+
+    def update_stats(self, stats: StatsCollector, prefix: str):
+        """Updates stats, and removes closed circuits without failures within
+        the window."""
+        prefix = f"{prefix}/circuit_breaker"
+        now = monotonic()
+        open_domains = set()
+        for domain, circuit in list(self._circuits.items()):
+            if circuit.state != _CLOSED:
+                open_domains.add(domain)
+                continue
+            self._expire_failures(circuit, now)
+            if not circuit.failures:
+                del self._circuits[domain]
+        stats.set_value(f"{prefix}/opened", self.opened)
+        stats.set_value(f"{prefix}/open", len(open_domains))
+        for domain in open_domains:
+            stats.set_value(f"{prefix}/state/{domain}", self._circuits[domain].state)
+        closed_domains = self._state_stats - open_domains
+        if closed_domains:
+            # StatsCollector has no API to remove a stat, but get_stats()
+            # returns the underlying dictionary.
+            all_stats = stats.get_stats()
+            for domain in closed_domains:
+                all_stats.pop(f"{prefix}/state/{domain}", None)
+        self._state_stats = open_domains
@@ -0,0 +1,125 @@
+import asyncio
+from heapq import heapify, heappop, heappush
+from itertools import count
+from time import monotonic
+from typing import List, Tuple
+
+from zyte_api.stats import AggStats
+
+
+class _ConcurrencyLimiter:
+    """Limits the number of concurrent Zyte API requests.
+
+    Unlike :class:`asyncio.Semaphore`, waiting requests get a slot in order of
+    priority, highest first, and in FIFO order for the same priority.
+    """
+
+    def __init__(self, limit: int):
+        if limit < 1:
+            raise ValueError(
+                f"The concurrency limit ({limit}) must be a positive integer."
+            )
+        self._limit = float(limit)
+        self._active = 0
+        # Heap of (-priority, sequence number, future) entries.
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = count()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    async def acquire(self, priority: int = 0):
+        if self._active < self.limit and not self._waiters:
+            self._active += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (-priority, next(self._sequence), waiter)
+        heappush(self._waiters, entry)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was granted right before cancellation.
+                self.release()
+            else:
+                self._waiters.remove(entry)
+                heapify(self._waiters)
+            raise
+
+    def release(self):
+        self._active -= 1
+        self._wake_up()
+
+    def _wake_up(self):
+        while self._waiters and self._active < self.limit:
+            *_, waiter = heappop(self._waiters)
+            if not waiter.done():
+                self._active += 1
+                waiter.set_result(None)
+
+    def update(self, agg_stats: AggStats):
+        """Called with the client stats after every request."""
+
+
+class _AdaptiveConcurrencyLimiter(_ConcurrencyLimiter):
+    """Limits the number of concurrent Zyte API requests, like
+    :class:`_ConcurrencyLimiter`, adjusting the limit at run time based on Zyte
+    API throttling feedback.
+
+    It follows an AIMD (additive increase, multiplicative decrease) approach:
+
+    -   Every request that finishes without new throttling (429) responses
+        increases the limit by ``1 / limit``, i.e. by 1 for every full round of
+        concurrent requests, up to *maximum*.
+
+    -   New throttling responses multiply the limit by *decrease_factor*, down
+        to *minimum*. Further decreases are ignored until the mean response
+        time has passed, so that a single burst of throttling responses, which
+        affects all requests in flight at that moment, only causes a single
+        decrease.
+    """
+
+    def __init__(
+        self,
+        *,
+        minimum: int,
+        maximum: int,
+        decrease_factor: float = 0.5,
+    ):
+        if not 1 <= minimum <= maximum:
+            raise ValueError(
+                f"The minimum adaptive concurrency ({minimum}) must be a "
+                f"positive integer not higher than the maximum ({maximum})."
+            )
+        if not 0 < decrease_factor < 1:
+            raise ValueError(
+                f"The adaptive concurrency decrease factor ({decrease_factor}) "
+                f"must be higher than 0 and lower than 1."
+            )
+        super().__init__(maximum)
+        self._minimum = minimum
+        self._maximum = maximum
+        self._decrease_factor = decrease_factor
+        self._n_429 = 0
+        self._last_decrease = float("-inf")
+
+    @property
+    def limit(self) -> int:
+        return max(self._minimum, int(self._limit))
+
+    def update(self, agg_stats: AggStats):
+        """Adjusts the limit based on the changes in *agg_stats* since the
+        previous call."""
+        n_429 = agg_stats.n_429
+        throttled = n_429 > self._n_429
+        self._n_429 = n_429
+        if throttled:
+            now = monotonic()
+            if now - self._last_decrease < agg_stats.time_total_stats.mean():
+                return
+            self._last_decrease = now
+            self._limit = max(float(self._minimum), self._limit * self._decrease_factor)
+            return
+        self._limit = min(float(self._maximum), self._limit + 1 / self._limit)
+        self._wake_up()
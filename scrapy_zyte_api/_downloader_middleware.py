@@ -1,4 +1,7 @@
+from time import perf_counter
+
 from ._params import _ParamParser
+from ._timings import _ENQUEUED_META_KEY
 
 
 class ScrapyZyteAPIDownloaderMiddleware:
@@ -10,13 +13,17 @@ class ScrapyZyteAPIDownloaderMiddleware:
         return cls(crawler)
 
     def __init__(self, crawler) -> None:
-        self._param_parser = _ParamParser(crawler.settings)
+        self._param_parser = _ParamParser.from_crawler(crawler)
         self._crawler = crawler
+        self._timings = crawler.settings.getbool("ZYTE_API_TIMINGS", False)
 
     def process_request(self, request, spider):
         if self._param_parser.parse(request) is None:
             return
 
+        if self._timings:
+            request.meta[_ENQUEUED_META_KEY] = perf_counter()
+
         downloader = self._crawler.engine.downloader
         slot_id = downloader._get_slot_key(request, spider)
         if not isinstance(slot_id, str) or not slot_id.startswith(self._slot_prefix):
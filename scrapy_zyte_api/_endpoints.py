@@ -0,0 +1,108 @@
+from logging import getLogger
+from time import monotonic
+from typing import List, Optional
+from urllib.parse import urlparse
+
+from scrapy.statscollectors import StatsCollector
+
+logger = getLogger(__name__)
+
+
+class _Endpoint:
+    def __init__(self, url: str, index: int = 0):
+        self.url = url
+        # The same host may serve several endpoints, e.g. with different
+        # schemes or paths, so the position of the endpoint is included.
+        self.name = f"{index}-{urlparse(url).netloc or url}"
+        # Exponentially-weighted moving averages of response time, in
+        # seconds, and error rate. latency is None until the first response.
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.consecutive_errors = 0
+        self.down_until = 0.0
+        self.last_used = 0
+        self.requests = 0
+
+    @property
+    def score(self) -> float:
+        """Lower is better."""
+        return (self.latency or 0.0) * (1 + 10 * self.error_rate)
+
+
+class _EndpointRouter:
+    """Picks, for each Zyte API request, the Zyte API endpoint with the best
+    recent latency and error rate.
+
+    Endpoints that fail *max_errors* times in a row are not used for
+    *cooldown* seconds, unless all endpoints are in that situation. Every
+    *probe_interval* requests, the least recently used endpoint is picked
+    instead, so that the stats of all endpoints stay up to date.
+    """
+
+    _ALPHA = 0.2
+
+    def __init__(
+        self,
+        urls: List[str],
+        *,
+        max_errors: int = 3,
+        cooldown: float = 30.0,
+        probe_interval: int = 20,
+    ):
+        if not urls:
+            raise ValueError("At least 1 Zyte API endpoint URL is required.")
+        self.endpoints = [_Endpoint(url, index) for index, url in enumerate(urls)]
+        self._max_errors = max_errors
+        self._cooldown = cooldown
+        self._probe_interval = probe_interval
+        self._count = 0
+
+    def select(self) -> int:
+        """Returns the index of the endpoint to use for the next request."""
+        self._count += 1
+        now = monotonic()
+        candidates = [
+            index
+            for index, endpoint in enumerate(self.endpoints)
+            if endpoint.down_until <= now
+        ] or list(range(len(self.endpoints)))
+        untried = [i for i in candidates if self.endpoints[i].latency is None]
+        if untried or self._count % self._probe_interval == 0:
+            index = min(
+                untried or candidates, key=lambda i: self.endpoints[i].last_used
+            )
+        else:
+            index = min(candidates, key=lambda i: self.endpoints[i].score)
+        endpoint = self.endpoints[index]
+        endpoint.last_used = self._count
+        endpoint.requests += 1
+        return index
+
+    def record_success(self, index: int, seconds: float):
+        endpoint = self.endpoints[index]
+        if endpoint.latency is None:
+            endpoint.latency = seconds
+        else:
+            endpoint.latency += self._ALPHA * (seconds - endpoint.latency)
+        endpoint.error_rate -= self._ALPHA * endpoint.error_rate
+        endpoint.consecutive_errors = 0
+
+    def record_error(self, index: int):
+        endpoint = self.endpoints[index]
+        endpoint.error_rate += self._ALPHA * (1 - endpoint.error_rate)
+        endpoint.consecutive_errors += 1
+        if endpoint.consecutive_errors >= self._max_errors:
+            endpoint.consecutive_errors = 0
+            endpoint.down_until = monotonic() + self._cooldown
+            logger.warning(
+                f"Zyte API endpoint {endpoint.url} failed {self._max_errors} "
+                f"times in a row, not using it for {self._cooldown} seconds."
+            )
+
+    def update_stats(self, stats: StatsCollector, prefix: str):
+        for endpoint in self.endpoints:
+            endpoint_prefix = f"{prefix}/endpoints/{endpoint.name}"
+            stats.set_value(f"{endpoint_prefix}/requests", endpoint.requests)
+            stats.set_value(f"{endpoint_prefix}/error_rate", endpoint.error_rate)
+            if endpoint.latency is not None:
+                stats.set_value(f"{endpoint_prefix}/latency", endpoint.latency)
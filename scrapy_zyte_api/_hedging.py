@@ -0,0 +1,65 @@
+from typing import Dict, Optional
+
+from ._latency import _LatencyHistogram, _request_types
+
+
+class _Hedger:
+    """Decides when to send a duplicate of a slow Zyte API request, i.e. a
+    hedged request, based on recent response times of the same request type.
+
+    A hedged request is sent once a request takes longer than *percentile*
+    percent of recent requests of the same type, provided at least
+    *min_samples* of them have finished, and as long as hedged requests do not
+    exceed *max_ratio* times the number of requests.
+    """
+
+    def __init__(
+        self,
+        *,
+        percentile: float = 95.0,
+        max_ratio: float = 0.05,
+        min_samples: int = 20,
+        window: int = 1000,
+    ):
+        if not 0 < percentile < 100:
+            raise ValueError(
+                f"The hedging percentile must be greater than 0 and lower "
+                f"than 100, got {percentile}."
+            )
+        self._percentile = percentile
+        self._max_ratio = max_ratio
+        self._min_samples = min_samples
+        self._window = window
+        self._histograms: Dict[str, _LatencyHistogram] = {}
+        self.requests = 0
+        self.hedges = 0
+
+    @staticmethod
+    def _key(api_params: dict) -> str:
+        return "+".join(_request_types(api_params))
+
+    def delay(self, api_params: dict) -> Optional[float]:
+        """Counts a new request, and returns how many seconds to wait for it
+        before hedging it, or ``None`` if there is not enough data yet."""
+        self.requests += 1
+        histogram = self._histograms.get(self._key(api_params))
+        if histogram is None or histogram.count < self._min_samples:
+            return None
+        return histogram.percentile(self._percentile)
+
+    def hedge(self) -> bool:
+        """Returns ``True`` and counts a hedged request if the hedged request
+        ratio allows for one more, or returns ``False`` otherwise."""
+        if self.hedges + 1 > self._max_ratio * self.requests:
+            return False
+        self.hedges += 1
+        return True
+
+    def record(self, seconds: float, *, api_params: dict):
+        key = self._key(api_params)
+        if key not in self._histograms:
+            self._histograms[key] = _LatencyHistogram()
+        histogram = self._histograms[key]
+        histogram.record(seconds)
+        if histogram.count >= self._window:
+            histogram.decay()
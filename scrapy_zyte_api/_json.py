@@ -0,0 +1,116 @@
+import asyncio
+import json
+import logging
+from typing import Any, Callable, Tuple, Union
+
+from aiohttp import ClientResponse
+
+logger = logging.getLogger(__name__)
+
+_CODECS = ("orjson", "ujson", "json")
+
+
+class _ClientResponse(ClientResponse):
+    """aiohttp response class that parses JSON with the :attr:`_json_loads`
+    function, since python-zyte-api does not let us pass one to
+    :meth:`~aiohttp.ClientResponse.json`.
+
+    Response bodies of at least :attr:`_thread_threshold` bytes, if higher
+    than 0, are parsed in a thread."""
+
+    _json_loads: Callable[[str], Any] = staticmethod(json.loads)
+    _thread_threshold: int = 0
+
+    async def json(self, *, loads=None, **kwargs):
+        loads = loads or self._json_loads
+        if self._thread_threshold > 0:
+            if self._body is None:
+                await self.read()
+            body = self._body
+            if body is not None and len(body) >= self._thread_threshold:
+                # Parsing multi-MB responses, e.g. with screenshots, would
+                # otherwise block the reactor thread. The parent method still
+                # runs, for its content type checks, with the parsing result.
+                result = await asyncio.get_running_loop().run_in_executor(
+                    None, loads, body
+                )
+                return await super().json(loads=lambda _: result, **kwargs)
+        return await super().json(loads=loads, **kwargs)
+
+
+class _JSONCodec:
+    """JSON serialization and parsing functions of a JSON library."""
+
+    def __init__(
+        self,
+        name: str,
+        dumps: Callable[[Any], str],
+        loads: Callable[[Union[str, bytes]], Any],
+    ):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+    def session_kwargs(self, *, thread_threshold: int = 0) -> dict:
+        """Returns keyword arguments for :class:`aiohttp.ClientSession` that
+        make it serialize requests and parse responses with this codec.
+
+        If *thread_threshold* is higher than 0, responses of at least that
+        many bytes are parsed in a thread."""
+        kwargs: dict = {}
+        if self.name != "json":
+            kwargs["json_serialize"] = self.dumps
+        elif thread_threshold <= 0:
+            return kwargs
+        kwargs["response_class"] = type(
+            "_ClientResponse",
+            (_ClientResponse,),
+            {
+                "_json_loads": staticmethod(self.loads),
+                "_thread_threshold": thread_threshold,
+            },
+        )
+        return kwargs
+
+
+def _build_codec(name: str) -> _JSONCodec:
+    if name == "orjson":
+        import orjson
+
+        def dumps(obj):
+            return orjson.dumps(obj).decode()
+
+        return _JSONCodec(name, dumps, orjson.loads)
+    if name == "ujson":
+        import ujson  # type: ignore[import]
+
+        return _JSONCodec(name, ujson.dumps, ujson.loads)
+    return _JSONCodec(name, json.dumps, json.loads)
+
+
+def _load_json_codec(settings) -> _JSONCodec:
+    """Returns the JSON codec that the ``ZYTE_API_JSON_CODEC`` setting
+    selects, falling back to the :mod:`json` module of the standard library if
+    it is not installed."""
+    name: str = settings.get("ZYTE_API_JSON_CODEC") or "json"
+    if name == "auto":
+        candidates: Tuple[str, ...] = _CODECS[:-1]
+    elif name in _CODECS:
+        candidates = (name,)
+    else:
+        raise ValueError(
+            f"The value of the ZYTE_API_JSON_CODEC setting ({name!r}) is "
+            f"invalid. It must be one of: 'auto', "
+            f"{', '.join(repr(codec) for codec in _CODECS)}."
+        )
+    for candidate in candidates:
+        try:
+            return _build_codec(candidate)
+        except ImportError:
+            if name != "auto":
+                logger.warning(
+                    f"The ZYTE_API_JSON_CODEC setting is {name!r}, but {name} "
+                    f"is not installed. Using the json module of the standard "
+                    f"library instead."
+                )
+    return _build_codec("json")
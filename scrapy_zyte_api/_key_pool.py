@@ -0,0 +1,103 @@
+from typing import Dict, List, Optional
+
+from zyte_api.aio.client import AsyncClient
+from zyte_api.stats import AggStats
+
+from ._concurrency import _ConcurrencyLimiter
+
+
+class _PooledKey:
+    """An API key of a :class:`_KeyPool`, with its own client and, optionally,
+    its own concurrency limiter."""
+
+    def __init__(
+        self,
+        client: AsyncClient,
+        *,
+        weight: float = 1.0,
+        concurrency_limiter: Optional[_ConcurrencyLimiter] = None,
+    ):
+        if weight <= 0:
+            raise ValueError(
+                f"The weight of API keys must be greater than 0, got {weight}."
+            )
+        self.client = client
+        self.weight = weight
+        self.concurrency_limiter = concurrency_limiter
+        # Set by _KeyPool, unique within the pool.
+        self.name = client.api_key[:7]
+        self._current_weight = 0.0
+
+    @property
+    def effective_weight(self) -> float:
+        """Weight of the key, lowered by the ratio of Zyte API requests sent
+        with it that got a throttling response."""
+        return self.weight * max(1 - self.client.agg_stats.throttle_ratio(), 0.01)
+
+
+class _KeyPool:
+    """Pool of API keys that spreads requests among them with smooth weighted
+    round-robin, as implemented in nginx, based on their effective weights."""
+
+    def __init__(self, keys: List[_PooledKey]):
+        if not keys:
+            raise ValueError("An API key pool needs at least 1 API key.")
+        self.keys = keys
+        # Different keys may start with the same characters, so key names,
+        # used in stats and logs, also include the position of the key.
+        for index, key in enumerate(keys):
+            key.name = f"{index}-{key.client.api_key[:7]}"
+
+    def select(self) -> int:
+        """Returns the index of the key to use for the next request."""
+        total = 0.0
+        best = 0
+        for index, key in enumerate(self.keys):
+            weight = key.effective_weight
+            key._current_weight += weight
+            total += weight
+            if key._current_weight > self.keys[best]._current_weight:
+                best = index
+        self.keys[best]._current_weight -= total
+        return best
+
+    def agg_stats(self) -> AggStats:
+        """Returns the stats of all keys combined."""
+        combined = AggStats()
+        for key in self.keys:
+            agg_stats = key.client.agg_stats
+            for attribute in (
+                "n_success",
+                "n_fatal_errors",
+                "n_attempts",
+                "n_429",
+                "n_errors",
+                "time_connect_stats",
+                "time_total_stats",
+            ):
+                setattr(
+                    combined,
+                    attribute,
+                    getattr(combined, attribute) + getattr(agg_stats, attribute),
+                )
+            for counter in ("status_codes", "exception_types", "api_error_types"):
+                getattr(combined, counter).update(getattr(agg_stats, counter))
+        return combined
+
+
+def _load_api_keys(settings) -> Dict[str, float]:
+    """Returns a dictionary of API keys and their weights from the
+    ``ZYTE_API_KEYS`` setting, which can be either a list of API keys, all with
+    the same weight, or such a dictionary, also as a JSON string (e.g. from
+    the command line)."""
+    value = settings.get("ZYTE_API_KEYS")
+    if not value:
+        return {}
+    if isinstance(value, dict) or (
+        isinstance(value, str) and value.lstrip().startswith("{")
+    ):
+        return {
+            key: float(weight)
+            for key, weight in settings.getdict("ZYTE_API_KEYS").items()
+        }
+    return {key: 1.0 for key in settings.getlist("ZYTE_API_KEYS")}
@@ -0,0 +1,207 @@
+from collections import OrderedDict
+from logging import getLogger
+from math import ceil, log
+from time import perf_counter
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from scrapy.statscollectors import StatsCollector
+
+logger = getLogger(__name__)
+
+_PERCENTILES = (50, 95, 99)
+
+
+class _LatencyHistogram:
+    """Streaming histogram of durations, in seconds, with fixed logarithmic
+    buckets.
+
+    Bucket boundaries grow by a factor of 2**(1/8), so reported percentiles
+    are within ~5% of the actual value, from 1 millisecond to 20 minutes.
+    Durations outside that range are counted in the first or last bucket.
+    """
+
+    _MIN = 0.001
+    _GROWTH = 2 ** (1 / 8)
+    _LOG_GROWTH = log(_GROWTH)
+    _SIZE = 162
+
+    def __init__(self):
+        self._counts: List[int] = [0] * self._SIZE
+        self.count = 0
+
+    def record(self, seconds: float):
+        if seconds <= self._MIN:
+            index = 0
+        else:
+            index = min(
+                int(log(seconds / self._MIN) / self._LOG_GROWTH), self._SIZE - 1
+            )
+        self._counts[index] += 1
+        self.count += 1
+
+    def decay(self):
+        """Halves all counts, so that older durations weigh less than newer
+        ones."""
+        self._counts = [count // 2 for count in self._counts]
+        self.count = sum(self._counts)
+
+    def percentile(self, percentile: float) -> float:
+        """Returns the duration below which *percentile* percent of recorded
+        durations fall, or 0.0 if no durations have been recorded."""
+        if not self.count:
+            return 0.0
+        target = max(1, ceil(self.count * percentile / 100))
+        cumulative = 0
+        for index, count in enumerate(self._counts):
+            cumulative += count
+            if cumulative >= target:
+                break
+        # Geometric middle of the bucket.
+        return self._MIN * self._GROWTH ** (index + 0.5)
+
+
+def _request_types(api_params: dict) -> List[str]:
+    """Returns the request types (browserHtml, httpResponseBody, screenshot)
+    that *api_params* ask for, or ``["other"]``."""
+    return [key for key in _LatencyStats._REQUEST_TYPES if api_params.get(key)] or [
+        "other"
+    ]
+
+
+class _LatencyStats:
+    """Keeps latency histograms of Zyte API responses, overall, per request
+    type (browserHtml, httpResponseBody, screenshot) and, optionally, per
+    target domain.
+
+    Only the *max_domains* most recently recorded domains keep a histogram;
+    the histogram and stats of the least recently recorded domain are removed
+    when a new domain would exceed that limit.
+    """
+
+    _REQUEST_TYPES = ("browserHtml", "httpResponseBody", "screenshot")
+
+    def __init__(self, *, by_domain: bool = False, max_domains: int = 100):
+        if max_domains < 1:
+            raise ValueError(
+                f"The maximum number of domains with latency stats must be 1 "
+                f"or higher, got {max_domains}."
+            )
+        self._by_domain = by_domain
+        self._max_domains = max_domains
+        self._histograms: Dict[str, _LatencyHistogram] = {}
+        # Histogram keys of domains, from least to most recently recorded.
+        self._domain_keys: "OrderedDict[str, None]" = OrderedDict()
+        self._outdated: Set[str] = set()
+        self._evicted: Set[str] = set()
+        self._log_outdated = False
+
+    def _keys(self, api_params: dict, domain: str) -> Iterable[str]:
+        yield ""
+        for request_type in _request_types(api_params):
+            yield f"type/{request_type}/"
+        if self._by_domain:
+            yield self._domain_key(domain)
+
+    def _domain_key(self, domain: str) -> str:
+        key = f"domain/{domain}/"
+        if key in self._domain_keys:
+            self._domain_keys.move_to_end(key)
+            return key
+        self._domain_keys[key] = None
+        self._evicted.discard(key)
+        if len(self._domain_keys) > self._max_domains:
+            evicted, _ = self._domain_keys.popitem(last=False)
+            del self._histograms[evicted]
+            self._outdated.discard(evicted)
+            self._evicted.add(evicted)
+        return key
+
+    def record(self, seconds: float, *, api_params: dict, domain: str):
+        for key in self._keys(api_params, domain):
+            if key not in self._histograms:
+                self._histograms[key] = _LatencyHistogram()
+            self._histograms[key].record(seconds)
+            self._outdated.add(key)
+        self._log_outdated = True
+
+    def percentiles(self, key: str = "") -> Dict[int, float]:
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            return {}
+        return {p: histogram.percentile(p) for p in _PERCENTILES}
+
+    def update_stats(self, stats: StatsCollector, prefix: str):
+        """Sets percentile stats for histograms updated since the previous
+        call."""
+        for key in self._outdated:
+            for p, value in self.percentiles(key).items():
+                stats.set_value(f"{prefix}/response_seconds/{key}p{p}", value)
+        self._outdated.clear()
+        if self._evicted:
+            # StatsCollector has no API to remove a stat, but get_stats()
+            # returns the underlying dictionary.
+            all_stats = stats.get_stats()
+            for key in self._evicted:
+                for p in _PERCENTILES:
+                    all_stats.pop(f"{prefix}/response_seconds/{key}p{p}", None)
+            self._evicted.clear()
+
+    def log(self):
+        if not self._log_outdated:
+            return
+        self._log_outdated = False
+        parts = []
+        for key in [""] + [f"type/{t}/" for t in self._REQUEST_TYPES + ("other",)]:
+            percentiles = self.percentiles(key)
+            if not percentiles:
+                continue
+            name = key[5:-1] if key else "all"
+            values = ", ".join(f"p{p}={v:.2f}s" for p, v in percentiles.items())
+            parts.append(f"{name} ({values})")
+        logger.info(f"Zyte API response times: {'; '.join(parts)}")
+
+
+class _LoopLagMonitor:
+    """Measures the lag of the reactor event loop, i.e. how late a call
+    scheduled every *interval* seconds runs, which grows while the reactor
+    thread is busy with CPU-bound work."""
+
+    def __init__(self, interval: float):
+        self._interval = interval
+        self._call: Optional[Any] = None
+        self._expected = 0.0
+        self._total = 0.0
+        self._count = 0
+        self._outdated = False
+        self.max = 0.0
+
+    def start(self):
+        self._schedule()
+
+    def stop(self):
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+
+    def _schedule(self):
+        from twisted.internet import reactor
+
+        self._expected = perf_counter() + self._interval
+        self._call = reactor.callLater(  # type: ignore[attr-defined]
+            self._interval, self._tick
+        )
+
+    def _tick(self):
+        lag = max(0.0, perf_counter() - self._expected)
+        self.max = max(self.max, lag)
+        self._total += lag
+        self._count += 1
+        self._outdated = True
+        self._schedule()
+
+    def update_stats(self, stats: StatsCollector, prefix: str):
+        if not self._outdated:
+            return
+        self._outdated = False
+        stats.set_value(f"{prefix}/loop_lag_seconds/max", self.max)
+        stats.set_value(f"{prefix}/loop_lag_seconds/mean", self._total / self._count)
@@ -1,85 +1,212 @@
 from base64 import b64decode, b64encode
+from collections import abc
 from copy import copy
 from logging import getLogger
-from typing import Any, Dict, Mapping, Optional, Set
+from time import monotonic
+from typing import Any, Dict, List, Mapping, Optional, Set, Tuple
 from warnings import warn
+from weakref import WeakKeyDictionary
 
 from scrapy import Request
 from scrapy.settings.default_settings import DEFAULT_REQUEST_HEADERS
 from scrapy.settings.default_settings import USER_AGENT as DEFAULT_USER_AGENT
 
+from ._validation import _get_param_errors
+
 logger = getLogger(__name__)
 
+
+class _ParamWarnings:
+    """Logs warnings about Zyte API parameters, and counts them in stats.
+
+    Warnings are identified by a *kind* and a *detail*, e.g. a header name.
+    Each warning is only logged the first time or, if *interval* is not
+    ``None``, at most once every *interval* seconds. Messages are formatted
+    lazily, only when logged.
+    """
+
+    def __init__(self, *, stats=None, interval: Optional[float] = None):
+        self._stats = stats
+        self._interval = interval
+        self._last_logged: Dict[Tuple[str, Any], float] = {}
+        self._skipped: Dict[Tuple[str, Any], int] = {}
+
+    def warn(self, kind: str, detail: Any, message: str, *args: Any):
+        if self._stats is not None:
+            self._stats.inc_value(f"scrapy-zyte-api/param_warnings/{kind}")
+        key = (kind, detail)
+        now = monotonic()
+        last_logged = self._last_logged.get(key)
+        if last_logged is not None and (
+            self._interval is None or now - last_logged < self._interval
+        ):
+            self._skipped[key] = self._skipped.get(key, 0) + 1
+            return
+        self._last_logged[key] = now
+        skipped = self._skipped.pop(key, 0)
+        if skipped:
+            message += " (%d similar warnings were not logged)"
+            args += (skipped,)
+        logger.warning(message, *args)
+
+
 _DEFAULT_API_PARAMS = {
     "browserHtml": False,
     "screenshot": False,
 }
 
 
-def _iter_headers(
+# Maximum number of header translations that _ParamParser keeps per header
+# parameter. Broad crawls reuse a few header sets, but headers like Referer
+# can make every request unique, so the memo must be bounded.
+_HEADER_CACHE_SIZE = 1024
+
+
+def _get_headers_key(request: Request) -> Tuple:
+    """Returns a normalized, hashable snapshot of the headers of
+    *request*."""
+    # dict.items() skips the value normalization of Headers.items(), values
+    # are already lists of bytes.
+    return tuple((k, tuple(v)) for k, v in dict.items(request.headers))
+
+
+def _iter_headers(headers_key: Tuple):
+    for k, v in headers_key:
+        if not v:
+            continue
+        decoded_v = b",".join(v).decode()
+        lowercase_k = k.strip().lower()
+        yield k, lowercase_k, decoded_v
+
+
+def _can_map_headers(
     *,
     api_params: Dict[str, Any],
     request: Request,
     header_parameter: str,
-):
+    param_warnings: _ParamWarnings,
+) -> bool:
     headers = api_params.get(header_parameter)
     if headers not in (None, True):
-        logger.warning(
-            f"Request {request} defines the Zyte API {header_parameter} "
-            f"parameter, overriding Request.headers. Use Request.headers "
-            f"instead."
+        param_warnings.warn(
+            "header_param_override",
+            header_parameter,
+            "Request %s defines the Zyte API %s parameter, overriding "
+            "Request.headers. Use Request.headers instead.",
+            request,
+            header_parameter,
         )
-        return
-    if not request.headers:
-        return
-    for k, v in request.headers.items():
-        if not v:
-            continue
-        decoded_v = b",".join(v).decode()
-        lowercase_k = k.strip().lower()
-        yield k, lowercase_k, decoded_v
+        return False
+    return bool(request.headers)
 
 
-def _map_custom_http_request_headers(
+def _translate_headers(
+    *,
+    headers_key: Tuple,
+    header_parameter: str,
+    header_cache: Dict[str, Dict[Tuple, Tuple]],
+    translate,
+    config,
+) -> Tuple:
+    """Returns the translation of *headers_key*, as returned by
+    :func:`_get_headers_key`, for *header_parameter*, memoized in
+    *header_cache*.
+
+    A translation is a ``(headers, unmappable)`` tuple, where *headers* is a
+    tuple of ``(name, value)`` string tuples, and *unmappable* is a tuple of
+    the names of request headers that cannot be mapped.
+
+    On a cache miss, the translation is built with ``translate(headers_key,
+    config)``.
+    """
+    cache = header_cache.setdefault(header_parameter, {})
+    translation = cache.get(headers_key)
+    if translation is None:
+        translation = translate(headers_key, config)
+        if len(cache) >= _HEADER_CACHE_SIZE:
+            del cache[next(iter(cache))]
+        cache[headers_key] = translation
+    return translation
+
+
+def _warn_unmappable_headers(
     *,
-    api_params: Dict[str, Any],
     request: Request,
-    skip_headers: Set[str],
+    unmappable: Tuple,
+    header_parameter: str,
+    param_warnings: _ParamWarnings,
 ):
+    for k in unmappable:
+        param_warnings.warn(
+            "unmappable_header",
+            k,
+            f"Request %s defines header %s, which cannot be mapped into the "
+            f"Zyte API {header_parameter} parameter.",
+            request,
+            k,
+        )
+
+
+def _translate_custom_http_request_headers(
+    headers_key: Tuple, skip_headers: Set[bytes]
+) -> Tuple:
     headers = []
-    for k, lowercase_k, decoded_v in _iter_headers(
-        api_params=api_params,
-        request=request,
-        header_parameter="customHttpRequestHeaders",
-    ):
+    unmappable = []
+    for k, lowercase_k, decoded_v in _iter_headers(headers_key):
         if lowercase_k in skip_headers:
             if lowercase_k != b"user-agent" or decoded_v != DEFAULT_USER_AGENT:
-                logger.warning(
-                    f"Request {request} defines header {k}, which "
-                    f"cannot be mapped into the Zyte API "
-                    f"customHttpRequestHeaders parameter."
-                )
+                unmappable.append(k)
             continue
-        headers.append({"name": k.decode(), "value": decoded_v})
-    if headers:
-        api_params["customHttpRequestHeaders"] = headers
+        headers.append((k.decode(), decoded_v))
+    return tuple(headers), tuple(unmappable)
 
 
-def _map_request_headers(
+def _map_custom_http_request_headers(
     *,
     api_params: Dict[str, Any],
     request: Request,
-    browser_headers: Dict[str, str],
+    skip_headers: Set[bytes],
+    param_warnings: _ParamWarnings,
+    header_cache: Dict[str, Dict[Tuple, Tuple]],
+    headers_key: Tuple,
 ):
-    request_headers = {}
-    for k, lowercase_k, decoded_v in _iter_headers(
+    header_parameter = "customHttpRequestHeaders"
+    if not _can_map_headers(
         api_params=api_params,
         request=request,
-        header_parameter="requestHeaders",
+        header_parameter=header_parameter,
+        param_warnings=param_warnings,
     ):
+        return
+    headers, unmappable = _translate_headers(
+        headers_key=headers_key,
+        header_parameter=header_parameter,
+        header_cache=header_cache,
+        translate=_translate_custom_http_request_headers,
+        config=skip_headers,
+    )
+    _warn_unmappable_headers(
+        request=request,
+        unmappable=unmappable,
+        header_parameter=header_parameter,
+        param_warnings=param_warnings,
+    )
+    if headers:
+        # Build new objects every time, the output may be modified.
+        api_params[header_parameter] = [
+            {"name": name, "value": value} for name, value in headers
+        ]
+
+
+def _translate_request_headers(
+    headers_key: Tuple, browser_headers: Dict[bytes, str]
+) -> Tuple:
+    headers = []
+    unmappable = []
+    for k, lowercase_k, decoded_v in _iter_headers(headers_key):
         key = browser_headers.get(lowercase_k)
         if key is not None:
-            request_headers[key] = decoded_v
+            headers.append((key, decoded_v))
         elif not (
             (
                 lowercase_k == b"accept"
@@ -91,115 +218,68 @@ def _map_request_headers(
             )
             or (lowercase_k == b"user-agent" and decoded_v == DEFAULT_USER_AGENT)
         ):
-            logger.warning(
-                f"Request {request} defines header {k}, which "
-                f"cannot be mapped into the Zyte API requestHeaders "
-                f"parameter."
-            )
-    if request_headers:
-        api_params["requestHeaders"] = request_headers
+            unmappable.append(k)
+    return tuple(headers), tuple(unmappable)
 
 
-def _set_request_headers_from_request(
-    *,
-    api_params: Dict[str, Any],
-    request: Request,
-    skip_headers: Set[str],
-    browser_headers: Dict[str, str],
-):
-    """Updates *api_params*, in place, based on *request*."""
-    custom_http_request_headers = api_params.get("customHttpRequestHeaders")
-    request_headers = api_params.get("requestHeaders")
-    response_body = api_params.get("httpResponseBody")
-
-    if (
-        response_body
-        and custom_http_request_headers is not False
-        or custom_http_request_headers is True
-    ):
-        _map_custom_http_request_headers(
-            api_params=api_params,
-            request=request,
-            skip_headers=skip_headers,
-        )
-    elif custom_http_request_headers is False:
-        api_params.pop("customHttpRequestHeaders")
-
-    if (
-        (
-            not response_body
-            or any(api_params.get(k) for k in ("browserHtml", "screenshot"))
-        )
-        and request_headers is not False
-        or request_headers is True
-    ):
-        _map_request_headers(
-            api_params=api_params,
-            request=request,
-            browser_headers=browser_headers,
-        )
-    elif request_headers is False:
-        api_params.pop("requestHeaders")
-
-
-def _set_http_response_body_from_request(
+def _map_request_headers(
     *,
     api_params: Dict[str, Any],
     request: Request,
+    browser_headers: Dict[bytes, str],
+    param_warnings: _ParamWarnings,
+    header_cache: Dict[str, Dict[Tuple, Tuple]],
+    headers_key: Tuple,
 ):
-    if not any(
-        api_params.get(k) for k in ("httpResponseBody", "browserHtml", "screenshot")
-    ):
-        api_params.setdefault("httpResponseBody", True)
-    elif api_params.get("httpResponseBody") is False:
-        logger.warning(
-            f"Request {request} unnecessarily defines the Zyte API "
-            f"'httpResponseBody' parameter with its default value, False. "
-            f"It will not be sent to the server."
-        )
-    if api_params.get("httpResponseBody") is False:
-        api_params.pop("httpResponseBody")
-
-
-def _set_http_response_headers_from_request(
-    *,
-    api_params: Dict[str, Any],
-    default_params: Dict[str, Any],
-    meta_params: Dict[str, Any],
-):
-    if api_params.get("httpResponseBody"):
-        api_params.setdefault("httpResponseHeaders", True)
-    elif (
-        api_params.get("httpResponseHeaders") is False
-        and not default_params.get("httpResponseHeaders") is False
+    header_parameter = "requestHeaders"
+    if not _can_map_headers(
+        api_params=api_params,
+        request=request,
+        header_parameter=header_parameter,
+        param_warnings=param_warnings,
     ):
-        logger.warning(
-            "You do not need to set httpResponseHeaders to False if "
-            "neither httpResponseBody nor browserHtml are set to True. Note "
-            "that httpResponseBody is set to True automatically if "
-            "neither browserHtml nor screenshot are set to True."
-        )
-    if api_params.get("httpResponseHeaders") is False:
-        api_params.pop("httpResponseHeaders")
+        return
+    headers, unmappable = _translate_headers(
+        headers_key=headers_key,
+        header_parameter=header_parameter,
+        header_cache=header_cache,
+        translate=_translate_request_headers,
+        config=browser_headers,
+    )
+    _warn_unmappable_headers(
+        request=request,
+        unmappable=unmappable,
+        header_parameter=header_parameter,
+        param_warnings=param_warnings,
+    )
+    if headers:
+        api_params[header_parameter] = dict(headers)
 
 
 def _set_http_request_method_from_request(
     *,
     api_params: Dict[str, Any],
     request: Request,
+    param_warnings: _ParamWarnings,
 ):
     method = api_params.get("httpRequestMethod")
     if method:
-        logger.warning(
-            f"Request {request} uses the Zyte API httpRequestMethod "
-            f"parameter, overriding Request.method. Use Request.method "
-            f"instead."
+        param_warnings.warn(
+            "method_param",
+            None,
+            "Request %s uses the Zyte API httpRequestMethod parameter, "
+            "overriding Request.method. Use Request.method instead.",
+            request,
         )
         if method != request.method:
-            logger.warning(
-                f"The HTTP method of request {request} ({request.method}) "
-                f"does not match the Zyte API httpRequestMethod parameter "
-                f"({method})."
+            param_warnings.warn(
+                "method_mismatch",
+                None,
+                "The HTTP method of request %s (%s) does not match the Zyte "
+                "API httpRequestMethod parameter (%s).",
+                request,
+                request.method,
+                method,
             )
     elif request.method != "GET":
         api_params["httpRequestMethod"] = request.method
@@ -209,113 +289,302 @@ def _set_http_request_body_from_request(
     *,
     api_params: Dict[str, Any],
     request: Request,
+    param_warnings: _ParamWarnings,
 ):
     body = api_params.get("httpRequestBody")
     if body:
-        logger.warning(
-            f"Request {request} uses the Zyte API httpRequestBody parameter, "
-            f"overriding Request.body. Use Request.body instead."
+        param_warnings.warn(
+            "body_param",
+            None,
+            "Request %s uses the Zyte API httpRequestBody parameter, "
+            "overriding Request.body. Use Request.body instead.",
+            request,
         )
         decoded_body = b64decode(body)
         if decoded_body != request.body:
-            logger.warning(
-                f"The body of request {request} ({request.body!r}) "
-                f"does not match the Zyte API httpRequestBody parameter "
-                f"({body!r}; decoded: {decoded_body!r})."
+            param_warnings.warn(
+                "body_mismatch",
+                None,
+                "The body of request %s (%r) does not match the Zyte API "
+                "httpRequestBody parameter (%r; decoded: %r).",
+                request,
+                request.body,
+                body,
+                decoded_body,
             )
     elif request.body != b"":
         base64_body = b64encode(request.body).decode()
         api_params["httpRequestBody"] = base64_body
 
 
-def _unset_unneeded_api_params(
-    *,
-    api_params: Dict[str, Any],
-    default_params: Dict[str, Any],
-    request: Request,
-):
-    for param, default_value in _DEFAULT_API_PARAMS.items():
-        if api_params.get(param) != default_value:
-            continue
-        if param not in default_params or default_params.get(param) == default_value:
-            logger.warning(
-                f"Request {request} unnecessarily defines the Zyte API {param!r} "
-                f"parameter with its default value, {default_value!r}. It will "
-                f"not be sent to the server."
+# Zyte API parameters whose values, besides the request itself, determine how
+# requests are mapped automatically.
+_PLAN_PARAMS = (
+    "browserHtml",
+    "customHttpRequestHeaders",
+    "httpResponseBody",
+    "httpResponseHeaders",
+    "requestHeaders",
+    "screenshot",
+)
+
+# Marks parameters to remove in _AutomapPlan.updates.
+_REMOVE = object()
+# Stands for the request in the warning arguments of _AutomapPlan.
+_REQUEST = object()
+
+
+def _get_plan_key(api_params: Dict[str, Any]) -> Tuple:
+    """Returns the values of *api_params* that determine its
+    :class:`_AutomapPlan`.
+
+    None is not a valid parameter value after merging, so it stands for
+    missing parameters. Values other than True and False are reduced to their
+    truthiness and whether or not they are equal to False, which is all that
+    automatic mapping checks.
+    """
+    key = []
+    for param in _PLAN_PARAMS:
+        value = api_params.get(param)
+        if value is not None and value is not True and value is not False:
+            value = (bool(value), value == False)  # noqa: E712
+        key.append(value)
+    return tuple(key)
+
+
+def _get_plan_sample(value):
+    """Returns a parameter value that stands for *value* from a plan key."""
+    if not isinstance(value, tuple):
+        return value
+    truthy, equal_to_false = value
+    if truthy:
+        return "…"
+    return 0 if equal_to_false else ""
+
+
+class _AutomapPlan:
+    """Changes to the parameters of an automatically-mapped request, and
+    warnings to log, that do not depend on the request itself, but only on
+    the values of :data:`_PLAN_PARAMS` that *key* describes."""
+
+    def __init__(self, key: Tuple, *, default_params: Dict[str, Any]):
+        params = {
+            param: _get_plan_sample(value)
+            for param, value in zip(_PLAN_PARAMS, key)
+            if value is not None
+        }
+        # (param, value) pairs to set in order, with _REMOVE as value for
+        # params to remove.
+        self.updates: List[Tuple[str, Any]] = []
+        # (kind, detail, message, args) of warnings to log before and after
+        # mapping the request, with _REQUEST in args standing for the
+        # request.
+        self.warnings_before: List[Tuple[str, str, str, Tuple]] = []
+        self.warnings_after: List[Tuple[str, str, str, Tuple]] = []
+
+        def update(param, value):
+            if value is _REMOVE:
+                params.pop(param)
+            else:
+                params[param] = value
+            self.updates.append((param, value))
+
+        if not any(
+            params.get(k) for k in ("httpResponseBody", "browserHtml", "screenshot")
+        ):
+            if "httpResponseBody" not in params:
+                update("httpResponseBody", True)
+        elif params.get("httpResponseBody") is False:
+            self.warnings_before.append(
+                (
+                    "unneeded_param",
+                    "httpResponseBody",
+                    "Request %s unnecessarily defines the Zyte API "
+                    "'httpResponseBody' parameter with its default value, "
+                    "False. It will not be sent to the server.",
+                    (_REQUEST,),
+                )
             )
-        api_params.pop(param)
-
-
-def _update_api_params_from_request(
-    api_params: Dict[str, Any],
-    request: Request,
-    *,
-    default_params: Dict[str, Any],
-    meta_params: Dict[str, Any],
-    skip_headers: Set[str],
-    browser_headers: Dict[str, str],
-):
-    _set_http_response_body_from_request(api_params=api_params, request=request)
-    _set_http_response_headers_from_request(
-        api_params=api_params,
-        default_params=default_params,
-        meta_params=meta_params,
-    )
-    _set_http_request_method_from_request(api_params=api_params, request=request)
-    _set_request_headers_from_request(
-        api_params=api_params,
-        request=request,
-        skip_headers=skip_headers,
-        browser_headers=browser_headers,
-    )
-    _set_http_request_body_from_request(api_params=api_params, request=request)
-    _unset_unneeded_api_params(
-        api_params=api_params, request=request, default_params=default_params
-    )
-    return api_params
+        if params.get("httpResponseBody") is False:
+            update("httpResponseBody", _REMOVE)
+
+        if params.get("httpResponseBody"):
+            if "httpResponseHeaders" not in params:
+                update("httpResponseHeaders", True)
+        elif (
+            params.get("httpResponseHeaders") is False
+            and not default_params.get("httpResponseHeaders") is False
+        ):
+            self.warnings_before.append(
+                (
+                    "unneeded_param",
+                    "httpResponseHeaders",
+                    "You do not need to set httpResponseHeaders to False if "
+                    "neither httpResponseBody nor browserHtml are set to "
+                    "True. Note that httpResponseBody is set to True "
+                    "automatically if neither browserHtml nor screenshot are "
+                    "set to True.",
+                    (),
+                )
+            )
+        if params.get("httpResponseHeaders") is False:
+            update("httpResponseHeaders", _REMOVE)
+
+        custom_http_request_headers = params.get("customHttpRequestHeaders")
+        request_headers = params.get("requestHeaders")
+        response_body = params.get("httpResponseBody")
+        self.map_custom_http_request_headers = False
+        self.remove_custom_http_request_headers = False
+        if (
+            response_body
+            and custom_http_request_headers is not False
+            or custom_http_request_headers is True
+        ):
+            self.map_custom_http_request_headers = True
+        elif custom_http_request_headers is False:
+            self.remove_custom_http_request_headers = True
+        self.map_request_headers = False
+        self.remove_request_headers = False
+        if (
+            (
+                not response_body
+                or any(params.get(k) for k in ("browserHtml", "screenshot"))
+            )
+            and request_headers is not False
+            or request_headers is True
+        ):
+            self.map_request_headers = True
+        elif request_headers is False:
+            self.remove_request_headers = True
+
+        self.removals_after: List[str] = []
+        for param, default_value in _DEFAULT_API_PARAMS.items():
+            if params.get(param) != default_value:
+                continue
+            if (
+                param not in default_params
+                or default_params.get(param) == default_value
+            ):
+                self.warnings_after.append(
+                    (
+                        "unneeded_param",
+                        param,
+                        "Request %s unnecessarily defines the Zyte API %r "
+                        "parameter with its default value, %r. It will not "
+                        "be sent to the server.",
+                        (_REQUEST, param, default_value),
+                    )
+                )
+            self.removals_after.append(param)
+
+    @staticmethod
+    def _warn(param_warnings, request, kind, detail, message, args):
+        args = tuple(request if arg is _REQUEST else arg for arg in args)
+        param_warnings.warn(kind, detail, message, *args)
+
+    def apply(
+        self,
+        api_params: Dict[str, Any],
+        request: Request,
+        *,
+        skip_headers: Set[bytes],
+        browser_headers: Dict[bytes, str],
+        param_warnings: _ParamWarnings,
+        header_cache: Dict[str, Dict[Tuple, Tuple]],
+        headers_key: Tuple,
+    ):
+        """Updates *api_params*, in place, based on *request*."""
+        for kind, detail, message, args in self.warnings_before:
+            self._warn(param_warnings, request, kind, detail, message, args)
+        for param, value in self.updates:
+            if value is _REMOVE:
+                api_params.pop(param)
+            else:
+                api_params[param] = value
+        _set_http_request_method_from_request(
+            api_params=api_params, request=request, param_warnings=param_warnings
+        )
+        if self.map_custom_http_request_headers:
+            _map_custom_http_request_headers(
+                api_params=api_params,
+                request=request,
+                skip_headers=skip_headers,
+                param_warnings=param_warnings,
+                header_cache=header_cache,
+                headers_key=headers_key,
+            )
+        elif self.remove_custom_http_request_headers:
+            api_params.pop("customHttpRequestHeaders")
+        if self.map_request_headers:
+            _map_request_headers(
+                api_params=api_params,
+                request=request,
+                browser_headers=browser_headers,
+                param_warnings=param_warnings,
+                header_cache=header_cache,
+                headers_key=headers_key,
+            )
+        elif self.remove_request_headers:
+            api_params.pop("requestHeaders")
+        _set_http_request_body_from_request(
+            api_params=api_params, request=request, param_warnings=param_warnings
+        )
+        for kind, detail, message, args in self.warnings_after:
+            self._warn(param_warnings, request, kind, detail, message, args)
+        for param in self.removals_after:
+            api_params.pop(param)
 
 
-def _copy_meta_params_as_dict(
-    meta_params: Dict[str, Any],
+def _get_meta_params_mapping(
+    meta_params: Any,
     *,
     param: str,
     request: Request,
-):
+) -> Mapping[str, Any]:
     if meta_params is True:
         return {}
-    elif not isinstance(meta_params, Mapping):
+    # isinstance() is much faster with collections.abc.Mapping than with
+    # typing.Mapping.
+    elif not isinstance(meta_params, abc.Mapping):
         raise ValueError(
             f"'{param}' parameters in the request meta should be provided as "
             f"a dictionary, got {type(meta_params)} instead in {request}."
         )
     else:
-        return copy(meta_params)
+        return meta_params
 
 
 def _merge_params(
     *,
     default_params: Dict[str, Any],
-    meta_params: Dict[str, Any],
+    meta_params: Mapping[str, Any],
     param: str,
     setting: str,
     request: Request,
+    param_warnings: _ParamWarnings,
 ):
-    params = copy(default_params)
-    meta_params = copy(meta_params)
-    for k in list(meta_params):
-        if meta_params[k] is not None:
-            continue
-        meta_params.pop(k)
-        if k in params:
+    """Returns a new dictionary with *default_params* updated with
+    *meta_params*, where None values remove parameters.
+
+    Neither *default_params* nor *meta_params* are copied on their own."""
+    params = dict(default_params)
+    for k, v in meta_params.items():
+        if v is not None:
+            params[k] = v
+        elif k in params:
             params.pop(k)
         else:
-            logger.warning(
-                f"In request {request} {param!r} parameter {k} is None, "
-                f"which is a value reserved to unset parameters defined in "
-                f"the {setting} setting, but the setting does not define such "
-                f"a parameter."
+            param_warnings.warn(
+                "undefined_unset_param",
+                (param, k),
+                "In request %s %r parameter %s is None, which is a value "
+                "reserved to unset parameters defined in the %s setting, but "
+                "the setting does not define such a parameter.",
+                request,
+                param,
+                k,
+                setting,
             )
-    params.update(meta_params)
     return params
 
 
@@ -323,6 +592,7 @@ def _get_raw_params(
     request: Request,
     *,
     default_params: Dict[str, Any],
+    param_warnings: _ParamWarnings,
 ):
     meta_params = request.meta.get("zyte_api", False)
     if meta_params is False:
@@ -336,7 +606,7 @@ def _get_raw_params(
         )
         return None
 
-    meta_params = _copy_meta_params_as_dict(
+    meta_params = _get_meta_params_mapping(
         meta_params,
         param="zyte_api",
         request=request,
@@ -348,6 +618,7 @@ def _get_raw_params(
         param="zyte_api",
         setting="ZYTE_API_DEFAULT_PARAMS",
         request=request,
+        param_warnings=param_warnings,
     )
 
 
@@ -356,14 +627,18 @@ def _get_automap_params(
     *,
     default_enabled: bool,
     default_params: Dict[str, Any],
-    skip_headers: Set[str],
-    browser_headers: Dict[str, str],
+    skip_headers: Set[bytes],
+    browser_headers: Dict[bytes, str],
+    param_warnings: _ParamWarnings,
+    automap_plans: Dict[Tuple, _AutomapPlan],
+    header_cache: Dict[str, Dict[Tuple, Tuple]],
+    headers_key: Tuple,
 ):
     meta_params = request.meta.get("zyte_api_automap", default_enabled)
     if meta_params is False:
         return None
 
-    meta_params = _copy_meta_params_as_dict(
+    meta_params = _get_meta_params_mapping(
         meta_params,
         param="zyte_api_automap",
         request=request,
@@ -375,15 +650,23 @@ def _get_automap_params(
         param="zyte_api_automap",
         setting="ZYTE_API_AUTOMAP_PARAMS",
         request=request,
+        param_warnings=param_warnings,
     )
 
-    _update_api_params_from_request(
+    plan_key = _get_plan_key(params)
+    plan = automap_plans.get(plan_key)
+    if plan is None:
+        plan = automap_plans[plan_key] = _AutomapPlan(
+            plan_key, default_params=default_params
+        )
+    plan.apply(
         params,
         request,
-        default_params=default_params,
-        meta_params=meta_params,
         skip_headers=skip_headers,
         browser_headers=browser_headers,
+        param_warnings=param_warnings,
+        header_cache=header_cache,
+        headers_key=headers_key,
     )
 
     return params
@@ -395,14 +678,20 @@ def _get_api_params(
     default_params: Dict[str, Any],
     transparent_mode: bool,
     automap_params: Dict[str, Any],
-    skip_headers: Set[str],
-    browser_headers: Dict[str, str],
+    skip_headers: Set[bytes],
+    browser_headers: Dict[bytes, str],
     job_id: Optional[str],
+    param_warnings: _ParamWarnings,
+    automap_plans: Dict[Tuple, _AutomapPlan],
+    header_cache: Dict[str, Dict[Tuple, Tuple]],
+    headers_key: Tuple,
 ) -> Optional[dict]:
     """Returns a dictionary of API parameters that must be sent to Zyte API for
     the specified request, or None if the request should not be sent through
     Zyte API."""
-    api_params = _get_raw_params(request, default_params=default_params)
+    api_params = _get_raw_params(
+        request, default_params=default_params, param_warnings=param_warnings
+    )
     if api_params is None:
         api_params = _get_automap_params(
             request,
@@ -410,6 +699,10 @@ def _get_api_params(
             default_params=automap_params,
             skip_headers=skip_headers,
             browser_headers=browser_headers,
+            param_warnings=param_warnings,
+            automap_plans=automap_plans,
+            header_cache=header_cache,
+            headers_key=headers_key,
         )
         if api_params is None:
             return None
@@ -440,6 +733,15 @@ def _load_default_params(settings, setting):
     return params
 
 
+def _validate_default_params(params, setting):
+    errors = _get_param_errors(params)
+    if errors:
+        raise ValueError(
+            f"The value of the {setting} setting ({params!r}) is invalid: "
+            f"{'; '.join(errors)}."
+        )
+
+
 def _load_skip_headers(settings):
     return {
         header.strip().lower().encode()
@@ -458,22 +760,110 @@ def _load_browser_headers(settings):
     return {k.strip().lower().encode(): v for k, v in browser_headers.items()}
 
 
+def _snapshot_meta_params(meta_params):
+    """Returns a snapshot of *meta_params* that does not change if
+    *meta_params*, or any mapping or list within, is modified in place."""
+    if isinstance(meta_params, abc.Mapping):
+        return (
+            abc.Mapping,
+            tuple((k, _snapshot_meta_params(v)) for k, v in meta_params.items()),
+        )
+    if isinstance(meta_params, list):
+        return (list, tuple(_snapshot_meta_params(v) for v in meta_params))
+    return meta_params
+
+
+def _request_signature(request: Request, *, headers_key: Tuple) -> Tuple:
+    """Returns a snapshot of every request attribute that parsing depends on,
+    to tell whether a request has changed in place since it was parsed.
+
+    *headers_key* must be the output of :func:`_get_headers_key` for
+    *request*."""
+    return (
+        request.url,
+        request.method,
+        request.body,
+        headers_key,
+        _snapshot_meta_params(request.meta.get("zyte_api", False)),
+        _snapshot_meta_params(request.meta.get("zyte_api_automap", None)),
+    )
+
+
 class _ParamParser:
-    def __init__(self, settings):
+    @classmethod
+    def from_crawler(cls, crawler):
+        # We keep the parser in the crawler object, so that the downloader
+        # middleware, the request fingerprinter and the download handler share
+        # parsing results.
+        if not hasattr(crawler, "zyte_api_param_parser"):
+            crawler.zyte_api_param_parser = cls(crawler.settings, stats=crawler.stats)
+        return crawler.zyte_api_param_parser
+
+    def __init__(self, settings, *, stats=None):
         self._automap_params = _load_default_params(settings, "ZYTE_API_AUTOMAP_PARAMS")
         self._browser_headers = _load_browser_headers(settings)
         self._default_params = _load_default_params(settings, "ZYTE_API_DEFAULT_PARAMS")
+        if settings.getbool("ZYTE_API_VALIDATE_PARAMS", False):
+            _validate_default_params(self._default_params, "ZYTE_API_DEFAULT_PARAMS")
+            _validate_default_params(self._automap_params, "ZYTE_API_AUTOMAP_PARAMS")
         self._job_id = settings.get("JOB")
         self._transparent_mode = settings.getbool("ZYTE_API_TRANSPARENT_MODE", False)
         self._skip_headers = _load_skip_headers(settings)
-
-    def parse(self, request):
-        return _get_api_params(
-            request,
-            default_params=self._default_params,
-            transparent_mode=self._transparent_mode,
-            automap_params=self._automap_params,
-            skip_headers=self._skip_headers,
-            browser_headers=self._browser_headers,
-            job_id=self._job_id,
+        interval = settings.get("ZYTE_API_PARAM_WARNINGS_INTERVAL")
+        self._param_warnings = _ParamWarnings(
+            stats=stats,
+            interval=None if interval is None else float(interval),
+        )
+        # Automatic mapping plans, by plan key, compiled on demand.
+        self._automap_plans: Dict[Tuple, _AutomapPlan] = {}
+        # Header translations, by header parameter and by header set.
+        self._header_cache: Dict[str, Dict[Tuple, Tuple]] = {}
+        self._cache: "WeakKeyDictionary[Request, Tuple[Tuple, Optional[dict]]]" = (
+            WeakKeyDictionary()
         )
+
+    def parse(self, request, *, forget: bool = False):
+        """Returns the Zyte API parameters of *request*, or ``None`` if it
+        should not be sent through Zyte API.
+
+        Results are memoized per request, and parsed again if the request has
+        been modified in place since, including changes to values nested
+        within the zyte_api and zyte_api_automap request metadata keys, as
+        long as those values are dictionaries, lists or immutable. Other
+        mutable objects nested there must not be modified in place.
+        Request.replace() returns a new request, which is always parsed again.
+
+        If *forget* is ``True``, the memoized result is dropped. The download
+        handler, the last component to parse a request, uses it, so that
+        results are not kept in memory for as long as requests are.
+
+        The returned dictionary is a shallow copy, so callers may add, change
+        or remove its keys.
+        """
+        headers_key = _get_headers_key(request)
+        signature = _request_signature(request, headers_key=headers_key)
+        if forget:
+            cached = self._cache.pop(request, None)
+        else:
+            cached = self._cache.get(request)
+        if cached is not None and cached[0] == signature:
+            api_params = cached[1]
+        else:
+            api_params = _get_api_params(
+                request,
+                default_params=self._default_params,
+                transparent_mode=self._transparent_mode,
+                automap_params=self._automap_params,
+                skip_headers=self._skip_headers,
+                browser_headers=self._browser_headers,
+                job_id=self._job_id,
+                param_warnings=self._param_warnings,
+                automap_plans=self._automap_plans,
+                header_cache=self._header_cache,
+                headers_key=headers_key,
+            )
+            if not forget:
+                self._cache[request] = (signature, api_params)
+        if api_params is None:
+            return None
+        return copy(api_params)
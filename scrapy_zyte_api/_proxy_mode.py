@@ -0,0 +1,167 @@
+import json
+import ssl
+import time
+from base64 import b64decode
+from typing import Any, Dict, Optional
+
+from aiohttp import BasicAuth, ClientSession
+from multidict import CIMultiDict
+from scrapy import Request
+from tenacity import AsyncRetrying
+from zyte_api.aio.client import AsyncClient
+from zyte_api.aio.errors import RequestError
+from zyte_api.stats import ResponseStats
+
+# Zyte API parameters that can be translated into a proxy mode request.
+_PROXY_MODE_PARAMS = frozenset(
+    (
+        "customHttpRequestHeaders",
+        "httpRequestBody",
+        "httpRequestMethod",
+        "httpResponseBody",
+        "httpResponseHeaders",
+        "jobId",
+        "url",
+    )
+)
+
+
+# Default URL of the proxy mode endpoint. HTTPS, so that the API key, sent in
+# the Proxy-Authorization header, is never sent in plain text.
+_DEFAULT_PROXY_MODE_URL = "https://api.zyte.com:8014"
+
+
+def _load_proxy_mode_ssl_context(settings) -> ssl.SSLContext:
+    """Returns the SSL context to verify the proxy mode endpoint and, if the
+    ``ZYTE_API_PROXY_MODE_CA_CERT`` setting is set, also HTTPS target
+    websites, whose traffic Zyte API decrypts and re-encrypts with its own CA
+    certificate."""
+    context = ssl.create_default_context()
+    ca_cert = settings.get("ZYTE_API_PROXY_MODE_CA_CERT")
+    if ca_cert:
+        context.load_verify_locations(cafile=ca_cert)
+    return context
+
+
+def _is_proxy_mode_eligible(
+    api_params: Dict[str, Any], request: Request, *, https: bool = False
+) -> bool:
+    """Returns ``True`` if *api_params* were automatically mapped from
+    *request* and only ask for a plain HTTP response body and headers, which
+    proxy mode can provide without a Base64-inside-JSON envelope.
+
+    HTTPS URLs are only eligible if *https* is ``True``, i.e. if responses
+    re-encrypted by Zyte API can be verified."""
+    return (
+        (https or request.url.startswith("http://"))
+        and not request.meta.get("zyte_api")
+        and api_params.get("httpResponseBody") is True
+        and api_params.get("httpResponseHeaders") is True
+        and api_params.keys() <= _PROXY_MODE_PARAMS
+    )
+
+
+def _proxy_mode_headers(api_params: Dict[str, Any]) -> CIMultiDict:
+    headers: CIMultiDict = CIMultiDict(
+        (header["name"], header["value"])
+        for header in api_params.get("customHttpRequestHeaders", ())
+    )
+    if "jobId" in api_params:
+        headers["Zyte-JobId"] = api_params["jobId"]
+    return headers
+
+
+async def _request_proxy_mode(
+    api_params: Dict[str, Any],
+    *,
+    client: AsyncClient,
+    session: ClientSession,
+    proxy: str,
+    ssl_context: ssl.SSLContext,
+    retrying: Optional[AsyncRetrying] = None,
+) -> Dict[str, Any]:
+    """Sends the request that *api_params* describe through the proxy mode of
+    Zyte API, and returns an equivalent of the Zyte API HTTP API response.
+
+    The ``httpResponseBody`` key of the returned response contains the raw
+    response body as :class:`bytes`, instead of Base64-encoded text.
+
+    Retries, stats and errors are handled as in
+    :meth:`zyte_api.aio.client.AsyncClient.request_raw`, with proxy mode
+    errors, which have a ``Zyte-Error-Type`` response header, reported as
+    :class:`~zyte_api.aio.errors.RequestError`.
+    """
+    retrying = retrying or client.retrying
+    agg_stats = client.agg_stats
+    auth = BasicAuth(client.api_key, "")
+    method = api_params.get("httpRequestMethod", "GET")
+    headers = _proxy_mode_headers(api_params)
+    body = None
+    if "httpRequestBody" in api_params:
+        body = b64decode(api_params["httpRequestBody"])
+    start_global = time.perf_counter()
+
+    async def request():
+        stats = ResponseStats.create(start_global)
+        agg_stats.n_attempts += 1
+        try:
+            async with session.request(
+                method,
+                api_params["url"],
+                headers=headers,
+                data=body,
+                proxy=proxy,
+                proxy_auth=auth,
+                ssl=ssl_context,
+                allow_redirects=False,
+                # Let Zyte API choose these headers, as with the HTTP API.
+                skip_auto_headers=("Accept", "Accept-Encoding", "User-Agent"),
+            ) as resp:
+                error_type = resp.headers.get("Zyte-Error-Type")
+                # Error-free responses are reported as HTTP 200, as the HTTP
+                # API reports target website responses regardless of their
+                # status code.
+                stats.record_connected(resp.status if error_type else 200, agg_stats)
+                content = await resp.read()
+                if error_type:
+                    stats.record_read()
+                    content = json.dumps(
+                        {
+                            "type": error_type,
+                            "title": resp.reason,
+                            "status": resp.status,
+                            "detail": content.decode(errors="replace"),
+                        }
+                    ).encode()
+                    stats.record_request_error(content, agg_stats)
+                    raise RequestError(
+                        request_info=resp.request_info,
+                        history=resp.history,
+                        status=resp.status,
+                        message=resp.reason,
+                        headers=resp.headers,
+                        response_content=content,
+                    )
+                stats.record_read(agg_stats)
+                return {
+                    "url": str(resp.url),
+                    "statusCode": resp.status,
+                    "httpResponseHeaders": [
+                        {"name": name, "value": value}
+                        for name, value in resp.headers.items()
+                    ],
+                    "httpResponseBody": content,
+                }
+        except Exception as e:
+            if not isinstance(e, RequestError):
+                agg_stats.n_errors += 1
+                stats.record_exception(e, agg_stats=agg_stats)
+            raise
+
+    try:
+        result = await retrying.wraps(request)()
+        agg_stats.n_success += 1
+    except Exception:
+        agg_stats.n_fatal_errors += 1
+        raise
+    return result
@@ -1,4 +1,34 @@
-from typing import TYPE_CHECKING
+import hashlib
+import json
+from typing import TYPE_CHECKING, Any, Dict
+
+from w3lib.url import canonicalize_url
+
+_SKIP_KEYS = (
+    "customHttpRequestHeaders",
+    "echoData",
+    "jobId",
+    "requestHeaders",
+)
+
+
+def _keep_fragments(api_params):
+    return any(api_params.get(key, False) for key in ("browserHtml", "screenshot"))
+
+
+def _get_api_params_fingerprint(api_params: Dict[str, Any]) -> bytes:
+    """Returns the fingerprint of the specified Zyte API parameters, without
+    modifying them."""
+    fingerprint_params = {
+        key: value for key, value in api_params.items() if key not in _SKIP_KEYS
+    }
+    fingerprint_params["url"] = canonicalize_url(
+        api_params["url"],
+        keep_fragments=_keep_fragments(api_params),
+    )
+    fingerprint_json = json.dumps(fingerprint_params, sort_keys=True)
+    return hashlib.sha1(fingerprint_json.encode()).digest()
+
 
 try:
     from scrapy.utils.request import RequestFingerprinter  # NOQA
@@ -6,14 +36,11 @@ except ImportError:
     if not TYPE_CHECKING:
         ScrapyZyteAPIRequestFingerprinter = None
 else:
-    import hashlib
-    import json
     from weakref import WeakKeyDictionary
 
     from scrapy import Request
     from scrapy.settings.default_settings import REQUEST_FINGERPRINTER_CLASS
     from scrapy.utils.misc import create_instance, load_object
-    from w3lib.url import canonicalize_url
 
     from ._params import _ParamParser
 
@@ -35,31 +62,13 @@ else:
                 crawler=crawler,
             )
             self._cache: "WeakKeyDictionary[Request, bytes]" = WeakKeyDictionary()
-            self._param_parser = _ParamParser(settings)
-            self._skip_keys = (
-                "customHttpRequestHeaders",
-                "echoData",
-                "jobId",
-                "requestHeaders",
-            )
-
-        def _keep_fragments(self, api_params):
-            return any(
-                api_params.get(key, False) for key in ("browserHtml", "screenshot")
-            )
+            self._param_parser = _ParamParser.from_crawler(crawler)
 
         def fingerprint(self, request):
             if request in self._cache:
                 return self._cache[request]
             api_params = self._param_parser.parse(request)
             if api_params is not None:
-                api_params["url"] = canonicalize_url(
-                    api_params["url"],
-                    keep_fragments=self._keep_fragments(api_params),
-                )
-                for key in self._skip_keys:
-                    api_params.pop(key, None)
-                fingerprint_json = json.dumps(api_params, sort_keys=True)
-                self._cache[request] = hashlib.sha1(fingerprint_json.encode()).digest()
+                self._cache[request] = _get_api_params_fingerprint(api_params)
                 return self._cache[request]
             return self._fallback_request_fingerprinter.fingerprint(request)
@@ -0,0 +1,73 @@
+from logging import getLogger
+from typing import Callable
+from weakref import WeakKeyDictionary
+
+from scrapy.statscollectors import StatsCollector
+from tenacity import AsyncRetrying, RetryCallState
+
+logger = getLogger(__name__)
+
+
+class _BudgetedStop:
+    """Stop condition of a retry policy that, when the original stop
+    condition of the policy allows a retry, also requires a token from a
+    retry budget."""
+
+    def __init__(self, stop: Callable[[RetryCallState], bool], budget: "_RetryBudget"):
+        self._stop = stop
+        self._budget = budget
+
+    def __call__(self, retry_state: RetryCallState) -> bool:
+        return self._stop(retry_state) or not self._budget.withdraw()
+
+
+class _RetryBudget:
+    """Token bucket that limits retries of all Zyte API requests combined to
+    a *ratio* of the number of Zyte API requests.
+
+    Every request adds *ratio* tokens to the bucket, and every retry takes 1
+    token from it. The bucket starts full, with *max_tokens* tokens, which is
+    also the most it can hold, so that up to *max_tokens* retries can happen
+    in a row when failures are rare.
+    """
+
+    def __init__(self, ratio: float, *, max_tokens: float = 10.0):
+        if ratio < 0:
+            raise ValueError(
+                f"The retry budget ratio must be 0 or higher, got {ratio}."
+            )
+        self._ratio = ratio
+        self._max_tokens = max_tokens
+        self._policies: WeakKeyDictionary = WeakKeyDictionary()
+        self.tokens = max_tokens
+        self.retries = 0
+        self.denied = 0
+
+    def deposit(self):
+        self.tokens = min(self.tokens + self._ratio, self._max_tokens)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            if not self.denied:
+                logger.warning(
+                    "The Zyte API retry budget is exhausted, some Zyte API "
+                    "requests will not be retried."
+                )
+            self.denied += 1
+            return False
+        self.tokens -= 1
+        self.retries += 1
+        return True
+
+    def wrap(self, retrying: AsyncRetrying) -> AsyncRetrying:
+        """Returns a copy of *retrying* whose retries are subject to this
+        budget."""
+        if retrying not in self._policies:
+            self._policies[retrying] = retrying.copy(
+                stop=_BudgetedStop(retrying.stop, self)
+            )
+        return self._policies[retrying]
+
+    def update_stats(self, stats: StatsCollector, prefix: str):
+        stats.set_value(f"{prefix}/retry_budget/retries", self.retries)
+        stats.set_value(f"{prefix}/retry_budget/denied", self.denied)
@@ -0,0 +1,28 @@
+from time import perf_counter
+from typing import Dict, Optional
+
+_ENQUEUED_META_KEY = "_zyte_api_enqueued"
+
+
+class _RequestTimer:
+    """Records how long each stage of a Zyte API request takes.
+
+    Each call to :meth:`mark` records the time elapsed since the previous
+    call, or since the timer was created, as the duration of the specified
+    stage.
+
+    If *enqueued* is set to the :func:`~time.perf_counter` value at which the
+    request reached the downloader, the time elapsed since then is recorded as
+    the ``scheduling`` stage.
+    """
+
+    def __init__(self, enqueued: Optional[float] = None):
+        self._last = perf_counter()
+        self.timings: Dict[str, float] = {}
+        if enqueued is not None:
+            self.timings["scheduling"] = self._last - enqueued
+
+    def mark(self, stage: str):
+        now = perf_counter()
+        self.timings[stage] = now - self._last
+        self._last = now
@@ -0,0 +1,36 @@
+from typing import Any, Dict, List
+
+# Parameters that Zyte API only accepts as booleans.
+_BOOLEAN_PARAMS = (
+    "browserHtml",
+    "httpResponseBody",
+    "httpResponseHeaders",
+    "screenshot",
+)
+
+# Pairs of parameters that Zyte API rejects when both are enabled.
+_INCOMPATIBLE_PARAMS = (
+    ("browserHtml", "httpResponseBody"),
+    ("screenshot", "httpResponseBody"),
+    ("actions", "httpResponseBody"),
+    ("httpRequestBody", "httpRequestText"),
+)
+
+
+def _get_param_errors(api_params: Dict[str, Any]) -> List[str]:
+    """Returns a list of the problems found in *api_params* that would make
+    Zyte API reject the request, empty if none are found.
+
+    Only a few, well-known problems are checked, so that checking every
+    request is cheap. Unknown parameters are not reported, since they may be
+    supported by Zyte API.
+    """
+    errors = []
+    for param in _BOOLEAN_PARAMS:
+        value = api_params.get(param)
+        if value is not None and not isinstance(value, bool):
+            errors.append(f"{param} must be a boolean, got {value!r}")
+    for param1, param2 in _INCOMPATIBLE_PARAMS:
+        if api_params.get(param1) and api_params.get(param2):
+            errors.append(f"{param1} and {param2} cannot be combined")
+    return errors
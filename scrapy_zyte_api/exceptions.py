@@ -0,0 +1,38 @@
+"""Exceptions raised by scrapy-zyte-api."""
+
+from typing import List
+
+
+class ZyteAPITimeoutError(Exception):
+    """Raised when a Zyte API request, retries included, does not finish
+    within its time budget, set through the ``zyte_api_timeout`` request meta
+    key or the ``ZYTE_API_TIMEOUT`` setting."""
+
+    def __init__(self, timeout: float):
+        super().__init__(
+            f"The Zyte API request did not finish within {timeout} seconds."
+        )
+        self.timeout = timeout
+
+
+class ZyteAPICircuitOpenError(Exception):
+    """Raised instead of sending a Zyte API request when too many recent Zyte
+    API requests to the same domain failed, if the
+    ``ZYTE_API_CIRCUIT_BREAKER`` setting is ``True``."""
+
+    def __init__(self, domain: str):
+        super().__init__(
+            f"Not sending a Zyte API request to {domain}: too many recent Zyte "
+            f"API requests to {domain} failed."
+        )
+        self.domain = domain
+
+
+class ZyteAPIInvalidParamsError(ValueError):
+    """Raised instead of sending a Zyte API request whose parameters Zyte API
+    is known to reject, if the ``ZYTE_API_VALIDATE_PARAMS`` setting is
+    ``True``."""
+
+    def __init__(self, errors: List[str]):
+        super().__init__(f"Invalid Zyte API parameters: {'; '.join(errors)}.")
+        self.errors = errors
@@ -1,48 +1,124 @@
+import asyncio
+import hashlib
 import json
 import logging
-from copy import deepcopy
-from typing import Generator, Optional, Union
+from copy import copy
+from functools import partial
+from time import perf_counter
+from typing import Any, Callable, Dict, Generator, List, Optional, Tuple, Union
 
-from scrapy import Spider
+from aiohttp import ClientSession
+from scrapy import Spider, signals
 from scrapy.core.downloader.handlers.http import HTTPDownloadHandler
 from scrapy.crawler import Crawler
 from scrapy.exceptions import NotConfigured
 from scrapy.http import Request
 from scrapy.settings import Settings
 from scrapy.utils.defer import deferred_from_coro
+from scrapy.utils.httpobj import urlparse_cached
 from scrapy.utils.misc import load_object
 from scrapy.utils.reactor import verify_installed_reactor
 from twisted.internet.defer import Deferred, inlineCallbacks
+from twisted.internet.task import LoopingCall
 from zyte_api.aio.client import AsyncClient, create_session
 from zyte_api.aio.errors import RequestError
 from zyte_api.apikey import NoApiKey
 from zyte_api.constants import API_URL
+from zyte_api.stats import AggStats
 
+from ._circuit_breaker import _TARGET_ERROR_STATUSES, _CircuitBreaker
+from ._concurrency import _AdaptiveConcurrencyLimiter, _ConcurrencyLimiter
+from ._endpoints import _EndpointRouter
+from ._hedging import _Hedger
+from ._json import _load_json_codec
+from ._key_pool import _KeyPool, _load_api_keys, _PooledKey
+from ._latency import _LatencyStats, _LoopLagMonitor
 from ._params import _ParamParser
+from ._proxy_mode import (
+    _DEFAULT_PROXY_MODE_URL,
+    _is_proxy_mode_eligible,
+    _load_proxy_mode_ssl_context,
+    _request_proxy_mode,
+)
+from ._retry_budget import _RetryBudget
+from ._timings import _ENQUEUED_META_KEY, _RequestTimer
+from ._validation import _get_param_errors
+from .exceptions import (
+    ZyteAPICircuitOpenError,
+    ZyteAPIInvalidParamsError,
+    ZyteAPITimeoutError,
+)
 from .responses import ZyteAPIResponse, ZyteAPITextResponse, _process_response
+from .signals import request_timed
 
 logger = logging.getLogger(__name__)
 
+# Size, in Base64 characters, of the chunks in which httpResponseBody is
+# decoded off the reactor thread.
+_DECODE_CHUNK_SIZE = 256 * 1024
 
-def _truncate_str(obj, index, text, limit):
-    if len(text) <= limit:
-        return
-    obj[index] = text[: limit - 1] + "…"
 
-
-def _truncate(obj, limit):
+def _dump_truncated(obj, limit: int, dumps: Callable[[Any], str]) -> str:
+    """Returns *obj* as JSON, with string values longer than *limit*
+    truncated, without copying *obj*."""
+    if isinstance(obj, str):
+        if len(obj) > limit:
+            obj = obj[: limit - 1] + "…"
+        return dumps(obj)
     if isinstance(obj, dict):
-        for key, value in obj.items():
-            if isinstance(value, str):
-                _truncate_str(obj, key, value, limit)
-            elif isinstance(value, (list, dict)):
-                _truncate(value, limit)
-    elif isinstance(obj, list):
-        for index, value in enumerate(obj):
-            if isinstance(value, str):
-                _truncate_str(obj, index, value, limit)
-            elif isinstance(value, (list, dict)):
-                _truncate(value, limit)
+        items = (
+            f"{dumps(key)}: {_dump_truncated(value, limit, dumps)}"
+            for key, value in obj.items()
+        )
+        return f"{{{', '.join(items)}}}"
+    if isinstance(obj, list):
+        values = (_dump_truncated(value, limit, dumps) for value in obj)
+        return f"[{', '.join(values)}]"
+    return dumps(obj)
+
+
+class _LoggedParams:
+    """Zyte API request parameters that are only serialized for logging if
+    the log record is actually emitted."""
+
+    __slots__ = ("_params", "_limit", "_dumps")
+
+    def __init__(self, params: dict, limit: int, dumps: Callable[[Any], str]):
+        self._params = params
+        self._limit = limit
+        self._dumps = dumps
+
+    def __str__(self) -> str:
+        if self._limit == 0:
+            return self._dumps(self._params)
+        return _dump_truncated(self._params, self._limit, self._dumps)
+
+
+# Zyte API parameters that do not affect the Zyte API response, other than
+# echoData, which is handled separately, so requests that only differ in them
+# can be coalesced.
+_COALESCING_SKIP_KEYS = ("echoData", "jobId")
+
+
+def _get_coalescing_key(api_params: dict, timeout, retry_policy) -> Tuple:
+    params = {
+        key: value
+        for key, value in api_params.items()
+        if key not in _COALESCING_SKIP_KEYS
+    }
+    params_json = json.dumps(params, sort_keys=True)
+    return (hashlib.sha1(params_json.encode()).digest(), timeout, retry_policy)
+
+
+class _InFlightRequest:
+    """A Zyte API request shared by coalesced requests, which is cancelled
+    only once all of them have been cancelled."""
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
 
 
 def _load_retry_policy(settings):
@@ -59,22 +135,106 @@ class ScrapyZyteAPIDownloadHandler(HTTPDownloadHandler):
         super().__init__(settings=settings, crawler=crawler)
         if not settings.getbool("ZYTE_API_ENABLED", True):
             raise NotConfigured
+        if not hasattr(crawler, "zyte_api_key_pool"):
+            crawler.zyte_api_key_pool = self._build_key_pool(settings)
+        self._key_pool: Optional[_KeyPool] = crawler.zyte_api_key_pool
         if not hasattr(crawler, "zyte_api_client"):
             if not client:
-                client = self._build_client(settings)
+                if self._key_pool is not None:
+                    client = self._key_pool.keys[0].client
+                else:
+                    client = self._build_client(settings)
             # We keep the client in the crawler object to prevent multiple,
             # duplicate clients with the same settings to be used.
             # https://github.com/scrapy-plugins/scrapy-zyte-api/issues/58
             crawler.zyte_api_client = client
         self._client: AsyncClient = crawler.zyte_api_client
-        logger.info("Using a Zyte API key starting with %r", self._client.api_key[:7])
+        if self._key_pool is not None:
+            logger.info(
+                "Using Zyte API keys starting with %s",
+                ", ".join(repr(key.client.api_key[:7]) for key in self._key_pool.keys),
+            )
+        else:
+            logger.info(
+                "Using a Zyte API key starting with %r", self._client.api_key[:7]
+            )
+        if not hasattr(crawler, "zyte_api_concurrency_limiter"):
+            crawler.zyte_api_concurrency_limiter = None
+            if self._key_pool is None:
+                crawler.zyte_api_concurrency_limiter = self._build_concurrency_limiter(
+                    settings, self._client
+                )
+        self._concurrency_limiter: Optional[_ConcurrencyLimiter] = (
+            crawler.zyte_api_concurrency_limiter
+        )
         verify_installed_reactor(
             "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
         )
-        self._param_parser = _ParamParser(settings)
+        self._param_parser = _ParamParser.from_crawler(crawler)
         self._retry_policy = _load_retry_policy(settings)
+        if not hasattr(crawler, "zyte_api_retry_budget"):
+            crawler.zyte_api_retry_budget = self._build_retry_budget(settings)
+        self._retry_budget: Optional[_RetryBudget] = crawler.zyte_api_retry_budget
         self._stats = crawler.stats
-        self._session = create_session(connection_pool_size=self._client.n_conn)
+        self._signals = crawler.signals
+        self._stats_interval = settings.getfloat("ZYTE_API_STATS_INTERVAL", 1.0)
+        self._stats_outdated = False
+        self._stats_loop = LoopingCall(self._flush_stats)
+        self._proxy_mode_url: Optional[str] = None
+        if settings.getbool("ZYTE_API_PROXY_MODE", False):
+            self._proxy_mode_url = settings.get(
+                "ZYTE_API_PROXY_MODE_URL", _DEFAULT_PROXY_MODE_URL
+            )
+            self._proxy_mode_ssl_context = _load_proxy_mode_ssl_context(settings)
+            self._proxy_mode_https = bool(settings.get("ZYTE_API_PROXY_MODE_CA_CERT"))
+        self._json_codec = _load_json_codec(settings)
+        self._decode_thread_threshold = settings.getint(
+            "ZYTE_API_DECODE_THREAD_THRESHOLD", 1024 * 1024
+        )
+        self._session_kwargs = self._json_codec.session_kwargs(
+            thread_threshold=self._decode_thread_threshold
+        )
+        self._session = create_session(
+            connection_pool_size=self._client.n_conn,
+            **self._session_kwargs,
+        )
+        if not hasattr(crawler, "zyte_api_endpoint_router"):
+            crawler.zyte_api_endpoint_router = self._build_endpoint_router(settings)
+        self._endpoint_router: Optional[_EndpointRouter] = (
+            crawler.zyte_api_endpoint_router
+        )
+        # Clients and sessions for the endpoints of the endpoint router, by key
+        # index (None if there is no key pool) and endpoint index, created on
+        # demand.
+        self._endpoint_transports: Dict[
+            Tuple[Optional[int], int], Tuple[AsyncClient, ClientSession]
+        ] = {}
+        # Sessions for the keys of the key pool, by key index.
+        self._key_sessions: List[ClientSession] = []
+        if self._key_pool is not None:
+            self._key_sessions = [
+                create_session(
+                    connection_pool_size=key.client.n_conn,
+                    **self._session_kwargs,
+                )
+                for key in self._key_pool.keys
+            ]
+        self._lean_raw_api_response = settings.getbool(
+            "ZYTE_API_LEAN_RAW_API_RESPONSE", False
+        )
+        self._timings = settings.getbool("ZYTE_API_TIMINGS", False)
+        self._timeout = settings.getfloat("ZYTE_API_TIMEOUT", 0.0)
+        if not hasattr(crawler, "zyte_api_hedger"):
+            crawler.zyte_api_hedger = self._build_hedger(settings)
+        self._hedger: Optional[_Hedger] = crawler.zyte_api_hedger
+        if not hasattr(crawler, "zyte_api_circuit_breaker"):
+            crawler.zyte_api_circuit_breaker = self._build_circuit_breaker(settings)
+        self._circuit_breaker: Optional[_CircuitBreaker] = (
+            crawler.zyte_api_circuit_breaker
+        )
+        self._validate_params = settings.getbool("ZYTE_API_VALIDATE_PARAMS", False)
+        self._coalesce_requests = settings.getbool("ZYTE_API_COALESCE_REQUESTS", False)
+        self._in_flight: Dict[Tuple, _InFlightRequest] = {}
         self._must_log_request = settings.getbool("ZYTE_API_LOG_REQUESTS", False)
         self._truncate_limit = settings.getint("ZYTE_API_LOG_REQUESTS_TRUNCATE", 64)
         if self._truncate_limit < 0:
@@ -83,9 +243,56 @@ class ScrapyZyteAPIDownloadHandler(HTTPDownloadHandler):
                 f"({self._truncate_limit}) is invalid. It must be 0 or a "
                 f"positive integer."
             )
+        self._log_sample_rate = settings.getfloat(
+            "ZYTE_API_LOG_REQUESTS_SAMPLE_RATE", 1.0
+        )
+        if not 0 < self._log_sample_rate <= 1:
+            raise ValueError(
+                f"The value of the ZYTE_API_LOG_REQUESTS_SAMPLE_RATE setting "
+                f"({self._log_sample_rate}) is invalid. It must be greater "
+                f"than 0 and lower than or equal to 1."
+            )
+        self._log_sample_credit = 1.0
+        # Timers are started last, so that invalid settings found above do
+        # not leave them running.
+        self._init_monitoring(crawler, settings)
+        if self._stats_interval > 0:
+            self._stats_loop.start(self._stats_interval, now=False)
+            # Stats are dumped before download handlers are closed.
+            crawler.signals.connect(self._flush_stats, signal=signals.spider_closed)
+
+    def _init_monitoring(self, crawler: Crawler, settings: Settings):
+        self._latency_log_loop: Optional[LoopingCall] = None
+        if not hasattr(crawler, "zyte_api_latency_stats"):
+            crawler.zyte_api_latency_stats = None
+            if settings.getbool("ZYTE_API_LATENCY_STATS", False):
+                crawler.zyte_api_latency_stats = _LatencyStats(
+                    by_domain=settings.getbool(
+                        "ZYTE_API_LATENCY_STATS_BY_DOMAIN", False
+                    ),
+                    max_domains=settings.getint(
+                        "ZYTE_API_LATENCY_STATS_MAX_DOMAINS", 100
+                    ),
+                )
+                interval = settings.getfloat("ZYTE_API_LATENCY_LOG_INTERVAL", 60.0)
+                if interval > 0:
+                    self._latency_log_loop = LoopingCall(
+                        crawler.zyte_api_latency_stats.log
+                    )
+                    self._latency_log_loop.start(interval, now=False)
+        self._latency_stats: Optional[_LatencyStats] = crawler.zyte_api_latency_stats
+        if not hasattr(crawler, "zyte_api_loop_lag_monitor"):
+            crawler.zyte_api_loop_lag_monitor = None
+            interval = settings.getfloat("ZYTE_API_LOOP_LAG_INTERVAL", 0.0)
+            if interval > 0:
+                crawler.zyte_api_loop_lag_monitor = _LoopLagMonitor(interval)
+                crawler.zyte_api_loop_lag_monitor.start()
+        self._loop_lag_monitor: Optional[_LoopLagMonitor] = (
+            crawler.zyte_api_loop_lag_monitor
+        )
 
     @staticmethod
-    def _build_client(settings):
+    def _build_client(settings, api_key: Optional[str] = None):
         try:
             return AsyncClient(
                 # To allow users to have a key defined in Scrapy settings and
@@ -94,7 +301,7 @@ class ScrapyZyteAPIDownloadHandler(HTTPDownloadHandler):
                 # overriding the setting on the command-line to be an empty
                 # string, we do not support setting empty string keys through
                 # settings.
-                api_key=settings.get("ZYTE_API_KEY") or None,
+                api_key=api_key or settings.get("ZYTE_API_KEY") or None,
                 api_url=settings.get("ZYTE_API_URL") or API_URL,
                 n_conn=settings.getint("CONCURRENT_REQUESTS"),
             )
@@ -105,16 +312,118 @@ class ScrapyZyteAPIDownloadHandler(HTTPDownloadHandler):
             )
             raise NotConfigured
 
+    @staticmethod
+    def _build_concurrency_limiter(settings, client):
+        if settings.getbool("ZYTE_API_ADAPTIVE_CONCURRENCY", False):
+            return _AdaptiveConcurrencyLimiter(
+                minimum=settings.getint("ZYTE_API_ADAPTIVE_CONCURRENCY_MIN", 1),
+                maximum=client.n_conn,
+            )
+        if settings.getbool("ZYTE_API_PRIORITY_DISPATCH", False):
+            return _ConcurrencyLimiter(
+                settings.getint("ZYTE_API_PRIORITY_DISPATCH_CONCURRENCY")
+                or client.n_conn
+            )
+        return None
+
+    @classmethod
+    def _build_key_pool(cls, settings) -> Optional[_KeyPool]:
+        api_keys = _load_api_keys(settings)
+        if not api_keys:
+            return None
+        keys = []
+        for api_key, weight in api_keys.items():
+            client = cls._build_client(settings, api_key)
+            keys.append(
+                _PooledKey(
+                    client,
+                    weight=weight,
+                    concurrency_limiter=cls._build_concurrency_limiter(
+                        settings, client
+                    ),
+                )
+            )
+        return _KeyPool(keys)
+
+    @staticmethod
+    def _build_endpoint_router(settings) -> Optional[_EndpointRouter]:
+        urls = settings.getlist("ZYTE_API_URLS")
+        if not urls:
+            return None
+        return _EndpointRouter(
+            urls,
+            max_errors=settings.getint("ZYTE_API_ENDPOINT_MAX_ERRORS", 3),
+            cooldown=settings.getfloat("ZYTE_API_ENDPOINT_COOLDOWN", 30.0),
+        )
+
+    @staticmethod
+    def _build_retry_budget(settings) -> Optional[_RetryBudget]:
+        ratio = settings.get("ZYTE_API_RETRY_BUDGET")
+        if ratio is None:
+            return None
+        return _RetryBudget(
+            float(ratio),
+            max_tokens=settings.getfloat("ZYTE_API_RETRY_BUDGET_MAX_TOKENS", 10.0),
+        )
+
+    @staticmethod
+    def _build_hedger(settings) -> Optional[_Hedger]:
+        if not settings.getbool("ZYTE_API_HEDGING", False):
+            return None
+        return _Hedger(
+            percentile=settings.getfloat("ZYTE_API_HEDGING_PERCENTILE", 95.0),
+            max_ratio=settings.getfloat("ZYTE_API_HEDGING_MAX_RATIO", 0.05),
+        )
+
+    @staticmethod
+    def _build_circuit_breaker(settings) -> Optional[_CircuitBreaker]:
+        if not settings.getbool("ZYTE_API_CIRCUIT_BREAKER", False):
+            return None
+        return _CircuitBreaker(
+            max_failures=settings.getint("ZYTE_API_CIRCUIT_BREAKER_MAX_FAILURES", 10),
+            window=settings.getfloat("ZYTE_API_CIRCUIT_BREAKER_WINDOW", 60.0),
+            cooldown=settings.getfloat("ZYTE_API_CIRCUIT_BREAKER_COOLDOWN", 60.0),
+            probes=settings.getint("ZYTE_API_CIRCUIT_BREAKER_PROBES", 1),
+        )
+
+    def _get_endpoint_transport(
+        self, key_index: Optional[int], endpoint_index: int, client: AsyncClient
+    ) -> Tuple[AsyncClient, ClientSession]:
+        assert self._endpoint_router is not None
+        transport_key = (key_index, endpoint_index)
+        if transport_key not in self._endpoint_transports:
+            # A shallow copy shares API key, retry policy and stats.
+            endpoint_client = copy(client)
+            endpoint_client.api_url = self._endpoint_router.endpoints[
+                endpoint_index
+            ].url
+            session = create_session(
+                connection_pool_size=client.n_conn,
+                **self._session_kwargs,
+            )
+            self._endpoint_transports[transport_key] = (endpoint_client, session)
+        return self._endpoint_transports[transport_key]
+
     def download_request(self, request: Request, spider: Spider) -> Deferred:
-        api_params = self._param_parser.parse(request)
+        timer = None
+        if self._timings:
+            timer = _RequestTimer(request.meta.get(_ENQUEUED_META_KEY))
+        api_params = self._param_parser.parse(request, forget=True)
         if api_params is not None:
+            if timer is not None:
+                timer.mark("params")
             return deferred_from_coro(
-                self._download_request(api_params, request, spider)
+                self._download_request(api_params, request, spider, timer)
             )
         return super().download_request(request, spider)
 
-    def _update_stats(self):
-        prefix = "scrapy-zyte-api"
+    def _flush_stats(self):
+        if not self._stats_outdated:
+            return
+        self._stats_outdated = False
+        self._update_stats()
+
+    def _set_agg_stats(self, agg_stats: AggStats, prefix: str):
         for stat in (
             "429",
             "attempts",
@@ -125,7 +434,7 @@ class ScrapyZyteAPIDownloadHandler(HTTPDownloadHandler):
         ):
             self._stats.set_value(
                 f"{prefix}/{stat}",
-                getattr(self._client.agg_stats, f"n_{stat}"),
+                getattr(agg_stats, f"n_{stat}"),
             )
         for stat in (
             "error_ratio",
@@ -134,7 +443,7 @@ class ScrapyZyteAPIDownloadHandler(HTTPDownloadHandler):
         ):
             self._stats.set_value(
                 f"{prefix}/{stat}",
-                getattr(self._client.agg_stats, stat)(),
+                getattr(agg_stats, stat)(),
             )
         for source, target in (
             ("connect", "connection"),
@@ -142,10 +451,10 @@ class ScrapyZyteAPIDownloadHandler(HTTPDownloadHandler):
         ):
             self._stats.set_value(
                 f"{prefix}/mean_{target}_seconds",
-                getattr(self._client.agg_stats, f"time_{source}_stats").mean(),
+                getattr(agg_stats, f"time_{source}_stats").mean(),
             )
 
-        for error_type, count in self._client.agg_stats.api_error_types.items():
+        for error_type, count in agg_stats.api_error_types.items():
             error_type = error_type or "/<empty>"
             if not error_type.startswith("/"):
                 error_type = f"/{error_type}"
@@ -155,26 +464,209 @@ class ScrapyZyteAPIDownloadHandler(HTTPDownloadHandler):
             "exception_types",
             "status_codes",
         ):
-            for key, value in getattr(self._client.agg_stats, counter).items():
+            for key, value in getattr(agg_stats, counter).items():
                 self._stats.set_value(f"{prefix}/{counter}/{key}", value)
 
+    def _update_stats(self):
+        prefix = "scrapy-zyte-api"
+        if self._key_pool is None:
+            self._set_agg_stats(self._client.agg_stats, prefix)
+        else:
+            self._set_agg_stats(self._key_pool.agg_stats(), prefix)
+            for key in self._key_pool.keys:
+                key_prefix = f"{prefix}/keys/{key.name}"
+                self._set_agg_stats(key.client.agg_stats, key_prefix)
+                if isinstance(key.concurrency_limiter, _AdaptiveConcurrencyLimiter):
+                    self._stats.set_value(
+                        f"{key_prefix}/adaptive_concurrency",
+                        key.concurrency_limiter.limit,
+                    )
+
+        if self._latency_stats is not None:
+            self._latency_stats.update_stats(self._stats, prefix)
+
+        if self._endpoint_router is not None:
+            self._endpoint_router.update_stats(self._stats, prefix)
+
+        if self._loop_lag_monitor is not None:
+            self._loop_lag_monitor.update_stats(self._stats, prefix)
+
+        if self._retry_budget is not None:
+            self._retry_budget.update_stats(self._stats, prefix)
+
+        if self._circuit_breaker is not None:
+            self._circuit_breaker.update_stats(self._stats, prefix)
+
+        if isinstance(self._concurrency_limiter, _AdaptiveConcurrencyLimiter):
+            self._stats.set_value(
+                f"{prefix}/adaptive_concurrency", self._concurrency_limiter.limit
+            )
+
     async def _download_request(
-        self, api_params: dict, request: Request, spider: Spider
+        self,
+        api_params: dict,
+        request: Request,
+        spider: Spider,
+        timer: Optional[_RequestTimer] = None,
     ) -> Optional[Union[ZyteAPITextResponse, ZyteAPIResponse]]:
+        api_response = await self._get_api_response(api_params, request, timer)
+        http_response_body = api_response.get("httpResponseBody")
+        if isinstance(
+            http_response_body, str
+        ) and 0 < self._decode_thread_threshold <= len(http_response_body):
+            # Decoding multi-MB bodies would otherwise block the reactor.
+            self._stats.inc_value("scrapy-zyte-api/threaded_decoding")
+            response = await asyncio.get_running_loop().run_in_executor(
+                None,
+                partial(
+                    _process_response,
+                    api_response,
+                    request,
+                    lean=self._lean_raw_api_response,
+                    timer=timer,
+                    decode_chunk_size=_DECODE_CHUNK_SIZE,
+                ),
+            )
+        else:
+            response = _process_response(
+                api_response, request, lean=self._lean_raw_api_response, timer=timer
+            )
+        if timer is not None:
+            request.meta["zyte_api_timings"] = timer.timings
+            self._signals.send_catch_log(
+                signal=request_timed,
+                request=request,
+                response=response,
+                spider=spider,
+                timings=timer.timings,
+            )
+        return response
+
+    async def _get_api_response(
+        self, api_params: dict, request: Request, timer: Optional[_RequestTimer]
+    ) -> dict:
+        if not self._coalesce_requests:
+            return await self._request_api(api_params, request, timer)
+
+        key = _get_coalescing_key(
+            api_params,
+            request.meta.get("zyte_api_timeout", self._timeout),
+            request.meta.get("zyte_api_retry_policy") or None,
+        )
+        in_flight = self._in_flight.get(key)
+        original = in_flight is None
+        if in_flight is None:
+            task = asyncio.ensure_future(self._request_api(api_params, request, timer))
+            in_flight = self._in_flight[key] = _InFlightRequest(task)
+            task.add_done_callback(partial(self._forget_in_flight, key, in_flight))
+        else:
+            self._stats.inc_value("scrapy-zyte-api/coalesced")
+        in_flight.waiters += 1
+        try:
+            # Shielded so that cancelling one of the coalesced requests does
+            # not cancel the others.
+            api_response = await asyncio.shield(in_flight.task)
+        except asyncio.CancelledError:
+            if in_flight.waiters == 1:
+                in_flight.task.cancel()
+            raise
+        finally:
+            in_flight.waiters -= 1
+        # Each response gets its own copy of the raw API response, with its own
+        # echoData, which does not affect coalescing.
+        api_response = copy(api_response)
+        if not original:
+            if timer is not None:
+                timer.mark("api")
+            if "echoData" in api_params:
+                api_response["echoData"] = api_params["echoData"]
+            else:
+                api_response.pop("echoData", None)
+        return api_response
+
+    def _forget_in_flight(
+        self, key: Tuple, in_flight: _InFlightRequest, task: asyncio.Future
+    ):
+        if self._in_flight.get(key) is in_flight:
+            del self._in_flight[key]
+
+    async def _request_api(
+        self,
+        api_params: dict,
+        request: Request,
+        timer: Optional[_RequestTimer] = None,
+    ) -> dict:
         # Define url by default
         retrying = request.meta.get("zyte_api_retry_policy")
         if retrying:
             retrying = load_object(retrying)
         else:
             retrying = self._retry_policy
-        self._log_request(api_params)
+        timeout = request.meta.get("zyte_api_timeout", self._timeout)
+        domain = urlparse_cached(request).hostname or ""
+        if self._validate_params:
+            errors = _get_param_errors(api_params)
+            if errors:
+                self._stats.inc_value("scrapy-zyte-api/param_validation/rejected")
+                raise ZyteAPIInvalidParamsError(errors)
+        circuit_breaker = self._circuit_breaker
+        permit = None
+        if circuit_breaker is not None:
+            permit = circuit_breaker.allow(domain)
+            if permit is None:
+                self._stats.inc_value("scrapy-zyte-api/circuit_breaker/rejected")
+                raise ZyteAPICircuitOpenError(domain)
+        # Whether the target website failed to download, for the circuit
+        # breaker: None if unknown.
+        failed: Optional[bool] = None
+        client, session = self._client, self._session
+        concurrency_limiter = self._concurrency_limiter
+        acquired = False
+        # Everything after allow() happens within this try, so that every
+        # allowed request is recorded, even if cancelled while queued.
         try:
-            api_response = await self._client.request_raw(
+            self._log_request(api_params)
+            key_index = None
+            if self._key_pool is not None:
+                key_index = self._key_pool.select()
+                key = self._key_pool.keys[key_index]
+                client, session = key.client, self._key_sessions[key_index]
+                concurrency_limiter = key.concurrency_limiter
+            if self._retry_budget is not None:
+                self._retry_budget.deposit()
+                retrying = self._retry_budget.wrap(retrying or client.retrying)
+            if concurrency_limiter is not None:
+                await concurrency_limiter.acquire(request.priority)
+                acquired = True
+            if timer is not None:
+                timer.mark("queue")
+            start = perf_counter()
+            send = partial(
+                self._send_request,
                 api_params,
-                session=self._session,
+                request,
+                client=client,
+                session=session,
+                key_index=key_index,
                 retrying=retrying,
             )
+            if self._hedger is not None:
+                coro = self._send_hedged_request(send, api_params)
+            else:
+                coro = send()
+            api_response = await self._with_timeout(coro, timeout)
+            failed = False
+            if timer is not None:
+                timer.mark("api")
+            if self._latency_stats is not None:
+                self._latency_stats.record(
+                    perf_counter() - start,
+                    api_params=api_params,
+                    domain=domain,
+                )
         except RequestError as er:
+            if er.status in _TARGET_ERROR_STATUSES:
+                failed = True
             error_detail = (er.parsed.data or {}).get("detail", er.message)
             logger.error(
                 f"Got Zyte API error (status={er.status}, type={er.parsed.type!r}) "
@@ -187,22 +679,151 @@ class ScrapyZyteAPIDownloadHandler(HTTPDownloadHandler):
             )
             raise
         finally:
-            self._update_stats()
+            if circuit_breaker is not None and permit is not None:
+                circuit_breaker.record(permit, failed)
+            if concurrency_limiter is not None and acquired:
+                concurrency_limiter.release()
+                concurrency_limiter.update(client.agg_stats)
+            if self._stats_interval > 0:
+                self._stats_outdated = True
+            else:
+                self._update_stats()
 
-        return _process_response(api_response, request)
+        return api_response
+
+    async def _send_request(
+        self,
+        api_params: dict,
+        request: Request,
+        *,
+        client: AsyncClient,
+        session: ClientSession,
+        key_index: Optional[int],
+        retrying,
+    ) -> dict:
+        if self._proxy_mode_url is not None and _is_proxy_mode_eligible(
+            api_params, request, https=self._proxy_mode_https
+        ):
+            self._stats.inc_value("scrapy-zyte-api/proxy_mode")
+            return await _request_proxy_mode(
+                api_params,
+                client=client,
+                session=session,
+                proxy=self._proxy_mode_url,
+                ssl_context=self._proxy_mode_ssl_context,
+                retrying=retrying,
+            )
+        if self._endpoint_router is None:
+            return await client.request_raw(
+                api_params,
+                session=session,
+                retrying=retrying,
+            )
+        endpoint_index = self._endpoint_router.select()
+        client, session = self._get_endpoint_transport(
+            key_index, endpoint_index, client
+        )
+        start = perf_counter()
+        try:
+            api_response = await client.request_raw(
+                api_params,
+                session=session,
+                retrying=retrying,
+            )
+        except asyncio.CancelledError:
+            raise
+        except RequestError as er:
+            if er.status >= 500:
+                self._endpoint_router.record_error(endpoint_index)
+            raise
+        except Exception:
+            self._endpoint_router.record_error(endpoint_index)
+            raise
+        self._endpoint_router.record_success(endpoint_index, perf_counter() - start)
+        return api_response
+
+    async def _send_hedged_request(self, send, api_params: dict) -> dict:
+        """Awaits *send()* and, if it takes longer than the hedger allows,
+        also a second *send()*, returning the first successful response and
+        cancelling the other request.
+
+        The response time of the original request is recorded in the hedger
+        once it succeeds or, if it is cancelled, e.g. because the hedged
+        request won or because of a timeout, its time so far is recorded as a
+        lower bound, so that slow requests are not left out of the recorded
+        distribution."""
+        hedger = self._hedger
+        assert hedger is not None
+        tasks = [asyncio.ensure_future(send())]
+        start = perf_counter()
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedger.delay(api_params))
+            if not done and hedger.hedge():
+                self._stats.inc_value("scrapy-zyte-api/hedging/requests")
+                tasks.append(asyncio.ensure_future(send()))
+            pending = set(tasks)
+            while True:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for index, task in enumerate(tasks):
+                    if task in done and task.exception() is None:
+                        if index > 0:
+                            self._stats.inc_value("scrapy-zyte-api/hedging/wins")
+                        return task.result()
+                if not pending:
+                    # Every request failed, raise the error of the first one.
+                    return tasks[0].result()
+        finally:
+            original = tasks[0]
+            if not original.done() or (
+                not original.cancelled() and original.exception() is None
+            ):
+                hedger.record(perf_counter() - start, api_params=api_params)
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def _with_timeout(self, coro, timeout: Optional[float]):
+        """Awaits *coro*, cancelling it and raising
+        :exc:`~scrapy_zyte_api.exceptions.ZyteAPITimeoutError` if it takes
+        longer than *timeout* seconds."""
+        if not timeout:
+            return await coro
+        # Unlike asyncio.wait_for, asyncio.wait does not raise
+        # asyncio.TimeoutError, which aiohttp also raises on connection and
+        # read timeouts.
+        task = asyncio.ensure_future(coro)
+        try:
+            done, _ = await asyncio.wait({task}, timeout=timeout)
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        if not done:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            self._stats.inc_value("scrapy-zyte-api/timeouts")
+            raise ZyteAPITimeoutError(timeout)
+        return task.result()
 
     def _log_request(self, params):
-        if not self._must_log_request:
+        if not self._must_log_request or not logger.isEnabledFor(logging.DEBUG):
             return
-        params = self._truncate_params(params)
-        logger.debug(f"Sending Zyte API extract request: {json.dumps(params)}")
-
-    def _truncate_params(self, params):
-        if self._truncate_limit == 0:
-            return params
-        params = deepcopy(params)
-        _truncate(params, self._truncate_limit)
-        return params
+        if self._log_sample_rate < 1:
+            # Every request adds the sample rate to the credit, and every
+            # logged request takes 1 from it. The first request is logged.
+            credit = self._log_sample_credit
+            self._log_sample_credit += self._log_sample_rate
+            if credit < 1:
+                return
+            self._log_sample_credit -= 1
+        logger.debug(
+            "Sending Zyte API extract request: %s",
+            _LoggedParams(params, self._truncate_limit, self._json_codec.dumps),
+        )
 
     @inlineCallbacks
     def close(self) -> Generator:
@@ -210,4 +831,15 @@ class ScrapyZyteAPIDownloadHandler(HTTPDownloadHandler):
         yield deferred_from_coro(self._close())
 
     async def _close(self) -> None:  # NOQA
+        if self._stats_loop.running:
+            self._stats_loop.stop()
+        if self._latency_log_loop is not None and self._latency_log_loop.running:
+            self._latency_log_loop.stop()
+        if self._loop_lag_monitor is not None:
+            self._loop_lag_monitor.stop()
+        self._flush_stats()
         await self._session.close()
+        for session in self._key_sessions:
+            await session.close()
+        for _, session in self._endpoint_transports.values():
+            await session.close()
@@ -1,5 +1,5 @@
-from base64 import b64decode
-from typing import Dict, List, Optional, Tuple, Union
+from base64 import b64decode, b64encode
+from typing import Dict, List, Optional, Tuple, Type, Union
 
 from scrapy import Request
 from scrapy.http import Response, TextResponse
@@ -11,6 +11,8 @@ from scrapy_zyte_api.utils import (
     _RESPONSE_HAS_PROTOCOL,
 )
 
+from ._timings import _RequestTimer
+
 _DEFAULT_ENCODING = "utf-8"
 
 
@@ -26,6 +28,7 @@ class ZyteAPIMixin:
     def __init__(self, *args, raw_api_response: Optional[Dict] = None, **kwargs):
         super().__init__(*args, **kwargs)
         self._raw_api_response = raw_api_response
+        self._dropped_raw_api_field: Optional[str] = None
         if not _RESPONSE_HAS_ATTRIBUTES:
             self.attributes: Tuple[str, ...] = (
                 "url",
@@ -57,8 +60,40 @@ class ZyteAPIMixin:
         To see the full list of parameters and their description, kindly refer to the
         `Zyte API Specification <https://docs.zyte.com/zyte-api/openapi.html#zyte-openapi-spec>`_.
         """
+        field = self._dropped_raw_api_field
+        if field is not None:
+            assert self._raw_api_response is not None
+            body = self.body  # type: ignore[attr-defined]
+            self._raw_api_response[field] = b64encode(body).decode()
+            self._dropped_raw_api_field = None
         return self._raw_api_response
 
+    def _drop_raw_api_field(self, field: str):
+        """Removes *field*, which must be a Base64-encoded field mapped into
+        the response body, from the stored raw API response.
+
+        It is rebuilt from the response body the first time
+        :attr:`raw_api_response` is read.
+        """
+        if not self._raw_api_response or field not in self._raw_api_response:
+            return
+        del self._raw_api_response[field]
+        self._dropped_raw_api_field = field
+
+    @classmethod
+    def _from_api_response(
+        cls, api_response: Dict, *, request: Optional[Request] = None, **kwargs
+    ):
+        return cls(
+            url=api_response["url"],
+            status=api_response.get("statusCode") or 200,
+            request=request,
+            flags=["zyte-api"],
+            headers=cls._prepare_headers(api_response.get("httpResponseHeaders")),
+            raw_api_response=api_response,
+            **kwargs,
+        )
+
     @classmethod
     def _prepare_headers(cls, init_headers: Optional[List[Dict[str, str]]]):
         if not init_headers:
@@ -71,30 +106,37 @@ class ZyteAPIMixin:
 
 
 class ZyteAPITextResponse(ZyteAPIMixin, TextResponse):
+
+    # browserHtml, kept as the cached unicode body, and only encoded into
+    # bytes the first time the body is read.
+    _unencoded_body: Optional[str] = None
+
     @classmethod
     def from_api_response(cls, api_response: Dict, *, request: Request = None):
         """Alternative constructor to instantiate the response from the raw
         Zyte API response.
         """
-        body = None
-        encoding = None
-
         if api_response.get("browserHtml"):
-            encoding = _DEFAULT_ENCODING  # Zyte API has "utf-8" by default
-            body = api_response["browserHtml"].encode(encoding)
-        elif api_response.get("httpResponseBody"):
+            response = cls._from_api_response(
+                api_response,
+                request=request,
+                encoding=_DEFAULT_ENCODING,  # Zyte API has "utf-8" by default
+            )
+            response._unencoded_body = api_response["browserHtml"]
+            response._cached_ubody = response._unencoded_body
+            return response
+
+        body = None
+        if api_response.get("httpResponseBody"):
             body = b64decode(api_response["httpResponseBody"])
+        return cls._from_api_response(api_response, request=request, body=body)
 
-        return cls(
-            url=api_response["url"],
-            status=api_response.get("statusCode") or 200,
-            body=body,
-            encoding=encoding,
-            request=request,
-            flags=["zyte-api"],
-            headers=cls._prepare_headers(api_response.get("httpResponseHeaders")),
-            raw_api_response=api_response,
-        )
+    @property
+    def body(self) -> bytes:
+        if self._unencoded_body is not None:
+            self._body = self._unencoded_body.encode(_DEFAULT_ENCODING)
+            self._unencoded_body = None
+        return self._body
 
     def replace(self, *args, **kwargs):
         kwargs.setdefault("encoding", self.encoding)
@@ -107,14 +149,10 @@ class ZyteAPIResponse(ZyteAPIMixin, Response):
         """Alternative constructor to instantiate the response from the raw
         Zyte API response.
         """
-        return cls(
-            url=api_response["url"],
-            status=api_response.get("statusCode") or 200,
-            body=b64decode(api_response.get("httpResponseBody") or ""),
+        return cls._from_api_response(
+            api_response,
             request=request,
-            flags=["zyte-api"],
-            headers=cls._prepare_headers(api_response.get("httpResponseHeaders")),
-            raw_api_response=api_response,
+            body=b64decode(api_response.get("httpResponseBody") or ""),
         )
 
 
@@ -125,12 +163,50 @@ _JSON = Union[
 _API_RESPONSE = Dict[str, _JSON]
 
 
+def _b64decode(data: str, chunk_size: Optional[int] = None) -> bytes:
+    """Decodes *data* from Base64.
+
+    If *chunk_size* is set, *data* is decoded in chunks of up to that many
+    characters. Each decoding call holds the GIL, so decoding in chunks from a
+    thread lets other threads, e.g. the reactor thread, run in between.
+    Chunking is only used for data without line breaks, which is what Zyte API
+    returns.
+    """
+    if chunk_size is None or len(data) <= chunk_size or "\n" in data:
+        return b64decode(data)
+    chunk_size -= chunk_size % 4
+    return b"".join(
+        b64decode(data[start : start + chunk_size])
+        for start in range(0, len(data), chunk_size)
+    )
+
+
 def _process_response(
-    api_response: _API_RESPONSE, request: Request
+    api_response: _API_RESPONSE,
+    request: Request,
+    *,
+    lean: bool = False,
+    timer: Optional[_RequestTimer] = None,
+    decode_chunk_size: Optional[int] = None,
 ) -> Optional[Union[ZyteAPITextResponse, ZyteAPIResponse]]:
     """Given a Zyte API Response and the ``scrapy.Request`` that asked for it,
     this returns either a ``ZyteAPITextResponse`` or ``ZyteAPIResponse`` depending
     on which if it can properly decode the HTTP Body or have access to browserHtml.
+
+    If *lean* is ``True``, ``httpResponseBody`` is removed from
+    ``raw_api_response`` until it is read. ``browserHtml`` is always kept, since
+    it is the same string object as the unicode body of the response, so
+    removing it would not lower memory usage.
+
+    If *timer* is set, the ``decoding`` and ``building`` stages are marked on
+    it.
+
+    *decode_chunk_size* is passed to :func:`_b64decode` when decoding
+    ``httpResponseBody``.
+
+    ``httpResponseBody`` may also be the raw response body, as :class:`bytes`,
+    for responses obtained through proxy mode. It is then used as is, and only
+    Base64-encoded into ``raw_api_response`` when read.
     """
 
     # NOTES: Currently, Zyte API does NOT only allow both 'browserHtml' and
@@ -142,16 +218,41 @@ def _process_response(
     if api_response.get("browserHtml"):
         # Using TextResponse because browserHtml always returns a browser-rendered page
         # even when requesting files (like images)
-        return ZyteAPITextResponse.from_api_response(api_response, request=request)
+        if timer is not None:
+            timer.mark("decoding")
+        response = ZyteAPITextResponse.from_api_response(api_response, request=request)
+        if timer is not None:
+            timer.mark("building")
+        return response
 
-    if api_response.get("httpResponseHeaders") and api_response.get("httpResponseBody"):
-        response_cls = responsetypes.from_args(
-            headers=api_response["httpResponseHeaders"],
-            url=api_response["url"],
-            # FIXME: update this when python-zyte-api supports base64 decoding
-            body=b64decode(api_response["httpResponseBody"]),  # type: ignore
-        )
-        if issubclass(response_cls, TextResponse):
-            return ZyteAPITextResponse.from_api_response(api_response, request=request)
+    # The body is decoded here once, and shared between response type detection
+    # and the response constructor, instead of letting from_api_response()
+    # decode it again.
+    # FIXME: update this when python-zyte-api supports base64 decoding
+    http_response_body = api_response.get("httpResponseBody") or ""
+    is_raw_body = isinstance(http_response_body, bytes)
+    if is_raw_body:
+        body = http_response_body
+    else:
+        body = _b64decode(http_response_body, decode_chunk_size)  # type: ignore
+    if timer is not None:
+        timer.mark("decoding")
+
+    response_cls: Type[Union[ZyteAPITextResponse, ZyteAPIResponse]] = ZyteAPIResponse
+    if api_response.get("httpResponseHeaders") and body:
+        if issubclass(
+            responsetypes.from_args(
+                headers=api_response["httpResponseHeaders"],
+                url=api_response["url"],
+                body=body,
+            ),
+            TextResponse,
+        ):
+            response_cls = ZyteAPITextResponse
 
-    return ZyteAPIResponse.from_api_response(api_response, request=request)
+    response = response_cls._from_api_response(api_response, request=request, body=body)
+    if timer is not None:
+        timer.mark("building")
+    if lean or is_raw_body:
+        response._drop_raw_api_field("httpResponseBody")
+    return response
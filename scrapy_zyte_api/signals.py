@@ -0,0 +1,10 @@
+"""Signals sent by scrapy-zyte-api.
+
+See https://docs.scrapy.org/en/latest/topics/signals.html
+"""
+
+#: Sent when a Zyte API request finishes, if the ``ZYTE_API_TIMINGS`` setting
+#: is ``True``, with the ``request``, ``response``, ``spider`` and ``timings``
+#: arguments, where ``timings`` is a ``dict`` that maps the name of each stage
+#: of the request to its duration in seconds.
+request_timed = object()
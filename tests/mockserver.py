@@ -122,6 +122,34 @@ class DelayedResource(LeafResource):
         request.finish()
 
 
+class ProxyModeResource(LeafResource):
+    """Stand-in for the proxy mode of Zyte API, which echoes the received
+    request as JSON."""
+
+    def render(self, request):
+        if request.uri.endswith(b"/error"):
+            request.setResponseCode(400)
+            request.responseHeaders.setRawHeaders(
+                b"Zyte-Error-Type", [b"/request/invalid"]
+            )
+            return b"Invalid request"
+        request.responseHeaders.setRawHeaders(
+            b"Content-Type",
+            [b"application/json"],
+        )
+        return json.dumps(
+            {
+                "method": request.method.decode(),
+                "url": request.uri.decode(),
+                "headers": {
+                    name.decode(): values[0].decode()
+                    for name, values in request.requestHeaders.getAllRawHeaders()
+                },
+                "body": request.content.read().decode(),
+            }
+        ).encode()
+
+
 class MockServer:
     def __init__(self, resource=None, port=None):
         resource = resource or DefaultResource
@@ -5,7 +5,7 @@ from functools import partial
 from inspect import isclass
 from typing import Any, Dict
 from unittest import mock
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 import pytest
 from _pytest.logging import LogCaptureFixture  # NOQA
@@ -15,11 +15,17 @@ from scrapy.exceptions import CloseSpider
 from scrapy.http import Response, TextResponse
 from scrapy.settings.default_settings import DEFAULT_REQUEST_HEADERS
 from scrapy.settings.default_settings import USER_AGENT as DEFAULT_USER_AGENT
+from scrapy.statscollectors import MemoryStatsCollector
 from scrapy.utils.test import get_crawler
 from twisted.internet.defer import Deferred
 from zyte_api.aio.errors import RequestError
 
-from scrapy_zyte_api.handler import _ParamParser
+from scrapy_zyte_api import (
+    ScrapyZyteAPIDownloaderMiddleware,
+    ScrapyZyteAPIRequestFingerprinter,
+)
+from scrapy_zyte_api._params import _get_api_params, _get_plan_key, _ParamWarnings
+from scrapy_zyte_api.handler import ScrapyZyteAPIDownloadHandler, _ParamParser
 
 from . import DEFAULT_CLIENT_CONCURRENCY, SETTINGS
 from .mockserver import DelayedResource, MockServer, produce_request_response
@@ -107,6 +113,24 @@ async def test_response_html(meta: Dict[str, Dict[str, Any]], mockserver):
         assert not resp.headers
 
 
+@ensureDeferred
+@pytest.mark.parametrize(
+    "meta,field",
+    [
+        ({"browserHtml": True}, "browserHtml"),
+        ({"httpResponseBody": True, "httpResponseHeaders": True}, "httpResponseBody"),
+    ],
+)
+@pytest.mark.parametrize("lean", [True, False])
+async def test_lean_raw_api_response(meta, field, lean, mockserver):
+    settings = {"ZYTE_API_LEAN_RAW_API_RESPONSE": lean}
+    req, resp = await produce_request_response(mockserver, {"zyte_api": meta}, settings)
+    dropped = lean and field == "httpResponseBody"
+    assert (field in resp._raw_api_response) is not dropped
+    assert field in resp.raw_api_response
+    assert resp.body == b"<html><body>Hello<h1>World!</h1></body></html>"
+
+
 UNSET = object()
 
 
@@ -319,6 +343,145 @@ async def test_param_parser_output_side_effects(output, uses_zyte_api, mockserve
         super_mock.download_request.assert_called()
 
 
+def test_param_parser_per_crawler():
+    """The downloader middleware, the request fingerprinter and the download
+    handler share a single parser per crawler."""
+    crawler = get_crawler(settings_dict=SETTINGS)
+    handler = ScrapyZyteAPIDownloadHandler(crawler.settings, crawler)
+    middleware = ScrapyZyteAPIDownloaderMiddleware.from_crawler(crawler)
+    assert handler._param_parser is middleware._param_parser
+    if ScrapyZyteAPIRequestFingerprinter is not None:
+        fingerprinter = ScrapyZyteAPIRequestFingerprinter.from_crawler(crawler)
+        assert handler._param_parser is fingerprinter._param_parser
+    assert _ParamParser.from_crawler(get_crawler()) is not handler._param_parser
+
+
+@pytest.mark.parametrize(
+    "params,expected",
+    [
+        ({}, (None, None, None, None, None, None)),
+        (
+            {"browserHtml": True, "httpResponseBody": False, "screenshot": 0},
+            (True, None, False, None, None, (False, True)),
+        ),
+        (
+            {"customHttpRequestHeaders": [{"name": "a", "value": "b"}]},
+            (None, (True, False), None, None, None, None),
+        ),
+        ({"requestHeaders": {}}, (None, None, None, None, (False, False), None)),
+    ],
+)
+def test_plan_key(params, expected):
+    assert _get_plan_key(params) == expected
+
+
+def test_automap_plans():
+    """Automatic mapping plans are compiled once per distinct combination of
+    the values of the parameters that they depend on."""
+    crawler = get_crawler(settings_dict={"ZYTE_API_TRANSPARENT_MODE": True})
+    param_parser = _ParamParser(crawler.settings)
+    for index in range(3):
+        param_parser.parse(Request(url=f"https://example.com/{index}"))
+    assert len(param_parser._automap_plans) == 1
+    for index in range(3):
+        request = Request(
+            url=f"https://example.com/{index}",
+            meta={"zyte_api_automap": {"browserHtml": True, "geolocation": "IE"}},
+        )
+        param_parser.parse(request)
+    assert len(param_parser._automap_plans) == 2
+
+
+def test_header_cache():
+    """Header translations are memoized per header set, the output is not
+    shared across requests, and warnings are still issued per request."""
+    crawler = get_crawler(settings_dict={"ZYTE_API_TRANSPARENT_MODE": True})
+    param_parser = _ParamParser(crawler.settings, stats=crawler.stats)
+    headers = {"Referer": "https://example.com", "Cookie": "a=b"}
+    api_params = [
+        param_parser.parse(Request(url=f"https://example.com/{index}", headers=headers))
+        for index in range(3)
+    ]
+    cache = param_parser._header_cache["customHttpRequestHeaders"]
+    assert len(cache) == 1
+    expected = [{"name": "Referer", "value": "https://example.com"}]
+    assert api_params[0]["customHttpRequestHeaders"] == expected
+    assert (
+        api_params[0]["customHttpRequestHeaders"]
+        is not api_params[1]["customHttpRequestHeaders"]
+    )
+    assert (
+        api_params[0]["customHttpRequestHeaders"][0]
+        is not api_params[1]["customHttpRequestHeaders"][0]
+    )
+    assert (
+        crawler.stats.get_value("scrapy-zyte-api/param_warnings/unmappable_header") == 3
+    )
+
+    with patch("scrapy_zyte_api._params._HEADER_CACHE_SIZE", 2):
+        for index in range(3):
+            param_parser.parse(
+                Request(
+                    url="https://example.com",
+                    headers={"Referer": f"https://example.com/{index}"},
+                )
+            )
+    assert len(cache) == 2
+
+
+def test_param_parser_memo():
+    """Parsing results are memoized per request, unless the request changes
+    in place, and each call returns a separate copy."""
+    crawler = get_crawler(settings_dict={"ZYTE_API_TRANSPARENT_MODE": True})
+    param_parser = _ParamParser(crawler.settings)
+    request = Request(url="https://example.com")
+    with patch(
+        "scrapy_zyte_api._params._get_api_params",
+        wraps=_get_api_params,
+    ) as get_api_params:
+        api_params = param_parser.parse(request)
+        api_params["foo"] = "bar"
+        assert "foo" not in param_parser.parse(request)
+        assert get_api_params.call_count == 1
+
+        request.headers["Referer"] = "https://example.com/a"
+        assert "customHttpRequestHeaders" in param_parser.parse(request)
+        assert get_api_params.call_count == 2
+
+        request.meta["zyte_api_automap"] = {"browserHtml": True}
+        assert "browserHtml" in param_parser.parse(request)
+        assert get_api_params.call_count == 3
+
+        param_parser.parse(request.replace(url="https://example.com/b"))
+        assert get_api_params.call_count == 4
+
+
+def test_param_parser_memo_nested():
+    """Changes to values nested within request metadata invalidate memoized
+    results, and forget=True drops them."""
+    crawler = get_crawler()
+    param_parser = _ParamParser(crawler.settings)
+    request = Request(
+        url="https://example.com",
+        meta={"zyte_api": {"browserHtml": True, "actions": []}},
+    )
+    with patch(
+        "scrapy_zyte_api._params._get_api_params",
+        wraps=_get_api_params,
+    ) as get_api_params:
+        assert param_parser.parse(request)["actions"] == []
+        assert get_api_params.call_count == 1
+
+        request.meta["zyte_api"]["actions"].append({"action": "scrollBottom"})
+        assert param_parser.parse(request)["actions"] == [{"action": "scrollBottom"}]
+        assert get_api_params.call_count == 2
+        assert request in param_parser._cache
+
+        param_parser.parse(request, forget=True)
+        assert get_api_params.call_count == 2
+        assert request not in param_parser._cache
+
+
 DEFAULT_AUTOMAP_PARAMS: Dict[str, Any] = {
     "httpResponseBody": True,
     "httpResponseHeaders": True,
@@ -1634,3 +1797,63 @@ def test_default_params_automap(default_params, meta, expected, warnings, caplog
             assert warning in caplog.text
     else:
         assert not caplog.records
+
+
+@pytest.mark.parametrize(
+    "interval,logged",
+    [
+        (None, 1),
+        (0, 3),
+        (60, 1),
+    ],
+)
+def test_param_warnings(interval, logged, caplog):
+    settings: Dict[str, Any] = {
+        "ZYTE_API_SKIP_HEADERS": ["Cookie", "X-Foo"],
+        "ZYTE_API_TRANSPARENT_MODE": True,
+    }
+    if interval is not None:
+        settings["ZYTE_API_PARAM_WARNINGS_INTERVAL"] = interval
+    crawler = get_crawler(settings_dict=settings)
+    crawler.stats = MemoryStatsCollector(crawler)
+    param_parser = _ParamParser.from_crawler(crawler)
+    with caplog.at_level("WARNING"):
+        for index in range(3):
+            request = Request(
+                url=f"https://example.com/{index}",
+                headers={"Cookie": "a=b", "X-Foo": "bar"},
+            )
+            param_parser.parse(request)
+    messages = [record.getMessage() for record in caplog.records]
+    # Each header gets its own warning.
+    for header in ("Cookie", "X-Foo"):
+        header_messages = [m for m in messages if f"header b'{header}'" in m]
+        assert len(header_messages) == logged
+    assert (
+        crawler.stats.get_value("scrapy-zyte-api/param_warnings/unmappable_header") == 6
+    )
+
+
+def test_param_warnings_interval(caplog):
+    param_warnings = _ParamWarnings(interval=10)
+    with patch("scrapy_zyte_api._params.monotonic") as monotonic:
+        for now in (0, 5, 9, 10, 11):
+            monotonic.return_value = now
+            with caplog.at_level("WARNING"):
+                param_warnings.warn("kind", None, "Message %s.", now)
+    assert [record.getMessage() for record in caplog.records] == [
+        "Message 0.",
+        "Message 10. (2 similar warnings were not logged)",
+    ]
+
+
+def test_param_warnings_lazy():
+    param_warnings = _ParamWarnings()
+    arg = MagicMock()
+    with patch("scrapy_zyte_api._params.logger") as logger:
+        param_warnings.warn("kind", None, "Message %s.", arg)
+        param_warnings.warn("kind", None, "Message %s.", arg)
+    assert logger.warning.call_count == 1
+    # The message is formatted by the logger, not before calling it.
+    assert logger.warning.call_args[0] == ("Message %s.", arg)
+    assert not arg.mock_calls
@@ -0,0 +1,183 @@
+import gzip
+import json
+from base64 import b64encode
+from unittest import mock
+
+import pytest
+from packaging.version import Version
+from scrapy import __version__ as SCRAPY_VERSION
+
+if Version(SCRAPY_VERSION) < Version("2.7"):
+    pytest.skip("Skipping tests for Scrapy ≥ 2.7", allow_module_level=True)
+
+from scrapy import Request, Spider
+from scrapy.http import Response, TextResponse
+from scrapy.utils.test import get_crawler
+
+from scrapy_zyte_api import ScrapyZyteAPICacheStorage
+from scrapy_zyte_api._cache import _REVALIDATION_META_KEY
+from scrapy_zyte_api.responses import ZyteAPIResponse, ZyteAPITextResponse
+
+HTML = "<html><body>Hello</body></html>"
+
+
+def make_storage(tmp_path, settings=None):
+    settings = {"HTTPCACHE_DIR": str(tmp_path), **(settings or {})}
+    crawler = get_crawler(Spider, settings_dict=settings)
+    spider = Spider.from_crawler(crawler, name="a")
+    storage = ScrapyZyteAPICacheStorage(crawler.settings)
+    storage.open_spider(spider)
+    return storage, spider
+
+
+def browser_response(request):
+    return ZyteAPITextResponse.from_api_response(
+        {"url": request.url, "browserHtml": HTML}, request=request
+    )
+
+
+def body_response(request):
+    return ZyteAPIResponse.from_api_response(
+        {
+            "url": request.url,
+            "httpResponseBody": b64encode(b"\x00").decode(),
+            "httpResponseHeaders": [
+                {"name": "Content-Type", "value": "application/octet-stream"}
+            ],
+        },
+        request=request,
+    )
+
+
+@pytest.mark.parametrize(
+    "build_response,cls",
+    [
+        (browser_response, TextResponse),
+        (body_response, Response),
+    ],
+)
+def test_hit(build_response, cls, tmp_path):
+    storage, spider = make_storage(tmp_path)
+    request = Request("https://example.com", meta={"zyte_api": {}})
+    assert storage.retrieve_response(spider, request) is None
+
+    response = build_response(request)
+    storage.store_response(spider, request, response)
+    cached = storage.retrieve_response(spider, request)
+    assert isinstance(cached, cls)
+    assert cached.url == response.url
+    assert cached.body == response.body
+    assert cached.raw_api_response == response.raw_api_response
+
+    # Cached entries persist across storage instances.
+    storage, spider = make_storage(tmp_path)
+    assert storage.retrieve_response(spider, request).body == response.body
+
+    # Requests with different Zyte API parameters are different entries.
+    other_request = Request("https://example.com", meta={"zyte_api": {"a": "b"}})
+    assert storage.retrieve_response(spider, other_request) is None
+
+
+def test_non_zyte_api_response(tmp_path):
+    storage, spider = make_storage(tmp_path)
+    request = Request("https://example.com")
+    response = Response(request.url, body=b"a", request=request)
+    storage.store_response(spider, request, response)
+    assert storage.retrieve_response(spider, request) is None
+    assert not storage._index
+
+
+def test_lru_eviction(tmp_path):
+    storage, spider = make_storage(tmp_path)
+    requests = [
+        Request(f"https://example.com/{i}", meta={"zyte_api": {}}) for i in range(3)
+    ]
+    storage.store_response(spider, requests[0], browser_response(requests[0]))
+    entry_size = storage._size
+
+    storage, spider = make_storage(
+        tmp_path, {"ZYTE_API_CACHE_MAX_SIZE": entry_size * 5 // 2}
+    )
+    storage.store_response(spider, requests[1], browser_response(requests[1]))
+    # Reading the first entry makes the second one the least recently used.
+    assert storage.retrieve_response(spider, requests[0]) is not None
+    storage.store_response(spider, requests[2], browser_response(requests[2]))
+
+    assert storage.retrieve_response(spider, requests[0]) is not None
+    assert storage.retrieve_response(spider, requests[1]) is None
+    assert storage.retrieve_response(spider, requests[2]) is not None
+    assert storage._stats.get_value("scrapy-zyte-api/cache/evictions") == 1
+    assert len(list(tmp_path.glob("a/*.json.gz"))) == 2
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"not gzip",
+        gzip.compress(b"not JSON"),
+        gzip.compress(json.dumps([]).encode()),
+        gzip.compress(json.dumps({}).encode()),
+        gzip.compress(json.dumps({"ttl": 0, "timestamp": 0}).encode()),
+        gzip.compress(
+            json.dumps({"ttl": None, "timestamp": 0, "response": {}}).encode()
+        ),
+    ],
+)
+def test_malformed_entry(data, tmp_path):
+    storage, spider = make_storage(tmp_path)
+    request = Request("https://example.com", meta={"zyte_api": {}})
+    storage.store_response(spider, request, browser_response(request))
+    (path,) = tmp_path.glob("a/*.json.gz")
+    path.write_bytes(data)
+    assert storage.retrieve_response(spider, request) is None
+    assert not storage._index
+    assert not path.exists()
+
+
+@pytest.mark.parametrize(
+    "settings,meta,age,expected",
+    [
+        ({}, {}, 10**6, True),
+        ({"HTTPCACHE_EXPIRATION_SECS": 60}, {}, 59, True),
+        ({"HTTPCACHE_EXPIRATION_SECS": 60}, {}, 61, False),
+        ({}, {"zyte_api_cache_ttl": 60}, 61, False),
+        ({"HTTPCACHE_EXPIRATION_SECS": 60}, {"zyte_api_cache_ttl": 120}, 61, True),
+    ],
+)
+def test_ttl(settings, meta, age, expected, tmp_path):
+    storage, spider = make_storage(tmp_path, settings)
+    request = Request("https://example.com", meta={"zyte_api": {}, **meta})
+    with mock.patch("scrapy_zyte_api._cache.time", return_value=1000):
+        storage.store_response(spider, request, browser_response(request))
+    with mock.patch("scrapy_zyte_api._cache.time", return_value=1000 + age):
+        cached = storage.retrieve_response(spider, request)
+    assert (cached is not None) is expected
+    if not expected:
+        assert storage._stats.get_value("scrapy-zyte-api/cache/expired") == 1
+        assert not storage._index
+
+
+def test_stale_while_revalidate(tmp_path):
+    settings = {
+        "HTTPCACHE_EXPIRATION_SECS": 60,
+        "ZYTE_API_CACHE_STALE_WHILE_REVALIDATE": 30,
+    }
+    storage, spider = make_storage(tmp_path, settings)
+    spider.crawler.engine = mock.Mock()
+    request = Request("https://example.com", meta={"zyte_api": {}})
+    with mock.patch("scrapy_zyte_api._cache.time", return_value=1000):
+        storage.store_response(spider, request, browser_response(request))
+
+    with mock.patch("scrapy_zyte_api._cache.time", return_value=1070):
+        assert storage.retrieve_response(spider, request) is not None
+        assert storage.retrieve_response(spider, request) is not None
+    assert storage._stats.get_value("scrapy-zyte-api/cache/stale") == 2
+    # Only 1 revalidation request is sent while one is in progress.
+    spider.crawler.engine.download.assert_called_once()
+    revalidation_request = spider.crawler.engine.download.call_args[0][0]
+    assert revalidation_request.url == request.url
+    assert revalidation_request.meta[_REVALIDATION_META_KEY] is True
+    assert storage.retrieve_response(spider, revalidation_request) is None
+
+    with mock.patch("scrapy_zyte_api._cache.time", return_value=1091):
+        assert storage.retrieve_response(spider, request) is None
@@ -0,0 +1,279 @@
+import asyncio
+import sys
+from unittest import mock
+
+import pytest
+from pytest_twisted import ensureDeferred
+from scrapy import Request
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.defer import deferred_from_coro
+from scrapy.utils.test import get_crawler
+from zyte_api.aio.errors import RequestError
+
+from scrapy_zyte_api._circuit_breaker import _CircuitBreaker
+from scrapy_zyte_api._concurrency import _ConcurrencyLimiter
+from scrapy_zyte_api.exceptions import (
+    ZyteAPICircuitOpenError,
+    ZyteAPIInvalidParamsError,
+)
+
+from . import make_handler
+
+
+@pytest.fixture
+def clock():
+    with mock.patch("scrapy_zyte_api._circuit_breaker.monotonic") as monotonic:
+        monotonic.return_value = 0.0
+        yield monotonic
+
+
+def test_invalid():
+    with pytest.raises(ValueError):
+        _CircuitBreaker(max_failures=0)
+    with pytest.raises(ValueError):
+        _CircuitBreaker(probes=0)
+
+
+def _fail(breaker, domain):
+    permit = breaker.allow(domain)
+    assert permit is not None
+    breaker.record(permit, True)
+
+
+def test_window(clock):
+    breaker = _CircuitBreaker(max_failures=3, window=10)
+    for now in (0, 5, 11):
+        clock.return_value = now
+        _fail(breaker, "a.example")
+    # The failure at 0 is outside the window.
+    permit = breaker.allow("a.example")
+    assert permit is not None
+    breaker.record(permit, None)
+    breaker.record(permit, False)
+    _fail(breaker, "a.example")
+    assert breaker.allow("a.example") is None
+    assert breaker.allow("b.example") is not None
+    assert breaker.opened == 1
+
+
+def test_half_open(clock, caplog):
+    caplog.set_level("INFO")
+    breaker = _CircuitBreaker(max_failures=1, cooldown=10, probes=2)
+    _fail(breaker, "a.example")
+    assert "Too many Zyte API requests to a.example failed" in caplog.text
+    clock.return_value = 9
+    assert breaker.allow("a.example") is None
+
+    # Probes that fail open the circuit again.
+    clock.return_value = 10
+    probe1 = breaker.allow("a.example")
+    probe2 = breaker.allow("a.example")
+    assert probe1 is not None and probe2 is not None
+    assert breaker.allow("a.example") is None
+    breaker.record(probe1, None)
+    probe3 = breaker.allow("a.example")
+    assert probe3 is not None
+    breaker.record(probe3, True)
+    assert breaker.allow("a.example") is None
+    assert breaker.opened == 2
+
+    # The outcome of a probe allowed before the circuit opened again is
+    # ignored.
+    clock.return_value = 20
+    probe4 = breaker.allow("a.example")
+    assert probe4 is not None
+    breaker.record(probe2, False)
+    assert "Resuming Zyte API requests to a.example" not in caplog.text
+    assert breaker.allow("a.example") is not None
+    assert breaker.allow("a.example") is None
+
+    # A probe that succeeds closes the circuit.
+    breaker.record(probe4, False)
+    assert "Resuming Zyte API requests to a.example" in caplog.text
+    for _ in range(3):
+        assert breaker.allow("a.example") is not None
+
+
+def test_half_open_stale(clock):
+    """The outcome of requests allowed before the circuit opened does not
+    count as the outcome of a probe."""
+    breaker = _CircuitBreaker(max_failures=1, cooldown=10)
+    stale = breaker.allow("a.example")
+    assert stale is not None
+    _fail(breaker, "a.example")
+    clock.return_value = 10
+    probe = breaker.allow("a.example")
+    assert probe is not None
+    breaker.record(stale, False)
+    breaker.record(stale, True)
+    assert breaker.allow("a.example") is None
+    assert breaker.opened == 1
+    breaker.record(probe, False)
+    assert breaker.allow("a.example") is not None
+
+
+def test_stats(clock):
+    breaker = _CircuitBreaker(max_failures=1, cooldown=10)
+    stats = MemoryStatsCollector(get_crawler())
+    _fail(breaker, "a.example")
+    _fail(breaker, "b.example")
+    breaker.update_stats(stats, "prefix")
+    assert stats.get_stats() == {
+        "prefix/circuit_breaker/opened": 2,
+        "prefix/circuit_breaker/open": 2,
+        "prefix/circuit_breaker/state/a.example": "open",
+        "prefix/circuit_breaker/state/b.example": "open",
+    }
+    clock.return_value = 10
+    permit = breaker.allow("a.example")
+    assert permit is not None
+    breaker.record(permit, False)
+    breaker.update_stats(stats, "prefix")
+    assert stats.get_value("prefix/circuit_breaker/open") == 1
+    # State stats are only kept while requests are stopped or probed.
+    assert "prefix/circuit_breaker/state/a.example" not in stats.get_stats()
+    assert stats.get_value("prefix/circuit_breaker/state/b.example") == "open"
+
+
+def test_cleanup(clock):
+    """Circuits are removed once closed without failures within the window, so
+    that memory usage does not grow with the number of domains."""
+    breaker = _CircuitBreaker(max_failures=2, window=10, cooldown=10)
+    stats = MemoryStatsCollector(get_crawler())
+    _fail(breaker, "a.example")
+    _fail(breaker, "b.example")
+    _fail(breaker, "b.example")
+    assert set(breaker._circuits) == {"a.example", "b.example"}
+
+    # A closed circuit is removed once its failures are outside the window.
+    clock.return_value = 9
+    breaker.update_stats(stats, "prefix")
+    assert set(breaker._circuits) == {"a.example", "b.example"}
+    clock.return_value = 10
+    breaker.update_stats(stats, "prefix")
+    assert set(breaker._circuits) == {"b.example"}
+
+    # A circuit closed by a probe is removed right away. A stale probe from
+    # an earlier opening does not affect a new circuit for the same domain.
+    probe = breaker.allow("b.example")
+    assert probe is not None
+    breaker.record(probe, False)
+    assert not breaker._circuits
+    _fail(breaker, "b.example")
+    _fail(breaker, "b.example")
+    breaker.record(probe, False)
+    assert breaker.allow("b.example") is None
+
+
+def _request_error(status):
+    return RequestError(
+        request_info=None,
+        history=(),
+        status=status,
+        message="",
+        headers=None,
+        response_content=b"{}",
+    )
+
+
+@ensureDeferred
+@pytest.mark.skipif(sys.version_info < (3, 8), reason="unittest.mock.AsyncMock")
+@pytest.mark.parametrize(
+    "settings,status,rejected",
+    [
+        ({}, 520, False),
+        ({"ZYTE_API_CIRCUIT_BREAKER": True}, 520, True),
+        ({"ZYTE_API_CIRCUIT_BREAKER": True}, 521, True),
+        # Errors not caused by the target website do not count.
+        ({"ZYTE_API_CIRCUIT_BREAKER": True}, 429, False),
+        ({"ZYTE_API_CIRCUIT_BREAKER": True}, 500, False),
+    ],
+)
+async def test_handler(settings, status, rejected):
+    settings = {
+        **settings,
+        "ZYTE_API_CIRCUIT_BREAKER_MAX_FAILURES": 2,
+        "ZYTE_API_STATS_INTERVAL": 0,
+    }
+    async with make_handler(settings) as handler:
+        handler._client = mock.AsyncMock(handler._client)
+        handler._client.request_raw.side_effect = _request_error(status)
+        for _ in range(2):
+            request = Request("https://a.example", meta={"zyte_api": {}})
+            with pytest.raises(RequestError):
+                await handler.download_request(request, None)
+        request = Request("https://a.example", meta={"zyte_api": {}})
+        expected_error = ZyteAPICircuitOpenError if rejected else RequestError
+        with pytest.raises(expected_error):
+            await handler.download_request(request, None)
+        assert handler._client.request_raw.call_count == (2 if rejected else 3)
+        stats = handler._stats
+        assert stats.get_value("scrapy-zyte-api/circuit_breaker/rejected") == (
+            1 if rejected else None
+        )
+        if rejected:
+            assert (
+                stats.get_value("scrapy-zyte-api/circuit_breaker/state/a.example")
+                == "open"
+            )
+
+        # Other domains are not affected.
+        handler._client.request_raw.side_effect = None
+        handler._client.request_raw.return_value = {
+            "url": "https://b.example",
+            "browserHtml": "",
+        }
+        request = Request("https://b.example", meta={"zyte_api": {}})
+        await handler.download_request(request, None)
+
+
+async def _cancel_queued_request(handler, request):
+    limiter = _ConcurrencyLimiter(1)
+    await limiter.acquire()
+    handler._concurrency_limiter = limiter
+    task = asyncio.ensure_future(handler._request_api({"url": request.url}, request))
+    await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    limiter.release()
+
+
+@ensureDeferred
+@pytest.mark.skipif(sys.version_info < (3, 8), reason="unittest.mock.AsyncMock")
+async def test_handler_probe_not_sent():
+    """Probes that are never sent, because they are cancelled while waiting
+    for a concurrency slot or have invalid parameters, do not keep the
+    circuit from closing."""
+    settings = {
+        "ZYTE_API_CIRCUIT_BREAKER": True,
+        "ZYTE_API_CIRCUIT_BREAKER_COOLDOWN": 0,
+        "ZYTE_API_CIRCUIT_BREAKER_MAX_FAILURES": 1,
+        "ZYTE_API_VALIDATE_PARAMS": True,
+    }
+    async with make_handler(settings) as handler:
+        handler._client = mock.AsyncMock(handler._client)
+        handler._client.request_raw.side_effect = _request_error(520)
+        request = Request("https://a.example", meta={"zyte_api": {}})
+        with pytest.raises(RequestError):
+            await handler.download_request(request, None)
+
+        invalid_request = Request(
+            "https://a.example",
+            meta={"zyte_api": {"browserHtml": True, "httpResponseBody": True}},
+        )
+        with pytest.raises(ZyteAPIInvalidParamsError):
+            await handler.download_request(invalid_request, None)
+
+        await deferred_from_coro(_cancel_queued_request(handler, request))
+
+        handler._client.request_raw.side_effect = None
+        handler._client.request_raw.return_value = {
+            "url": "https://a.example",
+            "browserHtml": "",
+        }
+        await handler.download_request(request, None)
+        await handler.download_request(request, None)
+        assert (
+            handler._stats.get_value("scrapy-zyte-api/circuit_breaker/rejected") is None
+        )
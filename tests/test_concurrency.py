@@ -0,0 +1,251 @@
+import asyncio
+import sys
+from unittest import mock
+
+import pytest
+from pytest_twisted import ensureDeferred
+from scrapy import Request
+from scrapy.utils.defer import deferred_from_coro
+from scrapy.utils.test import get_crawler
+from zyte_api.stats import AggStats
+
+from scrapy_zyte_api._concurrency import (
+    _AdaptiveConcurrencyLimiter,
+    _ConcurrencyLimiter,
+)
+from scrapy_zyte_api.handler import ScrapyZyteAPIDownloadHandler
+
+from . import SETTINGS, make_handler
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"minimum": 0, "maximum": 1},
+        {"minimum": 2, "maximum": 1},
+        {"minimum": 1, "maximum": 1, "decrease_factor": 0},
+        {"minimum": 1, "maximum": 1, "decrease_factor": 1},
+    ],
+)
+def test_invalid(kwargs):
+    with pytest.raises(ValueError):
+        _AdaptiveConcurrencyLimiter(**kwargs)
+
+
+async def _test_acquire_release():
+    limiter = _AdaptiveConcurrencyLimiter(minimum=1, maximum=2)
+    await limiter.acquire()
+    await limiter.acquire()
+    task = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+    assert not task.done()
+    limiter.release()
+    await asyncio.sleep(0)
+    assert task.done()
+    assert limiter._active == 2
+
+
+@ensureDeferred
+async def test_acquire_release():
+    await deferred_from_coro(_test_acquire_release())
+
+
+async def _test_acquire_cancel():
+    limiter = _AdaptiveConcurrencyLimiter(minimum=1, maximum=1)
+    await limiter.acquire()
+    task = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert not limiter._waiters
+    limiter.release()
+    assert limiter._active == 0
+
+
+@ensureDeferred
+async def test_acquire_cancel():
+    await deferred_from_coro(_test_acquire_cancel())
+
+
+def test_invalid_limit():
+    with pytest.raises(ValueError):
+        _ConcurrencyLimiter(0)
+
+
+async def _test_priority():
+    limiter = _ConcurrencyLimiter(1)
+    await limiter.acquire()
+    order = []
+
+    async def acquire(name, priority):
+        await limiter.acquire(priority)
+        order.append(name)
+
+    tasks = [
+        asyncio.ensure_future(acquire(name, priority))
+        for name, priority in (
+            ("low1", -1),
+            ("default1", 0),
+            ("high", 10),
+            ("default2", 0),
+            ("low2", -1),
+            ("cancelled", 20),
+        )
+    ]
+    await asyncio.sleep(0)
+    tasks.pop().cancel()
+    await asyncio.sleep(0)
+    assert len(limiter._waiters) == 5
+    for _ in range(5):
+        limiter.release()
+        await asyncio.sleep(0)
+    assert order == ["high", "default1", "default2", "low1", "low2"]
+
+
+@ensureDeferred
+async def test_priority():
+    await deferred_from_coro(_test_priority())
+
+
+def test_aimd():
+    limiter = _AdaptiveConcurrencyLimiter(minimum=2, maximum=8)
+    agg_stats = AggStats()
+    assert limiter.limit == 8
+
+    # Multiplicative decrease on throttling.
+    agg_stats.n_429 += 1
+    limiter.update(agg_stats)
+    assert limiter.limit == 4
+
+    # Further throttling within the mean response time is ignored.
+    agg_stats.time_total_stats.push(60.0)
+    agg_stats.n_429 += 1
+    limiter.update(agg_stats)
+    assert limiter.limit == 4
+
+    # Additive increase, by 1 for every full round of concurrent requests.
+    for _ in range(5):
+        limiter.update(agg_stats)
+    assert limiter.limit == 5
+
+    # The limit never goes below the minimum or above the maximum.
+    limiter._last_decrease = float("-inf")
+    for _ in range(3):
+        agg_stats.n_429 += 1
+        limiter.update(agg_stats)
+        limiter._last_decrease = float("-inf")
+    assert limiter.limit == 2
+    for _ in range(100):
+        limiter.update(agg_stats)
+    assert limiter.limit == 8
+
+
+@pytest.mark.parametrize(
+    "settings,expected",
+    [
+        ({}, None),
+        ({"ZYTE_API_ADAPTIVE_CONCURRENCY": False}, None),
+        ({"ZYTE_API_ADAPTIVE_CONCURRENCY": True}, (1, 16)),
+        (
+            {
+                "ZYTE_API_ADAPTIVE_CONCURRENCY": True,
+                "ZYTE_API_ADAPTIVE_CONCURRENCY_MIN": 4,
+                "CONCURRENT_REQUESTS": 32,
+            },
+            (4, 32),
+        ),
+    ],
+)
+def test_settings(settings, expected):
+    crawler = get_crawler(settings_dict={**SETTINGS, **settings})
+    handler = ScrapyZyteAPIDownloadHandler(crawler.settings, crawler)
+    limiter = handler._concurrency_limiter
+    if expected is None:
+        assert limiter is None
+    else:
+        assert isinstance(limiter, _AdaptiveConcurrencyLimiter)
+        assert (limiter._minimum, limiter._maximum) == expected
+    # Both download handlers (http, https) share the same limiter.
+    handler2 = ScrapyZyteAPIDownloadHandler(crawler.settings, crawler)
+    assert handler2._concurrency_limiter is limiter
+
+
+@pytest.mark.parametrize(
+    "settings,expected,limit",
+    [
+        ({"ZYTE_API_PRIORITY_DISPATCH": True}, _ConcurrencyLimiter, 4),
+        (
+            {
+                "ZYTE_API_PRIORITY_DISPATCH": True,
+                "ZYTE_API_PRIORITY_DISPATCH_CONCURRENCY": 2,
+            },
+            _ConcurrencyLimiter,
+            2,
+        ),
+        (
+            {
+                "ZYTE_API_PRIORITY_DISPATCH": True,
+                "ZYTE_API_ADAPTIVE_CONCURRENCY": True,
+            },
+            _AdaptiveConcurrencyLimiter,
+            4,
+        ),
+    ],
+)
+def test_priority_dispatch_settings(settings, expected, limit):
+    settings = {**SETTINGS, **settings, "CONCURRENT_REQUESTS": 4}
+    crawler = get_crawler(settings_dict=settings)
+    handler = ScrapyZyteAPIDownloadHandler(crawler.settings, crawler)
+    limiter = handler._concurrency_limiter
+    assert type(limiter) is expected
+    assert limiter.limit == limit
+
+
+@ensureDeferred
+@pytest.mark.skipif(sys.version_info < (3, 8), reason="unittest.mock.AsyncMock")
+async def test_priority_dispatch():
+    settings = {"ZYTE_API_PRIORITY_DISPATCH": True, "CONCURRENT_REQUESTS": 1}
+    async with make_handler(settings) as handler:
+        handler._client = mock.AsyncMock(handler._client)
+        urls = []
+
+        async def request_raw(api_params, **kwargs):
+            urls.append(api_params["url"])
+            await asyncio.sleep(0.01)
+            return {"url": api_params["url"], "browserHtml": "<html></html>"}
+
+        handler._client.request_raw.side_effect = request_raw
+        deferreds = [
+            handler.download_request(
+                Request(
+                    f"https://example.com/{priority}",
+                    priority=priority,
+                    meta={"zyte_api": {"browserHtml": True}},
+                ),
+                None,
+            )
+            for priority in (0, -1, 1, 0)
+        ]
+        for deferred in deferreds:
+            await deferred
+        assert urls == [
+            "https://example.com/0",
+            "https://example.com/1",
+            "https://example.com/0",
+            "https://example.com/-1",
+        ]
+        # The priority dispatch limiter does not report adaptive concurrency.
+        handler._update_stats()
+        assert handler._stats.get_value("scrapy-zyte-api/adaptive_concurrency") is None
+
+
+@ensureDeferred
+async def test_stats(mockserver):
+    settings = {"ZYTE_API_ADAPTIVE_CONCURRENCY": True}
+    async with make_handler(settings, mockserver.urljoin("/")) as handler:
+        request = Request("https://example.com", meta={"zyte_api": {}})
+        await handler.download_request(request, None)
+        assert handler._concurrency_limiter._active == 0
+        handler._flush_stats()
+        assert handler._stats.get_value("scrapy-zyte-api/adaptive_concurrency") == 16
@@ -1,9 +1,11 @@
+import pytest
 from pytest_twisted import ensureDeferred
 from scrapy import Request
 from scrapy.utils.misc import create_instance
 from scrapy.utils.test import get_crawler
 
 from scrapy_zyte_api import ScrapyZyteAPIDownloaderMiddleware
+from scrapy_zyte_api._timings import _ENQUEUED_META_KEY
 
 
 @ensureDeferred
@@ -54,3 +56,22 @@ async def test_downloader_middleware():
     assert slot.delay == 0
 
     await crawler.stop()
+
+
+@ensureDeferred
+@pytest.mark.parametrize("enabled", [True, False])
+async def test_timings(enabled):
+    crawler = get_crawler(settings_dict={"ZYTE_API_TIMINGS": enabled})
+    await crawler.crawl("a")
+    spider = crawler.spider
+    middleware = create_instance(
+        ScrapyZyteAPIDownloaderMiddleware, settings=crawler.settings, crawler=crawler
+    )
+
+    request = Request("https://example.com")
+    middleware.process_request(request, spider)
+    assert _ENQUEUED_META_KEY not in request.meta
+
+    request = Request("https://example.com", meta={"zyte_api": {}})
+    middleware.process_request(request, spider)
+    assert (_ENQUEUED_META_KEY in request.meta) is enabled
@@ -0,0 +1,119 @@
+from unittest import mock
+
+import pytest
+from pytest_twisted import ensureDeferred
+from scrapy import Request
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+from tenacity import AsyncRetrying, stop_after_attempt
+
+from scrapy_zyte_api._endpoints import _EndpointRouter
+
+from . import make_handler
+from .mockserver import get_ephemeral_port
+
+
+def test_invalid():
+    with pytest.raises(ValueError):
+        _EndpointRouter([])
+
+
+def test_select():
+    router = _EndpointRouter(["http://a/", "http://b/", "http://c/"])
+    # Untried endpoints are tried first, in turn.
+    assert [router.select() for _ in range(3)] == [0, 1, 2]
+    router.record_success(0, 2.0)
+    router.record_success(1, 1.0)
+    router.record_success(2, 3.0)
+    assert router.select() == 1
+
+    # Errors make an endpoint less preferred.
+    router.record_error(1)
+    router.record_error(1)
+    assert router.endpoints[1].score > router.endpoints[0].score
+    assert router.select() == 0
+    router.record_success(1, 1.0)
+    assert router.endpoints[1].error_rate < 0.36
+
+
+def test_probe():
+    router = _EndpointRouter(["http://a/", "http://b/"], probe_interval=5)
+    for index, seconds in ((router.select(), 1.0), (router.select(), 2.0)):
+        router.record_success(index, seconds)
+    assert [router.select() for _ in range(8)] == [0, 0, 1, 0, 0, 0, 0, 1]
+
+
+def test_failover():
+    router = _EndpointRouter(["http://a/", "http://b/"], max_errors=2, cooldown=10)
+    for index in range(2):
+        router.select()
+        router.record_success(index, 1.0 + 4 * index)
+    with mock.patch("scrapy_zyte_api._endpoints.monotonic", return_value=100):
+        router.record_error(0)
+        assert router.select() == 0
+        router.record_error(0)
+        assert router.select() == 1
+        assert router.select() == 1
+    with mock.patch("scrapy_zyte_api._endpoints.monotonic", return_value=111):
+        assert router.select() == 0
+
+
+def test_failover_all_down():
+    router = _EndpointRouter(["http://a/", "http://b/"], max_errors=1)
+    for index in range(2):
+        router.select()
+        router.record_success(index, 1.0 + index)
+        router.record_error(index)
+    assert router.select() == 0
+
+
+def test_stats():
+    router = _EndpointRouter(["http://a:8080/", "http://b/v1", "https://b/v2"])
+    router.select()
+    router.record_success(0, 1.0)
+    stats = MemoryStatsCollector(get_crawler())
+    router.update_stats(stats, "prefix")
+    assert stats.get_stats() == {
+        "prefix/endpoints/0-a:8080/requests": 1,
+        "prefix/endpoints/0-a:8080/error_rate": 0.0,
+        "prefix/endpoints/0-a:8080/latency": 1.0,
+        "prefix/endpoints/1-b/requests": 0,
+        "prefix/endpoints/1-b/error_rate": 0.0,
+        "prefix/endpoints/2-b/requests": 0,
+        "prefix/endpoints/2-b/error_rate": 0.0,
+    }
+
+
+NO_RETRIES = AsyncRetrying(stop=stop_after_attempt(1), reraise=True)
+
+
+@ensureDeferred
+async def test_handler(mockserver):
+    bad_url = f"http://127.0.0.1:{get_ephemeral_port()}/"
+    settings = {
+        "ZYTE_API_URLS": [mockserver.urljoin("/"), bad_url],
+        "ZYTE_API_ENDPOINT_MAX_ERRORS": 1,
+        "ZYTE_API_RETRY_POLICY": NO_RETRIES,
+        "ZYTE_API_STATS_INTERVAL": 0,
+    }
+    async with make_handler(settings) as handler:
+        router = handler._endpoint_router
+        assert router is not None
+        request = Request("https://example.com", meta={"zyte_api": {}})
+        await handler.download_request(request, None)
+        with pytest.raises(Exception):
+            await handler.download_request(request, None)
+        for _ in range(3):
+            await handler.download_request(request, None)
+        assert [endpoint.requests for endpoint in router.endpoints] == [4, 1]
+        clients = {client for client, _ in handler._endpoint_transports.values()}
+        assert {client.api_url for client in clients} == {
+            mockserver.urljoin("/"),
+            bad_url,
+        }
+        stats = handler._stats
+        assert stats.get_value("scrapy-zyte-api/processed") == 5
+        netloc = mockserver.urljoin("/").split("/")[2]
+        assert stats.get_value(f"scrapy-zyte-api/endpoints/0-{netloc}/requests") == 4
+        sessions = [session for _, session in handler._endpoint_transports.values()]
+    assert all(session.closed for session in sessions)
@@ -1,24 +1,33 @@
+import asyncio
 import json
 import re
 import sys
 from copy import deepcopy
 from inspect import isclass
+from time import perf_counter
 from typing import Any, Dict
 from unittest import mock
 
 import pytest
 from pytest_twisted import ensureDeferred
-from scrapy import Request
+from scrapy import Request, signals
 from scrapy.exceptions import NotConfigured
 from scrapy.utils.misc import create_instance
 from scrapy.utils.test import get_crawler
+from twisted.internet import reactor
+from twisted.internet.task import deferLater
 from zyte_api.aio.client import AsyncClient
 from zyte_api.aio.retry import RetryFactory
 from zyte_api.constants import API_URL
 
-from scrapy_zyte_api.handler import ScrapyZyteAPIDownloadHandler
+from scrapy_zyte_api._timings import _ENQUEUED_META_KEY
+from scrapy_zyte_api.exceptions import ZyteAPITimeoutError
+from scrapy_zyte_api.handler import _DECODE_CHUNK_SIZE, ScrapyZyteAPIDownloadHandler
+from scrapy_zyte_api.responses import _process_response
+from scrapy_zyte_api.signals import request_timed
 
 from . import DEFAULT_CLIENT_CONCURRENCY, SETTINGS, UNSET, make_handler, set_env
+from .mockserver import DelayedResource, MockServer
 
 
 @pytest.mark.parametrize(
@@ -242,8 +251,16 @@ async def test_retry_policy(
 
 
 @ensureDeferred
-async def test_stats(mockserver):
-    async with make_handler({}, mockserver.urljoin("/")) as handler:
+@pytest.mark.parametrize(
+    "settings,immediate",
+    [
+        ({}, False),
+        ({"ZYTE_API_STATS_INTERVAL": 60}, False),
+        ({"ZYTE_API_STATS_INTERVAL": 0}, True),
+    ],
+)
+async def test_stats(settings, immediate, mockserver):
+    async with make_handler(settings, mockserver.urljoin("/")) as handler:
         scrapy_stats = handler._stats
         assert scrapy_stats.get_stats() == {}
 
@@ -251,6 +268,10 @@ async def test_stats(mockserver):
         request = Request("https://example.com", meta=meta)
         await handler.download_request(request, None)
 
+        if not immediate:
+            assert scrapy_stats.get_stats() == {}
+            handler._flush_stats()
+
         assert set(scrapy_stats.get_stats()) == {
             f"scrapy-zyte-api/{stat}"
             for stat in (
@@ -402,7 +423,7 @@ async def test_log_request_truncate(
             await handler.download_request(request, None)
 
         # Check that the logged params are truncated.
-        logged_message = logger.debug.call_args[0][0]
+        logged_message = logger.debug.call_args[0][0] % logger.debug.call_args[0][1:]
         logged_params_json_match = re.search(r"\{.*", logged_message)
         assert logged_params_json_match is not None
         logged_params_json = logged_params_json_match[0]
@@ -416,6 +437,62 @@ async def test_log_request_truncate(
         assert actual_api_params == expected_api_params
 
 
+@ensureDeferred
+@pytest.mark.skipif(sys.version_info < (3, 8), reason="unittest.mock.AsyncMock")
+async def test_log_request_level(caplog):
+    """Parameters are not serialized unless the log record is emitted."""
+    settings = {"ZYTE_API_LOG_REQUESTS": True}
+    async with make_handler(settings) as handler:
+        handler._client = mock.AsyncMock(handler._client)
+        handler._client.request_raw.return_value = {"browserHtml": "", "url": ""}
+        meta = {"zyte_api": {"browserHtml": True}}
+        with mock.patch.object(
+            handler._json_codec, "dumps", wraps=handler._json_codec.dumps
+        ) as dumps:
+            with caplog.at_level("INFO", logger="scrapy_zyte_api.handler"):
+                await handler.download_request(
+                    Request("https://example.com", meta=meta), None
+                )
+            dumps.assert_not_called()
+            with caplog.at_level("DEBUG", logger="scrapy_zyte_api.handler"):
+                await handler.download_request(
+                    Request("https://example.com", meta=meta), None
+                )
+            dumps.assert_called()
+        assert caplog.text.count("Sending Zyte API extract request") == 1
+
+
+@ensureDeferred
+@pytest.mark.skipif(sys.version_info < (3, 8), reason="unittest.mock.AsyncMock")
+@pytest.mark.parametrize("sample_rate,expected", [(1, 10), (0.5, 5), (0.1, 1)])
+async def test_log_request_sample_rate(sample_rate, expected):
+    settings = {
+        "ZYTE_API_LOG_REQUESTS": True,
+        "ZYTE_API_LOG_REQUESTS_SAMPLE_RATE": sample_rate,
+    }
+    async with make_handler(settings) as handler:
+        handler._client = mock.AsyncMock(handler._client)
+        handler._client.request_raw.return_value = {"browserHtml": "", "url": ""}
+        with mock.patch("scrapy_zyte_api.handler.logger") as logger:
+            for _ in range(10):
+                meta = {"zyte_api": {"browserHtml": True}}
+                await handler.download_request(
+                    Request("https://example.com", meta=meta), None
+                )
+        assert logger.debug.call_count == expected
+
+
+@pytest.mark.parametrize("sample_rate", [0, -0.5, 1.5])
+def test_log_request_sample_rate_invalid(sample_rate):
+    settings = {
+        **SETTINGS,
+        "ZYTE_API_LOG_REQUESTS_SAMPLE_RATE": sample_rate,
+    }
+    crawler = get_crawler(settings_dict=settings)
+    with pytest.raises(ValueError):
+        create_instance(ScrapyZyteAPIDownloadHandler, settings=None, crawler=crawler)
+
+
 @pytest.mark.parametrize("enabled", [True, False])
 def test_log_request_truncate_negative(enabled):
     settings: Dict[str, Any] = {
@@ -430,3 +507,355 @@ def test_log_request_truncate_negative(enabled):
             settings=None,
             crawler=crawler,
         )
+
+
+def test_invalid_settings_no_timers():
+    """Invalid settings do not leave timers running."""
+    settings: Dict[str, Any] = {
+        **SETTINGS,
+        "ZYTE_API_LATENCY_STATS": True,
+        "ZYTE_API_LOG_REQUESTS_TRUNCATE": -1,
+        "ZYTE_API_LOOP_LAG_INTERVAL": 1.0,
+    }
+    crawler = get_crawler(settings_dict=settings)
+    with mock.patch("scrapy_zyte_api.handler.LoopingCall") as looping_call, mock.patch(
+        "scrapy_zyte_api.handler._LoopLagMonitor"
+    ) as loop_lag_monitor:
+        with pytest.raises(ValueError):
+            create_instance(
+                ScrapyZyteAPIDownloadHandler,
+                settings=None,
+                crawler=crawler,
+            )
+    looping_call.return_value.start.assert_not_called()
+    loop_lag_monitor.return_value.start.assert_not_called()
+
+
+@ensureDeferred
+@pytest.mark.skipif(sys.version_info < (3, 8), reason="unittest.mock.AsyncMock")
+@pytest.mark.parametrize(
+    "settings,expected_calls",
+    [
+        ({}, 2),
+        ({"ZYTE_API_COALESCE_REQUESTS": False}, 2),
+        ({"ZYTE_API_COALESCE_REQUESTS": True}, 1),
+    ],
+)
+async def test_coalesce_requests(settings, expected_calls):
+    async with make_handler(settings) as handler:
+        handler._client = mock.AsyncMock(handler._client)
+
+        async def request_raw(api_params, **kwargs):
+            await asyncio.sleep(0.01)
+            return {
+                "url": api_params["url"],
+                "browserHtml": "<html></html>",
+                "echoData": api_params["echoData"],
+            }
+
+        handler._client.request_raw.side_effect = request_raw
+        requests = [
+            Request(
+                "https://example.com",
+                meta={"zyte_api": {"browserHtml": True, "echoData": i}},
+                dont_filter=True,
+            )
+            for i in range(2)
+        ]
+        deferreds = [handler.download_request(request, None) for request in requests]
+        responses = [await deferred for deferred in deferreds]
+
+        assert handler._client.request_raw.call_count == expected_calls
+        coalesced = 2 - expected_calls
+        assert handler._stats.get_value("scrapy-zyte-api/coalesced", 0) == coalesced
+        for i, response in enumerate(responses):
+            assert response.request is requests[i]
+            assert response.text == "<html></html>"
+            assert response.raw_api_response["echoData"] == i
+        assert not handler._in_flight
+
+
+@ensureDeferred
+@pytest.mark.skipif(sys.version_info < (3, 8), reason="unittest.mock.AsyncMock")
+async def test_coalesce_requests_error():
+    settings = {"ZYTE_API_COALESCE_REQUESTS": True}
+    async with make_handler(settings) as handler:
+        handler._client = mock.AsyncMock(handler._client)
+
+        async def request_raw(api_params, **kwargs):
+            await asyncio.sleep(0.01)
+            raise RuntimeError
+
+        handler._client.request_raw.side_effect = request_raw
+        request = Request("https://example.com", meta={"zyte_api": {}})
+        deferreds = [handler.download_request(request, None) for _ in range(2)]
+        for deferred in deferreds:
+            with pytest.raises(RuntimeError):
+                await deferred
+        assert handler._client.request_raw.call_count == 1
+        assert not handler._in_flight
+
+
+@ensureDeferred
+@pytest.mark.skipif(sys.version_info < (3, 8), reason="unittest.mock.AsyncMock")
+@pytest.mark.parametrize(
+    "meta1,meta2",
+    [
+        # Requests with different headers get different responses.
+        (
+            {"zyte_api_automap": {"browserHtml": True}},
+            {"zyte_api_automap": {"browserHtml": True}, "_headers": {"Referer": "a"}},
+        ),
+        (
+            {"zyte_api": {"browserHtml": True, "requestHeaders": {"referer": "a"}}},
+            {"zyte_api": {"browserHtml": True, "requestHeaders": {"referer": "b"}}},
+        ),
+        # Requests with a different timeout or retry policy are sent separately.
+        (
+            {"zyte_api": {"browserHtml": True}},
+            {"zyte_api": {"browserHtml": True}, "zyte_api_timeout": 60},
+        ),
+        (
+            {"zyte_api": {"browserHtml": True}},
+            {
+                "zyte_api": {"browserHtml": True},
+                "zyte_api_retry_policy": "zyte_api.aio.retry.zyte_api_retrying",
+            },
+        ),
+    ],
+)
+async def test_coalesce_requests_different(meta1, meta2):
+    settings = {"ZYTE_API_COALESCE_REQUESTS": True}
+    async with make_handler(settings) as handler:
+        handler._client = mock.AsyncMock(handler._client)
+
+        async def request_raw(api_params, **kwargs):
+            await asyncio.sleep(0.01)
+            return {"url": api_params["url"], "browserHtml": "<html></html>"}
+
+        handler._client.request_raw.side_effect = request_raw
+        requests = []
+        for meta in (meta1, meta2):
+            meta = dict(meta)
+            headers = meta.pop("_headers", None)
+            requests.append(
+                Request(
+                    "https://example.com",
+                    headers=headers,
+                    meta=meta,
+                    dont_filter=True,
+                )
+            )
+        deferreds = [handler.download_request(request, None) for request in requests]
+        for deferred in deferreds:
+            await deferred
+        assert handler._client.request_raw.call_count == 2
+        assert handler._stats.get_value("scrapy-zyte-api/coalesced") is None
+
+
+@ensureDeferred
+@pytest.mark.skipif(sys.version_info < (3, 8), reason="unittest.mock.AsyncMock")
+async def test_coalesce_requests_cancel():
+    """Cancelling a coalesced request does not cancel the others, and the
+    shared Zyte API request is only cancelled once all of them are."""
+    settings = {"ZYTE_API_COALESCE_REQUESTS": True}
+    async with make_handler(settings) as handler:
+        handler._client = mock.AsyncMock(handler._client)
+        cancelled = []
+
+        async def request_raw(api_params, **kwargs):
+            try:
+                await asyncio.sleep(0.05)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+            return {"url": api_params["url"], "browserHtml": "<html></html>"}
+
+        handler._client.request_raw.side_effect = request_raw
+        request = Request("https://example.com", meta={"zyte_api": {}})
+        deferreds = [handler.download_request(request, None) for _ in range(2)]
+        deferreds[0].cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await deferreds[0]
+        response = await deferreds[1]
+        assert response.text == "<html></html>"
+        assert handler._client.request_raw.call_count == 1
+        assert not cancelled
+        assert not handler._in_flight
+
+        deferreds = [handler.download_request(request, None) for _ in range(2)]
+        for deferred in deferreds:
+            deferred.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await deferred
+        await deferLater(reactor, 0.01, lambda: None)  # type: ignore[arg-type]
+        assert cancelled == [True]
+        assert not handler._in_flight
+
+
+@ensureDeferred
+async def test_stats_flush(mockserver):
+    """Stats are flushed periodically, and when the spider closes."""
+    settings = {
+        **SETTINGS,
+        "ZYTE_API_STATS_INTERVAL": 0.01,
+        "ZYTE_API_URL": mockserver.urljoin("/"),
+    }
+    crawler = get_crawler(settings_dict=settings)
+    handler = ScrapyZyteAPIDownloadHandler(crawler.settings, crawler)
+    try:
+        meta = {"zyte_api": {"foo": "bar"}}
+        request = Request("https://example.com", meta=meta)
+        await handler.download_request(request, None)
+        assert crawler.stats.get_value("scrapy-zyte-api/processed") is None
+        await deferLater(reactor, 0.05, lambda: None)  # type: ignore[arg-type]
+        assert crawler.stats.get_value("scrapy-zyte-api/processed") == 1
+
+        await handler.download_request(request, None)
+        crawler.signals.send_catch_log(signals.spider_closed)
+        assert crawler.stats.get_value("scrapy-zyte-api/processed") == 2
+    finally:
+        await handler._close()
+
+
+@ensureDeferred
+@pytest.mark.parametrize(
+    "meta",
+    [
+        {"httpResponseBody": True},
+        {"browserHtml": True},
+    ],
+)
+async def test_timings(meta, mockserver):
+    settings = {
+        **SETTINGS,
+        "ZYTE_API_TIMINGS": True,
+        "ZYTE_API_URL": mockserver.urljoin("/"),
+    }
+    crawler = get_crawler(settings_dict=settings)
+    received = []
+
+    def track(**kwargs):
+        received.append(kwargs)
+
+    crawler.signals.connect(track, signal=request_timed)
+    handler = ScrapyZyteAPIDownloadHandler(crawler.settings, crawler)
+    try:
+        request = Request(
+            "https://example.com",
+            meta={"zyte_api": meta, _ENQUEUED_META_KEY: perf_counter()},
+        )
+        response = await handler.download_request(request, None)
+    finally:
+        await handler._close()
+
+    timings = response.meta["zyte_api_timings"]
+    assert list(timings) == [
+        "scheduling",
+        "params",
+        "queue",
+        "api",
+        "decoding",
+        "building",
+    ]
+    assert all(value >= 0 for value in timings.values())
+    assert len(received) == 1
+    assert received[0]["request"] is request
+    assert received[0]["response"] is response
+    assert received[0]["timings"] is timings
+
+
+@ensureDeferred
+async def test_timings_disabled(mockserver):
+    async with make_handler({}, mockserver.urljoin("/")) as handler:
+        request = Request("https://example.com", meta={"zyte_api": {}})
+        response = await handler.download_request(request, None)
+    assert "zyte_api_timings" not in response.meta
+
+
+@ensureDeferred
+@pytest.mark.parametrize(
+    "threshold,threaded",
+    [
+        (UNSET, False),
+        (0, False),
+        (1, True),
+    ],
+)
+async def test_decode_thread_threshold(threshold, threaded, mockserver):
+    settings = {"ZYTE_API_STATS_INTERVAL": 0}
+    if threshold is not UNSET:
+        settings["ZYTE_API_DECODE_THREAD_THRESHOLD"] = threshold
+    async with make_handler(settings, mockserver.urljoin("/")) as handler:
+        meta = {"zyte_api": {"httpResponseBody": True}}
+        request = Request("https://example.com", meta=meta)
+        with mock.patch(
+            "scrapy_zyte_api.handler._process_response",
+            wraps=_process_response,
+        ) as process_response:
+            response = await handler.download_request(request, None)
+        assert response.body == b"<html><body>Hello<h1>World!</h1></body></html>"
+        stat = handler._stats.get_value("scrapy-zyte-api/threaded_decoding")
+        assert stat == (1 if threaded else None)
+        kwargs = process_response.call_args[1]
+        assert kwargs.get("decode_chunk_size") == (
+            _DECODE_CHUNK_SIZE if threaded else None
+        )
+
+
+@ensureDeferred
+@pytest.mark.parametrize(
+    "setting,meta,timeout",
+    [
+        (None, 0.05, 0.05),
+        (0.05, None, 0.05),
+        (10, 0.05, 0.05),
+        (0.05, 0, None),
+        (None, None, None),
+    ],
+)
+async def test_timeout(setting, meta, timeout):
+    settings = {}
+    if setting is not None:
+        settings["ZYTE_API_TIMEOUT"] = setting
+    request_meta: Dict[str, Any] = {"zyte_api": {"browserHtml": True, "delay": 0.3}}
+    if meta is not None:
+        request_meta["zyte_api_timeout"] = meta
+    request = Request("https://example.com", meta=request_meta)
+    with MockServer(DelayedResource) as server:
+        async with make_handler(settings, server.urljoin("/")) as handler:
+            start = perf_counter()
+            if timeout is None:
+                await handler.download_request(request, None)
+                assert handler._stats.get_value("scrapy-zyte-api/timeouts") is None
+                return
+            try:
+                await handler.download_request(request, None)
+            except ZyteAPITimeoutError as error:
+                assert error.timeout == timeout
+            else:
+                pytest.fail("ZyteAPITimeoutError not raised")
+            assert perf_counter() - start < 0.3
+            assert handler._stats.get_value("scrapy-zyte-api/timeouts") == 1
+
+
+@ensureDeferred
+@pytest.mark.skipif(sys.version_info < (3, 8), reason="unittest.mock.AsyncMock")
+async def test_timeout_cancel():
+    settings = {"ZYTE_API_TIMEOUT": 0.1}
+    async with make_handler(settings) as handler:
+        handler._client = mock.AsyncMock(handler._client)
+        cancelled = []
+
+        async def request_raw(api_params, **kwargs):
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        handler._client.request_raw.side_effect = request_raw
+        request = Request("https://example.com", meta={"zyte_api": {}})
+        with pytest.raises(ZyteAPITimeoutError):
+            await handler.download_request(request, None)
+        assert cancelled == [True]
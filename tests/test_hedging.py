@@ -0,0 +1,192 @@
+import asyncio
+import sys
+from unittest import mock
+
+import pytest
+from pytest_twisted import ensureDeferred
+from scrapy import Request
+
+from scrapy_zyte_api._hedging import _Hedger
+from scrapy_zyte_api._latency import _LatencyHistogram
+from scrapy_zyte_api.exceptions import ZyteAPITimeoutError
+
+from . import make_handler
+
+
+def test_invalid_percentile():
+    with pytest.raises(ValueError):
+        _Hedger(percentile=100)
+
+
+def test_delay():
+    hedger = _Hedger(min_samples=10)
+    browser = {"browserHtml": True}
+    http = {"httpResponseBody": True}
+    for i in range(1, 10):
+        hedger.record(i, api_params=browser)
+    assert hedger.delay(browser) is None
+    hedger.record(10, api_params=browser)
+    assert hedger.delay(browser) == pytest.approx(10, rel=0.05)
+    # Request types do not share latency data.
+    assert hedger.delay(http) is None
+    assert hedger.requests == 3
+
+
+def test_max_ratio():
+    hedger = _Hedger(max_ratio=0.1)
+    for _ in range(9):
+        hedger.delay({})
+    assert not hedger.hedge()
+    hedger.delay({})
+    assert hedger.hedge()
+    assert not hedger.hedge()
+    assert hedger.hedges == 1
+
+
+def test_window():
+    hedger = _Hedger(percentile=50, min_samples=1, window=10)
+    for _ in range(9):
+        hedger.record(10, api_params={})
+    assert hedger.delay({}) == pytest.approx(10, rel=0.05)
+    # Once the window is reached, old data weighs less.
+    for _ in range(6):
+        hedger.record(0.1, api_params={})
+    assert hedger.delay({}) == pytest.approx(0.1, rel=0.05)
+
+
+def test_histogram_decay():
+    histogram = _LatencyHistogram()
+    for _ in range(3):
+        histogram.record(1)
+    histogram.record(2)
+    histogram.decay()
+    assert histogram.count == 1
+    assert histogram.percentile(100) == pytest.approx(1, rel=0.05)
+
+
+@pytest.mark.parametrize(
+    "settings,enabled",
+    [
+        ({}, False),
+        ({"ZYTE_API_HEDGING": True}, True),
+    ],
+)
+@ensureDeferred
+async def test_settings(settings, enabled):
+    async with make_handler(settings) as handler:
+        assert (handler._hedger is not None) is enabled
+
+
+async def _prepare(handler, delays):
+    handler._client = mock.AsyncMock(handler._client)
+    cancelled = []
+    delays = iter(delays)
+
+    async def request_raw(api_params, **kwargs):
+        delay, error = next(delays)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(delay)
+            raise
+        if error:
+            raise error
+        return {"url": api_params["url"], "browserHtml": str(delay)}
+
+    handler._client.request_raw.side_effect = request_raw
+    for _ in range(20):
+        handler._hedger.record(0.05, api_params={"browserHtml": True})
+    return cancelled
+
+
+@ensureDeferred
+@pytest.mark.skipif(sys.version_info < (3, 8), reason="unittest.mock.AsyncMock")
+@pytest.mark.parametrize(
+    "delays,body,hedges,wins,cancelled",
+    [
+        # Fast enough, no hedging.
+        ([(0.01, None)], "0.01", None, None, []),
+        # The hedged request wins.
+        ([(1.0, None), (0.01, None)], "0.01", 1, 1, [1.0]),
+        # The original request wins.
+        ([(0.1, None), (1.0, None)], "0.1", 1, None, [1.0]),
+        # The original request fails, the hedged request wins.
+        ([(0.1, ValueError()), (0.2, None)], "0.2", 1, 1, []),
+    ],
+)
+async def test_handler(delays, body, hedges, wins, cancelled):
+    settings = {"ZYTE_API_HEDGING": True, "ZYTE_API_HEDGING_MAX_RATIO": 1}
+    async with make_handler(settings) as handler:
+        actual_cancelled = await _prepare(handler, delays)
+        request = Request(
+            "https://example.com", meta={"zyte_api": {"browserHtml": True}}
+        )
+        response = await handler.download_request(request, None)
+        assert response.text == body
+        assert actual_cancelled == cancelled
+        stats = handler._stats
+        assert stats.get_value("scrapy-zyte-api/hedging/requests") == hedges
+        assert stats.get_value("scrapy-zyte-api/hedging/wins") == wins
+
+
+@ensureDeferred
+@pytest.mark.skipif(sys.version_info < (3, 8), reason="unittest.mock.AsyncMock")
+async def test_handler_errors():
+    settings = {"ZYTE_API_HEDGING": True, "ZYTE_API_HEDGING_MAX_RATIO": 1}
+    async with make_handler(settings) as handler:
+        await _prepare(handler, [(0.1, ValueError("a")), (0.01, ValueError("b"))])
+        request = Request(
+            "https://example.com", meta={"zyte_api": {"browserHtml": True}}
+        )
+        with pytest.raises(ValueError, match="a"):
+            await handler.download_request(request, None)
+
+
+@ensureDeferred
+@pytest.mark.skipif(sys.version_info < (3, 8), reason="unittest.mock.AsyncMock")
+async def test_handler_max_ratio():
+    settings = {"ZYTE_API_HEDGING": True}
+    async with make_handler(settings) as handler:
+        await _prepare(handler, [(0.1, None)])
+        request = Request(
+            "https://example.com", meta={"zyte_api": {"browserHtml": True}}
+        )
+        await handler.download_request(request, None)
+        assert handler._stats.get_value("scrapy-zyte-api/hedging/requests") is None
+
+
+@ensureDeferred
+@pytest.mark.skipif(sys.version_info < (3, 8), reason="unittest.mock.AsyncMock")
+@pytest.mark.parametrize(
+    "delays,timeout,minimum,maximum",
+    [
+        # The original request wins.
+        ([(0.1, None), (1.0, None)], 0, 0.1, 0.5),
+        # The hedged request wins, the time of the cancelled original request
+        # is recorded as a lower bound.
+        ([(1.0, None), (0.01, None)], 0, 0.05, 0.5),
+        # The request times out before hedging.
+        ([(1.0, None)], 0.02, 0.02, 0.05),
+    ],
+)
+async def test_handler_record(delays, timeout, minimum, maximum):
+    settings = {
+        "ZYTE_API_HEDGING": True,
+        "ZYTE_API_HEDGING_MAX_RATIO": 1,
+        "ZYTE_API_TIMEOUT": timeout,
+    }
+    async with make_handler(settings) as handler:
+        await _prepare(handler, delays)
+        request = Request(
+            "https://example.com", meta={"zyte_api": {"browserHtml": True}}
+        )
+        with mock.patch.object(
+            handler._hedger, "record", wraps=handler._hedger.record
+        ) as record:
+            try:
+                await handler.download_request(request, None)
+            except ZyteAPITimeoutError:
+                assert timeout
+        assert record.call_count == 1
+        seconds = record.call_args[0][0]
+        assert minimum <= seconds < maximum
@@ -0,0 +1,113 @@
+import json
+import threading
+from unittest import mock
+
+import pytest
+from pytest_twisted import ensureDeferred
+from scrapy import Request
+from scrapy.settings import Settings
+
+from scrapy_zyte_api._json import _ClientResponse, _load_json_codec
+
+from . import make_handler
+
+
+@pytest.mark.parametrize("value", [None, "", "json"])
+def test_default(value):
+    codec = _load_json_codec(Settings({"ZYTE_API_JSON_CODEC": value}))
+    assert codec.name == "json"
+    assert codec.dumps is json.dumps
+    assert codec.loads is json.loads
+    assert codec.session_kwargs() == {}
+
+
+def test_orjson():
+    orjson = pytest.importorskip("orjson")
+    codec = _load_json_codec(Settings({"ZYTE_API_JSON_CODEC": "orjson"}))
+    assert codec.name == "orjson"
+    assert codec.loads is orjson.loads
+    assert codec.dumps({"a": "ü"}) == '{"a":"ü"}'
+    assert set(codec.session_kwargs()) == {"json_serialize", "response_class"}
+
+
+@pytest.mark.parametrize(
+    "modules,expected",
+    [
+        ({}, "orjson"),
+        ({"orjson": None}, "ujson"),
+        ({"orjson": None, "ujson": None}, "json"),
+    ],
+)
+def test_auto(modules, expected, caplog):
+    pytest.importorskip("orjson")
+    ujson_module = mock.Mock(dumps=json.dumps, loads=json.loads)
+    with mock.patch.dict("sys.modules", {"ujson": ujson_module, **modules}):
+        codec = _load_json_codec(Settings({"ZYTE_API_JSON_CODEC": "auto"}))
+    assert codec.name == expected
+    assert not caplog.records
+
+
+def test_missing(caplog):
+    with mock.patch.dict("sys.modules", {"ujson": None}):
+        codec = _load_json_codec(Settings({"ZYTE_API_JSON_CODEC": "ujson"}))
+    assert codec.name == "json"
+    assert "ujson is not installed" in caplog.text
+
+
+def test_invalid():
+    with pytest.raises(ValueError, match="ZYTE_API_JSON_CODEC"):
+        _load_json_codec(Settings({"ZYTE_API_JSON_CODEC": "foo"}))
+
+
+@ensureDeferred
+async def test_handler(mockserver):
+    pytest.importorskip("orjson")
+    settings = {"ZYTE_API_JSON_CODEC": "orjson"}
+    async with make_handler(settings, mockserver.urljoin("/")) as handler:
+        assert handler._json_codec.name == "orjson"
+        assert issubclass(handler._session._response_class, _ClientResponse)
+        request = Request(
+            "https://example.com", meta={"zyte_api": {"browserHtml": True}}
+        )
+        response = await handler.download_request(request, None)
+    assert response.text == "<html><body>Hello<h1>World!</h1></body></html>"
+
+
+def test_session_kwargs_thread_threshold():
+    codec = _load_json_codec(Settings({}))
+    kwargs = codec.session_kwargs(thread_threshold=10)
+    assert set(kwargs) == {"response_class"}
+    assert issubclass(kwargs["response_class"], _ClientResponse)
+    assert kwargs["response_class"]._thread_threshold == 10
+    assert kwargs["response_class"]._json_loads is json.loads
+
+
+@ensureDeferred
+@pytest.mark.parametrize(
+    "threshold,threaded",
+    [
+        (0, False),
+        (1, True),
+        (1024 * 1024, False),
+    ],
+)
+async def test_thread_threshold(threshold, threaded, mockserver):
+    """JSON responses of at least ZYTE_API_DECODE_THREAD_THRESHOLD bytes are
+    parsed in a thread."""
+    threads = []
+    json_loads = json.loads
+
+    def loads(*args, **kwargs):
+        threads.append(threading.current_thread())
+        return json_loads(*args, **kwargs)
+
+    settings = {"ZYTE_API_DECODE_THREAD_THRESHOLD": threshold}
+    with mock.patch("json.loads", loads):
+        async with make_handler(settings, mockserver.urljoin("/")) as handler:
+            request = Request(
+                "https://example.com", meta={"zyte_api": {"browserHtml": True}}
+            )
+            response = await handler.download_request(request, None)
+    assert response.text == "<html><body>Hello<h1>World!</h1></body></html>"
+    main_thread = threading.main_thread()
+    assert any(thread is not main_thread for thread in threads) is threaded
@@ -0,0 +1,110 @@
+from collections import Counter
+
+import pytest
+from pytest_twisted import ensureDeferred
+from scrapy import Request
+from scrapy.settings import Settings
+from zyte_api.aio.client import AsyncClient
+
+from scrapy_zyte_api._key_pool import _KeyPool, _load_api_keys, _PooledKey
+
+from . import make_handler
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        (None, {}),
+        ([], {}),
+        (["a", "b"], {"a": 1.0, "b": 1.0}),
+        ("a,b", {"a": 1.0, "b": 1.0}),
+        ({"a": 2, "b": 1}, {"a": 2.0, "b": 1.0}),
+        ('{"a": 2, "b": 1}', {"a": 2.0, "b": 1.0}),
+    ],
+)
+def test_load_api_keys(value, expected):
+    assert _load_api_keys(Settings({"ZYTE_API_KEYS": value})) == expected
+
+
+def make_pool(weights):
+    return _KeyPool(
+        [
+            _PooledKey(AsyncClient(api_key=f"key{index}"), weight=weight)
+            for index, weight in enumerate(weights)
+        ]
+    )
+
+
+def test_invalid():
+    with pytest.raises(ValueError):
+        _KeyPool([])
+    with pytest.raises(ValueError):
+        make_pool([0])
+
+
+def test_names():
+    pool = _KeyPool(
+        [
+            _PooledKey(AsyncClient(api_key="abcdefgh1")),
+            _PooledKey(AsyncClient(api_key="abcdefgh2")),
+        ]
+    )
+    assert [key.name for key in pool.keys] == ["0-abcdefg", "1-abcdefg"]
+
+
+def test_select():
+    pool = make_pool([2, 1])
+    # Smooth weighted round-robin interleaves keys instead of sending bursts
+    # to the heaviest one.
+    assert [pool.select() for _ in range(6)] == [0, 1, 0, 0, 1, 0]
+
+
+def test_select_throttling():
+    pool = make_pool([1, 1])
+    agg_stats = pool.keys[0].client.agg_stats
+    agg_stats.n_attempts = 4
+    agg_stats.n_429 = 3
+    counts = Counter(pool.select() for _ in range(500))
+    assert counts == {0: 100, 1: 400}
+
+
+def test_agg_stats():
+    pool = make_pool([1, 1])
+    for index, key in enumerate(pool.keys):
+        agg_stats = key.client.agg_stats
+        agg_stats.n_attempts = index + 1
+        agg_stats.n_success = 1
+        agg_stats.status_codes[200] += 1
+        agg_stats.time_total_stats.push(index + 1)
+    combined = pool.agg_stats()
+    assert combined.n_attempts == 3
+    assert combined.n_success == 2
+    assert combined.status_codes == {200: 2}
+    assert combined.time_total_stats.mean() == 1.5
+
+
+@ensureDeferred
+@pytest.mark.parametrize("adaptive", [True, False])
+async def test_handler(adaptive, mockserver):
+    settings = {
+        "ZYTE_API_KEYS": {"key1-abcdef": 1, "key2-abcdef": 1},
+        "ZYTE_API_ADAPTIVE_CONCURRENCY": adaptive,
+        "ZYTE_API_STATS_INTERVAL": 0,
+    }
+    async with make_handler(settings, mockserver.urljoin("/")) as handler:
+        assert handler._key_pool is not None
+        assert handler._client is handler._key_pool.keys[0].client
+        assert handler._concurrency_limiter is None
+        for _ in range(2):
+            request = Request("https://example.com", meta={"zyte_api": {}})
+            await handler.download_request(request, None)
+        stats = handler._stats.get_stats()
+        assert stats["scrapy-zyte-api/attempts"] == 2
+        for name in ("0-key1-ab", "1-key2-ab"):
+            assert stats[f"scrapy-zyte-api/keys/{name}/attempts"] == 1
+            assert stats[f"scrapy-zyte-api/keys/{name}/status_codes/200"] == 1
+            assert (
+                f"scrapy-zyte-api/keys/{name}/adaptive_concurrency" in stats
+            ) is adaptive
+        sessions = handler._key_sessions
+    assert all(session.closed for session in sessions)
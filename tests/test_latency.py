@@ -0,0 +1,178 @@
+import re
+import time
+
+import pytest
+from pytest_twisted import ensureDeferred
+from scrapy import Request
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+from twisted.internet import reactor
+from twisted.internet.task import deferLater
+
+from scrapy_zyte_api._latency import _LatencyHistogram, _LatencyStats, _LoopLagMonitor
+
+from . import make_handler
+
+
+def test_histogram_empty():
+    assert _LatencyHistogram().percentile(50) == 0.0
+
+
+@pytest.mark.parametrize("value", [0.002, 0.5, 1.0, 3.7, 42.0, 600.0])
+def test_histogram_precision(value):
+    histogram = _LatencyHistogram()
+    histogram.record(value)
+    assert histogram.percentile(50) == pytest.approx(value, rel=0.05)
+
+
+def test_histogram_out_of_range():
+    histogram = _LatencyHistogram()
+    histogram.record(0)
+    assert histogram.percentile(50) < 0.0011
+    histogram = _LatencyHistogram()
+    histogram.record(10**6)
+    assert 1000 < histogram.percentile(50) < 1300
+
+
+def test_histogram_percentiles():
+    histogram = _LatencyHistogram()
+    for i in range(1, 101):
+        histogram.record(i / 10)
+    assert histogram.count == 100
+    assert histogram.percentile(50) == pytest.approx(5.0, rel=0.05)
+    assert histogram.percentile(95) == pytest.approx(9.5, rel=0.05)
+    assert histogram.percentile(99) == pytest.approx(9.9, rel=0.05)
+    assert histogram.percentile(100) == pytest.approx(10.0, rel=0.05)
+
+
+@pytest.mark.parametrize("by_domain", [True, False])
+def test_stats(by_domain):
+    latency_stats = _LatencyStats(by_domain=by_domain)
+    latency_stats.record(
+        1.0, api_params={"browserHtml": True, "screenshot": True}, domain="a.example"
+    )
+    latency_stats.record(0.1, api_params={}, domain="b.example")
+    stats = MemoryStatsCollector(get_crawler())
+    latency_stats.update_stats(stats, "prefix")
+    keys = ["", "type/browserHtml/", "type/screenshot/", "type/other/"]
+    if by_domain:
+        keys += ["domain/a.example/", "domain/b.example/"]
+    assert set(stats.get_stats()) == {
+        f"prefix/response_seconds/{key}p{p}" for key in keys for p in (50, 95, 99)
+    }
+    assert stats.get_value(
+        "prefix/response_seconds/type/browserHtml/p50"
+    ) == pytest.approx(1.0, rel=0.05)
+
+    # Only histograms updated since the previous call are published.
+    stats.clear_stats()
+    latency_stats.record(0.1, api_params={"browserHtml": True}, domain="a.example")
+    latency_stats.update_stats(stats, "prefix")
+    keys = ["", "type/browserHtml/"]
+    if by_domain:
+        keys += ["domain/a.example/"]
+    assert set(stats.get_stats()) == {
+        f"prefix/response_seconds/{key}p{p}" for key in keys for p in (50, 95, 99)
+    }
+
+
+def test_max_domains():
+    with pytest.raises(ValueError):
+        _LatencyStats(max_domains=0)
+    latency_stats = _LatencyStats(by_domain=True, max_domains=2)
+    stats = MemoryStatsCollector(get_crawler())
+    for domain in ("a.example", "b.example", "a.example", "c.example"):
+        latency_stats.record(1.0, api_params={}, domain=domain)
+        latency_stats.update_stats(stats, "prefix")
+    # b.example is the least recently recorded domain.
+    assert set(latency_stats._histograms) == {
+        "",
+        "type/other/",
+        "domain/a.example/",
+        "domain/c.example/",
+    }
+    keys = ["", "type/other/", "domain/a.example/", "domain/c.example/"]
+    assert set(stats.get_stats()) == {
+        f"prefix/response_seconds/{key}p{p}" for key in keys for p in (50, 95, 99)
+    }
+
+    # An evicted domain recorded again before a stats update keeps its stats.
+    latency_stats.record(1.0, api_params={}, domain="b.example")
+    latency_stats.record(1.0, api_params={}, domain="a.example")
+    latency_stats.record(1.0, api_params={}, domain="b.example")
+    latency_stats.update_stats(stats, "prefix")
+    assert "prefix/response_seconds/domain/b.example/p50" in stats.get_stats()
+    assert "prefix/response_seconds/domain/c.example/p50" not in stats.get_stats()
+
+
+def test_log(caplog):
+    latency_stats = _LatencyStats()
+    with caplog.at_level("INFO"):
+        latency_stats.log()
+    assert not caplog.records
+
+    latency_stats.record(1.0, api_params={"browserHtml": True}, domain="a.example")
+    with caplog.at_level("INFO"):
+        latency_stats.log()
+        latency_stats.log()
+    assert len(caplog.records) == 1
+    assert re.fullmatch(
+        r"Zyte API response times: all \(p50=\S+s, p95=\S+s, p99=\S+s\); "
+        r"browserHtml \(p50=\S+s, p95=\S+s, p99=\S+s\)",
+        caplog.records[0].getMessage(),
+    )
+
+
+@ensureDeferred
+@pytest.mark.parametrize("enabled", [True, False])
+async def test_handler(enabled, mockserver):
+    settings = {
+        "ZYTE_API_LATENCY_STATS": enabled,
+        "ZYTE_API_LATENCY_STATS_BY_DOMAIN": True,
+        "ZYTE_API_STATS_INTERVAL": 0,
+    }
+    async with make_handler(settings, mockserver.urljoin("/")) as handler:
+        request = Request("https://example.com", meta={"zyte_api": {}})
+        await handler.download_request(request, None)
+        stats = handler._stats.get_stats()
+        for key in ("p50", "domain/example.com/p99"):
+            stat = f"scrapy-zyte-api/response_seconds/{key}"
+            if enabled:
+                assert stats[stat] > 0.0
+            else:
+                assert stat not in stats
+        assert (handler._latency_log_loop is not None) is enabled
+
+
+@ensureDeferred
+async def test_loop_lag_monitor():
+    monitor = _LoopLagMonitor(0.01)
+    stats = MemoryStatsCollector(get_crawler())
+    monitor.start()
+    try:
+        monitor.update_stats(stats, "prefix")
+        assert not stats.get_stats()
+        await deferLater(reactor, 0.005, time.sleep, 0.05)  # type: ignore[arg-type]
+        await deferLater(reactor, 0.05, lambda: None)  # type: ignore[arg-type]
+    finally:
+        monitor.stop()
+    assert not monitor._call
+    monitor.update_stats(stats, "prefix")
+    assert stats.get_value("prefix/loop_lag_seconds/max") >= 0.04
+    assert 0 < stats.get_value("prefix/loop_lag_seconds/mean") < 0.05
+
+
+@ensureDeferred
+@pytest.mark.parametrize("interval,enabled", [(None, False), (0.01, True)])
+async def test_loop_lag_handler(interval, enabled):
+    settings = {}
+    if interval is not None:
+        settings["ZYTE_API_LOOP_LAG_INTERVAL"] = interval
+    async with make_handler(settings) as handler:
+        assert (handler._loop_lag_monitor is not None) is enabled
+        await deferLater(reactor, 0.05, lambda: None)  # type: ignore[arg-type]
+        handler._update_stats()
+        stat = handler._stats.get_value("scrapy-zyte-api/loop_lag_seconds/max")
+        assert (stat is not None) is enabled
+    if enabled:
+        assert not handler._loop_lag_monitor._call
@@ -0,0 +1,204 @@
+import json
+from base64 import b64encode
+from typing import Any, Dict
+from unittest import mock
+
+import pytest
+from pytest_twisted import ensureDeferred
+from scrapy import Request
+from scrapy.utils.misc import create_instance
+from scrapy.utils.test import get_crawler
+from zyte_api.aio.errors import RequestError
+
+from scrapy_zyte_api._proxy_mode import _is_proxy_mode_eligible
+from scrapy_zyte_api.handler import ScrapyZyteAPIDownloadHandler
+from scrapy_zyte_api.responses import ZyteAPITextResponse
+
+from . import SETTINGS, make_handler
+from .mockserver import MockServer, ProxyModeResource
+
+
+@pytest.fixture(scope="module")
+def proxy_server():
+    with MockServer(ProxyModeResource) as server:
+        yield server
+
+
+@pytest.mark.parametrize(
+    "api_params,meta,expected",
+    [
+        ({"httpResponseBody": True, "httpResponseHeaders": True}, {}, True),
+        (
+            {
+                "httpResponseBody": True,
+                "httpResponseHeaders": True,
+                "httpRequestMethod": "POST",
+                "httpRequestBody": "YQ==",
+                "customHttpRequestHeaders": [{"name": "A", "value": "b"}],
+                "jobId": "1/2/3",
+            },
+            {},
+            True,
+        ),
+        (
+            {"httpResponseBody": True, "httpResponseHeaders": True},
+            {"zyte_api": {"httpResponseBody": True}},
+            False,
+        ),
+        ({"httpResponseBody": True}, {}, False),
+        ({"browserHtml": True}, {}, False),
+        (
+            {
+                "httpResponseBody": True,
+                "httpResponseHeaders": True,
+                "geolocation": "IE",
+            },
+            {},
+            False,
+        ),
+    ],
+)
+def test_eligible(api_params, meta, expected):
+    request = Request("https://example.com", meta=meta)
+    api_params = {"url": request.url, **api_params}
+    assert _is_proxy_mode_eligible(api_params, request, https=True) is expected
+
+
+@pytest.mark.parametrize(
+    "url,https,expected",
+    [
+        ("http://example.com", False, True),
+        ("https://example.com", False, False),
+        ("https://example.com", True, True),
+    ],
+)
+def test_eligible_https(url, https, expected):
+    """HTTPS URLs are only eligible if the CA certificate of Zyte API is
+    configured."""
+    request = Request(url)
+    api_params = {
+        "url": request.url,
+        "httpResponseBody": True,
+        "httpResponseHeaders": True,
+    }
+    assert _is_proxy_mode_eligible(api_params, request, https=https) is expected
+
+
+def test_ssl_context():
+    settings: Dict[str, Any] = {
+        **SETTINGS,
+        "ZYTE_API_PROXY_MODE": True,
+        "ZYTE_API_STATS_INTERVAL": 0,
+    }
+    crawler = get_crawler(settings_dict=settings)
+    with mock.patch("scrapy_zyte_api._proxy_mode.ssl") as ssl:
+        handler = create_instance(
+            ScrapyZyteAPIDownloadHandler, settings=None, crawler=crawler
+        )
+    assert handler._proxy_mode_url == "https://api.zyte.com:8014"
+    assert handler._proxy_mode_https is False
+    context = ssl.create_default_context.return_value
+    assert handler._proxy_mode_ssl_context is context
+    context.load_verify_locations.assert_not_called()
+
+    settings["ZYTE_API_PROXY_MODE_CA_CERT"] = "zyte-ca.crt"
+    crawler = get_crawler(settings_dict=settings)
+    with mock.patch("scrapy_zyte_api._proxy_mode.ssl") as ssl:
+        handler = create_instance(
+            ScrapyZyteAPIDownloadHandler, settings=None, crawler=crawler
+        )
+    assert handler._proxy_mode_https is True
+    context = ssl.create_default_context.return_value
+    context.load_verify_locations.assert_called_once_with(cafile="zyte-ca.crt")
+
+
+@ensureDeferred
+@pytest.mark.parametrize(
+    "method,body",
+    [
+        ("GET", b""),
+        ("POST", b"a=b"),
+    ],
+)
+async def test_proxy_mode(method, body, mockserver, proxy_server):
+    settings = {
+        "ZYTE_API_PROXY_MODE": True,
+        "ZYTE_API_PROXY_MODE_URL": proxy_server.root_url,
+        "ZYTE_API_TRANSPARENT_MODE": True,
+        "ZYTE_API_STATS_INTERVAL": 0,
+    }
+    async with make_handler(settings, mockserver.urljoin("/")) as handler:
+        request = Request(
+            "http://example.com/a",
+            method=method,
+            body=body,
+            headers={"Accept-Language": "en"},
+        )
+        response = await handler.download_request(request, None)
+        assert handler._stats.get_value("scrapy-zyte-api/proxy_mode") == 1
+        assert handler._stats.get_value("scrapy-zyte-api/success") == 1
+        assert handler._stats.get_value("scrapy-zyte-api/status_codes/200") == 1
+
+    assert isinstance(response, ZyteAPITextResponse)
+    assert response.status == 200
+    assert response.url == "http://example.com/a"
+    assert response.headers["Content-Type"] == b"application/json"
+    echo = json.loads(response.body)
+    assert echo["method"] == method
+    assert echo["url"] == "http://example.com/a"
+    assert echo["body"] == body.decode()
+    assert echo["headers"]["Accept-Language"] == "en"
+    assert echo["headers"]["Proxy-Authorization"] == "Basic YTo="
+    for header in ("Accept", "Accept-Encoding", "User-Agent"):
+        assert header not in echo["headers"]
+    assert response.raw_api_response is not None
+    assert response.raw_api_response["httpResponseBody"] == (
+        b64encode(response.body).decode()
+    )
+
+
+@ensureDeferred
+async def test_not_eligible(mockserver, proxy_server):
+    settings = {
+        "ZYTE_API_PROXY_MODE": True,
+        "ZYTE_API_PROXY_MODE_URL": proxy_server.root_url,
+    }
+    async with make_handler(settings, mockserver.urljoin("/")) as handler:
+        meta = {"zyte_api": {"httpResponseBody": True}}
+        request = Request("http://example.com/a", meta=meta)
+        response = await handler.download_request(request, None)
+        assert handler._stats.get_value("scrapy-zyte-api/proxy_mode") is None
+    assert response.body == b"<html><body>Hello<h1>World!</h1></body></html>"
+
+
+@ensureDeferred
+async def test_disabled(mockserver, proxy_server):
+    settings = {
+        "ZYTE_API_PROXY_MODE_URL": proxy_server.root_url,
+        "ZYTE_API_TRANSPARENT_MODE": True,
+    }
+    async with make_handler(settings, mockserver.urljoin("/")) as handler:
+        request = Request("http://example.com/a")
+        response = await handler.download_request(request, None)
+        assert handler._stats.get_value("scrapy-zyte-api/proxy_mode") is None
+    assert response.body == b"<html><body>Hello<h1>World!</h1></body></html>"
+
+
+@ensureDeferred
+async def test_error(mockserver, proxy_server, caplog):
+    settings = {
+        "ZYTE_API_PROXY_MODE": True,
+        "ZYTE_API_PROXY_MODE_URL": proxy_server.root_url,
+        "ZYTE_API_TRANSPARENT_MODE": True,
+        "ZYTE_API_STATS_INTERVAL": 0,
+    }
+    async with make_handler(settings, mockserver.urljoin("/")) as handler:
+        request = Request("http://example.com/error")
+        with pytest.raises(RequestError):
+            await handler.download_request(request, None)
+        stats = handler._stats
+        assert stats.get_value("scrapy-zyte-api/fatal_errors") == 1
+        assert stats.get_value("scrapy-zyte-api/status_codes/400") == 1
+        assert stats.get_value("scrapy-zyte-api/error_types/request/invalid") == 1
+    assert "type='/request/invalid'" in caplog.text
+    assert "Invalid request" in caplog.text
@@ -1,4 +1,5 @@
-from base64 import b64encode
+from base64 import b64decode, b64encode, encodebytes
+from unittest import mock
 
 import pytest
 from scrapy import Request
@@ -9,6 +10,7 @@ from scrapy_zyte_api.responses import (
     _API_RESPONSE,
     ZyteAPIResponse,
     ZyteAPITextResponse,
+    _b64decode,
     _process_response,
 )
 from scrapy_zyte_api.utils import _RESPONSE_HAS_IP_ADDRESS, _RESPONSE_HAS_PROTOCOL
@@ -166,6 +168,18 @@ def test_non_utf8_response():
     assert response.encoding == "utf-8"
 
 
+def test_browser_html_lazy_body():
+    """browserHtml is reused as the response text, and only encoded into
+    bytes when the response body is read."""
+    api_response = raw_api_response_browser()
+    response = ZyteAPITextResponse.from_api_response(api_response)
+    assert response.text is api_response["browserHtml"]
+    assert response._body == b""
+    assert response.body == EXPECTED_BODY
+    assert response.text is api_response["browserHtml"]
+    assert response.replace(url=URL).body == EXPECTED_BODY
+
+
 BODY = "<html><body>Hello<h1>World!✨</h1></body></html>"
 
 
@@ -367,6 +381,91 @@ def test__process_response_body_and_headers_mismatch():
     assert resp.encoding == "gb18030"
 
 
+@pytest.mark.parametrize(
+    "body,content_type,cls",
+    [
+        (BODY.encode(), "text/html", ZyteAPITextResponse),
+        (b"GIF89a\x00\x01", "image/gif", ZyteAPIResponse),
+    ],
+)
+def test__process_response_single_decode(body, content_type, cls):
+    """The HTTP response body must be base64-decoded only once, no matter
+    whether it is used for response type detection or not."""
+    api_response: _API_RESPONSE = {
+        "url": "https://example.com",
+        "httpResponseBody": b64encode(body).decode(),
+        "httpResponseHeaders": [{"name": "Content-Type", "value": content_type}],
+    }
+
+    with mock.patch("scrapy_zyte_api.responses.b64decode", wraps=b64decode) as decode:
+        resp = _process_response(api_response, Request(api_response["url"]))
+
+    assert decode.call_count == 1
+    assert isinstance(resp, cls)
+    assert resp.body == body
+
+
+@pytest.mark.parametrize(
+    "api_response,field",
+    [
+        (
+            {
+                "url": URL,
+                "httpResponseBody": format_to_httpResponseBody(BODY),
+                "httpResponseHeaders": [{"name": "Content-Type", "value": "text/html"}],
+            },
+            "httpResponseBody",
+        ),
+        (
+            {
+                "url": URL,
+                "httpResponseBody": b64encode(b"GIF89a\x00\x01").decode(),
+                "httpResponseHeaders": [{"name": "Content-Type", "value": "image/gif"}],
+            },
+            "httpResponseBody",
+        ),
+    ],
+)
+def test__process_response_lean(api_response, field):
+    """In lean mode, the raw API response field mapped into the response body
+    is dropped, and rebuilt when reading raw_api_response."""
+    expected = dict(api_response)
+    resp = _process_response(api_response, Request(URL), lean=True)
+    assert resp is not None
+    assert resp._raw_api_response is not None
+    assert field not in resp._raw_api_response
+    assert resp.raw_api_response == expected
+    assert resp.raw_api_response is resp._raw_api_response
+
+    new_resp = resp.replace(body=b"")
+    assert new_resp.raw_api_response == expected
+
+
+def test__process_response_lean_browser_html():
+    """browserHtml is never dropped, since it is shared with the unicode
+    body of the response instead of being stored twice."""
+    api_response: _API_RESPONSE = {
+        "url": URL,
+        "browserHtml": BODY,
+        "screenshot": "aGVsbG8=",
+    }
+    expected = dict(api_response)
+    resp = _process_response(api_response, Request(URL), lean=True)
+    assert resp is not None
+    assert resp._raw_api_response == expected
+    assert resp._raw_api_response["browserHtml"] is resp.text
+
+
+def test__process_response_lean_mixed():
+    """Only httpResponseBody is dropped."""
+    api_response = raw_api_response_mixed()
+    api_response["httpResponseBody"] = api_response["httpResponseBody"].decode()
+    expected = dict(api_response)
+    resp = _process_response(api_response, Request(URL), lean=True)
+    assert resp is not None
+    assert resp._raw_api_response == expected
+
+
 def test__process_response_non_text():
     """Non-textual responses like images, files, etc. won't have access to the
     css/xpath selectors.
@@ -437,3 +536,26 @@ def test_status_code(base_kwargs_func, kwargs, expected_status_code):
     response = _process_response(api_response, Request(api_response["url"]))
     assert response is not None
     assert response.status == expected_status_code
+
+
+@pytest.mark.parametrize(
+    "data,chunk_size",
+    [
+        (b"", None),
+        (b"", 4),
+        (bytes(range(256)) * 10, None),
+        (bytes(range(256)) * 10, 4),
+        (bytes(range(256)) * 10, 10),
+        (bytes(range(256)) * 10, 1024),
+        (bytes(range(256)) * 10, 10**6),
+    ],
+)
+def test_b64decode(data, chunk_size):
+    assert _b64decode(b64encode(data).decode(), chunk_size) == data
+
+
+def test_b64decode_line_breaks():
+    data = bytes(range(256)) * 10
+    encoded = encodebytes(data).decode()
+    assert "\n" in encoded
+    assert _b64decode(encoded, 10) == data
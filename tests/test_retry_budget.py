@@ -0,0 +1,110 @@
+import sys
+from unittest import mock
+
+import pytest
+from pytest_twisted import ensureDeferred
+from scrapy import Request
+from tenacity import (
+    AsyncRetrying,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_none,
+)
+
+from scrapy_zyte_api._retry_budget import _RetryBudget
+
+from . import make_handler
+
+RETRY_POLICY = AsyncRetrying(
+    retry=retry_if_exception_type(ValueError),
+    stop=stop_after_attempt(3),
+    wait=wait_none(),
+    reraise=True,
+)
+
+
+def test_invalid_ratio():
+    with pytest.raises(ValueError):
+        _RetryBudget(-0.1)
+
+
+def test_tokens():
+    budget = _RetryBudget(0.5, max_tokens=2)
+    assert budget.withdraw()
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert budget.withdraw()
+    for _ in range(10):
+        budget.deposit()
+    assert budget.tokens == 2
+    assert (budget.retries, budget.denied) == (3, 2)
+
+
+def test_wrap():
+    budget = _RetryBudget(0.1)
+    wrapped = budget.wrap(RETRY_POLICY)
+    assert wrapped is not RETRY_POLICY
+    assert budget.wrap(RETRY_POLICY) is wrapped
+
+
+@ensureDeferred
+async def test_wrapped_policy():
+    budget = _RetryBudget(0, max_tokens=3)
+    attempts = 0
+
+    async def fail():
+        nonlocal attempts
+        attempts += 1
+        raise ValueError
+
+    retrying = budget.wrap(RETRY_POLICY)
+    for expected_attempts in (3, 5, 6):
+        with pytest.raises(ValueError):
+            await retrying.wraps(fail)()
+        assert attempts == expected_attempts
+    assert (budget.retries, budget.denied) == (3, 2)
+
+
+@ensureDeferred
+@pytest.mark.skipif(sys.version_info < (3, 8), reason="unittest.mock.AsyncMock")
+@pytest.mark.parametrize(
+    "budget,attempts,retries,denied",
+    [
+        (None, 6, None, None),
+        (0, 4, 2, 1),
+        (1, 5, 3, 1),
+    ],
+)
+async def test_handler(budget, attempts, retries, denied, caplog):
+    settings = {
+        "ZYTE_API_RETRY_POLICY": "tests.test_retry_budget.RETRY_POLICY",
+        "ZYTE_API_RETRY_BUDGET_MAX_TOKENS": 2,
+        "ZYTE_API_STATS_INTERVAL": 0,
+    }
+    if budget is not None:
+        settings["ZYTE_API_RETRY_BUDGET"] = budget
+    async with make_handler(settings) as handler:
+        handler._client = mock.AsyncMock(handler._client)
+        actual_attempts = 0
+
+        async def request_raw(api_params, *, retrying, **kwargs):
+            async def request():
+                nonlocal actual_attempts
+                actual_attempts += 1
+                raise ValueError
+
+            return await retrying.wraps(request)()
+
+        handler._client.request_raw.side_effect = request_raw
+        for _ in range(2):
+            request = Request("https://example.com", meta={"zyte_api": {}})
+            with pytest.raises(ValueError):
+                await handler.download_request(request, None)
+        assert actual_attempts == attempts
+        stats = handler._stats
+        assert stats.get_value("scrapy-zyte-api/retry_budget/retries") == retries
+        assert stats.get_value("scrapy-zyte-api/retry_budget/denied") == denied
+        assert ("retry budget is exhausted" in caplog.text) is bool(denied)
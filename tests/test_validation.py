@@ -0,0 +1,93 @@
+import sys
+from unittest import mock
+
+import pytest
+from pytest_twisted import ensureDeferred
+from scrapy import Request
+from scrapy.utils.test import get_crawler
+
+from scrapy_zyte_api._params import _ParamParser
+from scrapy_zyte_api._validation import _get_param_errors
+from scrapy_zyte_api.exceptions import ZyteAPIInvalidParamsError
+
+from . import make_handler
+
+
+@pytest.mark.parametrize(
+    "api_params,errors",
+    [
+        ({}, []),
+        ({"browserHtml": True, "screenshot": True}, []),
+        ({"httpResponseBody": True, "httpResponseHeaders": True}, []),
+        ({"browserHtml": True, "httpResponseBody": False}, []),
+        ({"unknownParam": "foo"}, []),
+        (
+            {"browserHtml": True, "httpResponseBody": True},
+            ["browserHtml and httpResponseBody cannot be combined"],
+        ),
+        (
+            {"screenshot": True, "httpResponseBody": True},
+            ["screenshot and httpResponseBody cannot be combined"],
+        ),
+        (
+            {"actions": [{"action": "scrollBottom"}], "httpResponseBody": True},
+            ["actions and httpResponseBody cannot be combined"],
+        ),
+        (
+            {"httpRequestBody": "Zm9v", "httpRequestText": "foo"},
+            ["httpRequestBody and httpRequestText cannot be combined"],
+        ),
+        (
+            {"browserHtml": "true"},
+            ["browserHtml must be a boolean, got 'true'"],
+        ),
+    ],
+)
+def test_get_param_errors(api_params, errors):
+    assert _get_param_errors(api_params) == errors
+
+
+@pytest.mark.parametrize(
+    "setting",
+    ["ZYTE_API_DEFAULT_PARAMS", "ZYTE_API_AUTOMAP_PARAMS"],
+)
+def test_startup(setting):
+    params = {"browserHtml": True, "httpResponseBody": True}
+    crawler = get_crawler(settings_dict={setting: params})
+    _ParamParser(crawler.settings)
+    crawler = get_crawler(
+        settings_dict={setting: params, "ZYTE_API_VALIDATE_PARAMS": True}
+    )
+    with pytest.raises(ValueError, match=setting):
+        _ParamParser(crawler.settings)
+
+
+@ensureDeferred
+@pytest.mark.skipif(sys.version_info < (3, 8), reason="unittest.mock.AsyncMock")
+@pytest.mark.parametrize("validate", [False, True])
+async def test_handler(validate):
+    settings = {"ZYTE_API_VALIDATE_PARAMS": validate}
+    async with make_handler(settings) as handler:
+        handler._client = mock.AsyncMock(handler._client)
+        handler._client.request_raw.return_value = {
+            "url": "https://example.com",
+            "browserHtml": "",
+        }
+        request = Request(
+            "https://example.com",
+            meta={"zyte_api": {"browserHtml": True, "httpResponseBody": True}},
+        )
+        if validate:
+            with pytest.raises(ZyteAPIInvalidParamsError):
+                await handler.download_request(request, None)
+        else:
+            await handler.download_request(request, None)
+        assert handler._client.request_raw.call_count == (0 if validate else 1)
+        assert handler._stats.get_value(
+            "scrapy-zyte-api/param_validation/rejected"
+        ) == (1 if validate else None)
+
+        # Valid requests are sent.
+        request = Request("https://example.com", meta={"zyte_api": {}})
+        await handler.download_request(request, None)
+        assert handler._client.request_raw.call_count == (1 if validate else 2)